@@ -0,0 +1,345 @@
+import hashlib
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from datos import (RUTA_INCIDENCIAS, directorio_almacen, leer_manifiesto, leer_partes,
+                   version_incidencias)
+from instrumentacion import medido, tramo
+
+COLUMNAS_CUBO = ['fecha_entrada_ayuntamiento', 'tema', 'barrio_localizacion', 'distrito_localizacion']
+
+
+# ----------------------------
+# Cubo de conteos barrio × tema × mes
+# ----------------------------
+@dataclass
+class CuboIncidencias:
+    """Conteos densos de incidencias por localización (barrio, distrito), tema y mes.
+
+    ``conteos[i, j, k]`` es el número de incidencias de la localización ``i``
+    (barrio ``barrios[barrio_de_loc[i]]`` del distrito ``distritos[distrito_de_loc[i]]``),
+    tema ``temas[j]`` y mes ``meses[k]``.
+    """
+    barrios: pd.Index
+    distritos: pd.Index
+    temas: pd.Index
+    meses: pd.DatetimeIndex
+    barrio_de_loc: np.ndarray
+    distrito_de_loc: np.ndarray
+    conteos: np.ndarray
+
+    # ------------ Selección ------------
+    def _indices_temas(self, temas):
+        if temas is None:
+            return slice(None)
+        return self.temas.get_indexer(list(temas))
+
+    def _por_barrio(self, matriz):
+        # Suma las filas de localizaciones que comparten barrio
+        resultado = np.zeros((len(self.barrios),) + matriz.shape[1:], dtype=np.int64)
+        np.add.at(resultado, self.barrio_de_loc, matriz)
+        return resultado
+
+    # ------------ Periodo ------------
+    def recortar(self, desde=None, hasta=None):
+        """Cubo de los meses de ``desde`` a ``hasta`` (incluidos), sin copiar los conteos.
+
+        Los límites se buscan con ``searchsorted`` en el eje ordenado de meses y el
+        recorte es una vista: el coste no depende del número de incidencias.
+        """
+        inicio = 0 if desde is None else self.meses.searchsorted(_mes(desde), side='left')
+        fin = len(self.meses) if hasta is None else self.meses.searchsorted(_mes(hasta), side='right')
+        if inicio == 0 and fin == len(self.meses):
+            return self
+        return replace(self, meses=self.meses[inicio:fin], conteos=self.conteos[:, :, inicio:fin])
+
+    def filtrar_distritos(self, distritos):
+        """Cubo con sólo las localizaciones de ``distritos`` (los índices de barrios y distritos no cambian)."""
+        indices = self.distritos.get_indexer(list(distritos))
+        if (indices < 0).any():
+            desconocidos = [d for d, i in zip(distritos, indices) if i < 0]
+            raise ValueError(f"Distritos desconocidos: {', '.join(map(str, desconocidos))}")
+        mascara = np.isin(self.distrito_de_loc, indices)
+        return replace(self, barrio_de_loc=self.barrio_de_loc[mascara], distrito_de_loc=self.distrito_de_loc[mascara],
+                       conteos=self.conteos[mascara])
+
+    # ------------ Consultas ------------
+    def conteo_por_barrio(self, temas=None):
+        conteos = self.conteos[:, self._indices_temas(temas), :].sum(axis=(1, 2), dtype=np.int64)
+        serie = pd.Series(self._por_barrio(conteos), index=self.barrios, name='conteo')
+        serie = serie[serie > 0].sort_values(ascending=False, kind='stable')
+        serie.index.name = 'barrio_localizacion'
+        return serie
+
+    def conteo_por_distrito(self, temas=None):
+        conteos = self.conteos[:, self._indices_temas(temas), :].sum(axis=(1, 2), dtype=np.int64)
+        resultado = np.bincount(self.distrito_de_loc, weights=conteos, minlength=len(self.distritos))
+        serie = pd.Series(resultado.astype(np.int64), index=self.distritos, name='conteo')
+        serie = serie[serie > 0].sort_values(ascending=False, kind='stable')
+        serie.index.name = 'distrito_localizacion'
+        return serie
+
+    def conteo_por_tema(self):
+        serie = pd.Series(self.conteos.sum(axis=(0, 2), dtype=np.int64), index=self.temas, name='conteo')
+        serie = serie[serie > 0].sort_values(ascending=False, kind='stable')
+        serie.index.name = 'tema'
+        return serie
+
+    def tabla_barrio_tema(self, temas=None):
+        """Tabla barrio × tema con los conteos (sólo barrios con alguna incidencia)."""
+        indices = self._indices_temas(temas)
+        columnas = self.temas if temas is None else pd.Index(list(temas), name='tema')
+        matriz = self._por_barrio(self.conteos[:, indices, :].sum(axis=2, dtype=np.int64))
+        tabla = pd.DataFrame(matriz, index=self.barrios, columns=columnas)
+        tabla = tabla[tabla.sum(axis=1) > 0]
+        tabla.index.name = 'barrio_localizacion'
+        tabla.columns.name = 'tema'
+        return tabla
+
+    def tablas_barrio_tema_anuales(self):
+        """Tabla barrio × tema de cada año, ``{año: tabla}``, con los barrios que tienen incidencias ese año."""
+        por_barrio = self._por_barrio(self.conteos)
+        anios = self.meses.year
+        tablas = {}
+        for anio in np.unique(anios):
+            tabla = pd.DataFrame(por_barrio[:, :, anios == anio].sum(axis=2), index=self.barrios, columns=self.temas)
+            tabla = tabla[tabla.sum(axis=1) > 0]
+            tabla.index.name = 'barrio_localizacion'
+            tabla.columns.name = 'tema'
+            tablas[int(anio)] = tabla
+        return tablas
+
+    def pares_barrio_distrito(self):
+        """Pares (barrio, distrito) observados, uno por localización."""
+        return pd.DataFrame({'barrio_localizacion': self.barrios[self.barrio_de_loc],
+                             'distrito_localizacion': self.distritos[self.distrito_de_loc]})
+
+    def conteos_barrio_tema_mes(self):
+        """Conteos agregados por barrio: array (barrio, tema, mes)."""
+        return self._por_barrio(self.conteos)
+
+    def serie_mensual(self, tema='TODOS', barrio='TODOS'):
+        """Serie mensual en formato Prophet (``ds``, ``y``), del primer al último mes con datos."""
+        conteos = self.conteos
+        if barrio != 'TODOS':
+            conteos = conteos[self.barrio_de_loc == self.barrios.get_loc(barrio)]
+        if tema != 'TODOS':
+            conteos = conteos[:, [self.temas.get_loc(tema)], :]
+        y = conteos.sum(axis=(0, 1), dtype=np.int64)
+
+        con_datos = np.flatnonzero(y)
+        if len(con_datos) == 0:
+            return pd.DataFrame({'ds': pd.DatetimeIndex([]), 'y': np.array([], dtype=np.int64)})
+        inicio, fin = con_datos[0], con_datos[-1] + 1
+        return pd.DataFrame({'ds': self.meses[inicio:fin], 'y': y[inicio:fin]})
+
+    # ------------ Huellas para invalidar resultados derivados ------------
+    # Los resultados derivados de las tablas (clusters, niveles de conflictividad)
+    # se indexan por la huella de sus datos de entrada: tras una ingesta sólo se
+    # recalculan aquellos cuya tabla ha cambiado de verdad. Los pronósticos hacen
+    # lo mismo con su serie de entrenamiento (prediccion.clave_pronostico).
+    def huella_tabla(self, temas=None):
+        tabla = self.tabla_barrio_tema(temas)
+        return _huella(tabla.index.to_numpy(str), tabla.columns.to_numpy(str), tabla.to_numpy())
+
+    def huella_tablas_anuales(self):
+        tablas = self.tablas_barrio_tema_anuales()
+        return _huella(np.array(list(tablas)), self.temas.to_numpy(str),
+                       *(a for tabla in tablas.values() for a in (tabla.index.to_numpy(str), tabla.to_numpy())))
+
+    # ------------ Combinación ------------
+    def sumar(self, otro):
+        """Cubo con los conteos de ambos cubos, sobre la unión de sus ejes."""
+        # Un cubo vacío (sin meses) no añade nada
+        if not len(otro.meses):
+            return self
+        if not len(self.meses):
+            return otro
+        barrios = self.barrios.union(otro.barrios)
+        distritos = self.distritos.union(otro.distritos)
+        temas = self.temas.union(otro.temas)
+        meses = pd.date_range(min(self.meses[0], otro.meses[0]), max(self.meses[-1], otro.meses[-1]), freq='MS')
+
+        def pares(cubo):
+            return (barrios.get_indexer(cubo.barrios[cubo.barrio_de_loc]).astype(np.int64) * len(distritos)
+                    + distritos.get_indexer(cubo.distritos[cubo.distrito_de_loc]))
+
+        pares_a, pares_b = pares(self), pares(otro)
+        todos = np.union1d(pares_a, pares_b)
+        conteos = np.zeros((len(todos), len(temas), len(meses)), dtype=np.int32)
+        for cubo, pares_cubo in ((self, pares_a), (otro, pares_b)):
+            filas = np.searchsorted(todos, pares_cubo)
+            columnas = temas.get_indexer(cubo.temas)
+            inicio = meses.get_loc(cubo.meses[0])
+            conteos[np.ix_(filas, columnas, np.arange(inicio, inicio + len(cubo.meses)))] += cubo.conteos
+
+        return CuboIncidencias(
+            barrios=barrios.rename('barrio_localizacion'),
+            distritos=distritos.rename('distrito_localizacion'),
+            temas=temas.rename('tema'),
+            meses=meses,
+            barrio_de_loc=(todos // len(distritos)).astype(np.int32),
+            distrito_de_loc=(todos % len(distritos)).astype(np.int32),
+            conteos=conteos,
+        )
+
+    def series_con_datos(self):
+        """Pares (tema, barrio) con alguna incidencia en el cubo."""
+        por_barrio = self._por_barrio(self.conteos.sum(axis=2, dtype=np.int64))
+        filas, columnas = np.nonzero(por_barrio)
+        return set(zip(self.temas[columnas], self.barrios[filas]))
+
+
+def _mes(fecha):
+    return pd.Timestamp(fecha).to_period('M').to_timestamp()
+
+
+def _huella(*arrays):
+    h = hashlib.sha1()
+    for array in arrays:
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()[:16]
+
+
+# ----------------------------
+# Construcción
+# ----------------------------
+def cubo_vacio():
+    """Cubo sin localizaciones, temas ni meses: el de un almacén sin incidencias."""
+    return CuboIncidencias(
+        barrios=pd.Index([], dtype=object, name='barrio_localizacion'),
+        distritos=pd.Index([], dtype=object, name='distrito_localizacion'),
+        temas=pd.Index([], dtype=object, name='tema'),
+        meses=pd.DatetimeIndex([], freq='MS'),
+        barrio_de_loc=np.empty(0, dtype=np.int32),
+        distrito_de_loc=np.empty(0, dtype=np.int32),
+        conteos=np.zeros((0, 0, 0), dtype=np.int32),
+    )
+
+
+def construir_cubo(df):
+    fechas = df['fecha_entrada_ayuntamiento']
+    if not fechas.notna().any():
+        return cubo_vacio()
+    meses = pd.date_range(fechas.min().to_period('M').to_timestamp(),
+                          fechas.max().to_period('M').to_timestamp(), freq='MS')
+    codigo_mes = ((fechas.dt.year - meses[0].year) * 12 + (fechas.dt.month - meses[0].month)).to_numpy()
+
+    # Ejes ordenados alfabéticamente para que cubos de distintas partes sean comparables
+    barrio, distrito, tema = (df[col].astype('category')
+                              for col in ('barrio_localizacion', 'distrito_localizacion', 'tema'))
+    barrio, distrito, tema = (c.cat.reorder_categories(sorted(c.cat.categories)) for c in (barrio, distrito, tema))
+    barrios, distritos, temas = barrio.cat.categories, distrito.cat.categories, tema.cat.categories
+
+    # Filas sin barrio, distrito o tema (NaN) no cuentan en el cubo
+    codigo_barrio = barrio.cat.codes.to_numpy(np.int64)
+    codigo_distrito = distrito.cat.codes.to_numpy(np.int64)
+    codigo_tema = tema.cat.codes.to_numpy(np.int64)
+    validas = (codigo_barrio >= 0) & (codigo_distrito >= 0) & (codigo_tema >= 0)
+
+    # Pares (barrio, distrito) observados -> eje de localizaciones
+    codigo_par = codigo_barrio[validas] * len(distritos) + codigo_distrito[validas]
+    pares, codigo_loc = np.unique(codigo_par, return_inverse=True)
+
+    plano = (codigo_loc * len(temas) + codigo_tema[validas]) * len(meses) + codigo_mes[validas]
+    conteos = np.bincount(plano, minlength=len(pares) * len(temas) * len(meses))
+
+    return CuboIncidencias(
+        barrios=pd.Index(barrios, name='barrio_localizacion'),
+        distritos=pd.Index(distritos, name='distrito_localizacion'),
+        temas=pd.Index(temas, name='tema'),
+        meses=meses,
+        barrio_de_loc=(pares // len(distritos)).astype(np.int32),
+        distrito_de_loc=(pares % len(distritos)).astype(np.int32),
+        conteos=conteos.reshape(len(pares), len(temas), len(meses)).astype(np.int32),
+    )
+
+
+# ----------------------------
+# Persistencia y actualización incremental
+# ----------------------------
+# El cubo se guarda junto al almacén columnar con la lista de partes que ya
+# contiene; al llegar partes nuevas (cola del CSV o deltas) sólo se agregan esas.
+def ruta_cubo(ruta):
+    return directorio_almacen(ruta) / "cubo.npz"
+
+
+def guardar_cubo(cubo, ruta, partes):
+    destino = ruta_cubo(ruta)
+    temporal = destino.with_name("cubo.tmp.npz")
+    np.savez(temporal,
+             barrios=cubo.barrios.to_numpy(str), distritos=cubo.distritos.to_numpy(str),
+             temas=cubo.temas.to_numpy(str), meses=cubo.meses.to_numpy('datetime64[M]'),
+             barrio_de_loc=cubo.barrio_de_loc, distrito_de_loc=cubo.distrito_de_loc,
+             conteos=cubo.conteos, partes=np.array(partes, dtype=str))
+    temporal.replace(destino)
+
+
+@medido("cargar cubo")
+def cargar_cubo(ruta):
+    """Devuelve ``(cubo, partes)`` guardados, o ``(None, [])`` si no hay cubo en disco."""
+    try:
+        with np.load(ruta_cubo(ruta)) as datos:
+            cubo = CuboIncidencias(
+                barrios=pd.Index(datos['barrios'], dtype=object, name='barrio_localizacion'),
+                distritos=pd.Index(datos['distritos'], dtype=object, name='distrito_localizacion'),
+                temas=pd.Index(datos['temas'], dtype=object, name='tema'),
+                meses=pd.DatetimeIndex(datos['meses'].astype('datetime64[ns]'), freq='MS'),
+                barrio_de_loc=datos['barrio_de_loc'],
+                distrito_de_loc=datos['distrito_de_loc'],
+                conteos=datos['conteos'],
+            )
+            return cubo, list(datos['partes'])
+    except (OSError, KeyError, ValueError):
+        return None, []
+
+
+def cubo_de_partes(ruta, partes):
+    """Cubo de las ``partes`` del almacén, agregadas de una en una.
+
+    Sólo se lee una parte cada vez (y sólo las columnas del cubo): la memoria
+    depende del tamaño de las partes y del cubo, no del total de incidencias.
+    """
+    cubo = None
+    for parte in partes:
+        df = leer_partes(ruta, [parte], COLUMNAS_CUBO)
+        if len(df):
+            with tramo("construir cubo", filas=len(df)):
+                cubo = construir_cubo(df) if cubo is None else cubo.sumar(construir_cubo(df))
+    return cubo if cubo is not None else cubo_vacio()
+
+
+def actualizar_cubo(ruta=RUTA_INCIDENCIAS):
+    """Pone el cubo guardado al día con el almacén, agregando sólo las partes nuevas.
+
+    Devuelve ``(cubo, cambios)``, donde ``cambios`` son los pares (tema, barrio) que
+    han recibido incidencias nuevas, o ``None`` si el cubo se ha reconstruido entero.
+    """
+    manifiesto = leer_manifiesto(ruta)
+    cubo, partes = cargar_cubo(ruta)
+
+    if cubo is not None and set(partes) <= set(manifiesto['partes']):
+        nuevas = [parte for parte in manifiesto['partes'] if parte not in partes]
+        if not nuevas:
+            return cubo, set()
+        delta = cubo_de_partes(ruta, nuevas)
+        cubo, cambios = cubo.sumar(delta), delta.series_con_datos()
+    else:
+        cubo, cambios = cubo_de_partes(ruta, manifiesto['partes']), None
+
+    guardar_cubo(cubo, ruta, manifiesto['partes'])
+    return cubo, cambios
+
+
+@st.cache_resource(show_spinner="Agregando incidencias...", max_entries=2)
+def _cubo_version(ruta, version):
+    cubo, _ = actualizar_cubo(ruta)
+    return cubo
+
+
+def obtener_cubo(ruta=RUTA_INCIDENCIAS):
+    """Cubo de conteos de la versión actual de los datos, compartido entre páginas y sesiones."""
+    return _cubo_version(*version_incidencias(ruta))
@@ -0,0 +1,350 @@
+"""API HTTP de sólo lectura sobre los agregados de la app.
+
+Uso (desde la raíz del repositorio), junto a la app:
+
+    python app/api.py [--host 127.0.0.1] [--puerto 8502]
+
+Sirve en JSON los mismos resultados que calculan las páginas, leídos del cubo
+de conteos y de los centroides que guarda la app en data/cache, sin ejecutar
+ningún script de Streamlit ni escribir nada en disco:
+
+    GET /                 datos servidos: versión, meses, temas y distritos
+    GET /conteos          incidencias e incidencias por 1000 habitantes (``nivel=barrio|distrito``)
+    GET /clusters         clúster de cada barrio (``k``, por defecto 4), como en 2_Clustering.py
+    GET /conflictividad   nivel de conflictividad de cada barrio, como en la página 3
+
+Filtros: ``desde`` y ``hasta`` (``AAAA-MM``, como el selector de periodo),
+``tema`` (repetible; no en /clusters, que usa el perfil de todos los temas) y
+``distrito`` (repetible, con cualquier grafía). En /clusters y
+/conflictividad el distrito sólo filtra las filas: los clústeres y los
+niveles se calculan con toda la ciudad, como en las páginas.
+
+Cada respuesta lleva un ETag que depende de los datos y de la consulta; con
+``If-None-Match`` se responde 304 sin calcular nada. Los cuerpos ya
+serializados quedan en la caché de resultados (cache_memoria.py).
+"""
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from agregados import CuboIncidencias, cargar_cubo, ruta_cubo
+from cache_memoria import en_memoria
+from clustering import (K_MAXIMO, K_POR_DEFECTO, ajustar_clustering, consultar_clustering_historico,
+                        tabla_proporciones)
+from conflictividad import preparar_datos_conflictividad
+from datos import RUTA_BARRIOS, RUTA_DISTRITOS, RUTA_INCIDENCIAS, alias_localizaciones
+from geometria import indice_nombres, propiedad_numerica, version_fichero
+from normalizacion import normalizar_localizacion
+
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+PUERTO = 8502
+
+# Parámetros que admite cada recurso
+PARAMETROS = {
+    '/': set(),
+    '/conteos': {'nivel', 'desde', 'hasta', 'tema', 'distrito'},
+    '/clusters': {'k', 'desde', 'hasta', 'distrito'},
+    '/conflictividad': {'desde', 'hasta', 'tema', 'distrito'},
+}
+_MES = re.compile(r"^\d{4}-\d{2}$")
+
+
+class ConsultaInvalida(ValueError):
+    pass
+
+
+# ----------------------------
+# Datos servidos
+# ----------------------------
+@dataclass
+class Datos:
+    """Cubo guardado por la app, con la huella de las partes que contiene."""
+    cubo: CuboIncidencias
+    huella: str
+
+
+@functools.lru_cache(maxsize=1)
+def _leer_datos(ruta, mtime_ns):
+    cubo, partes = cargar_cubo(ruta)
+    if cubo is None:
+        return None
+    huella = hashlib.sha1("\n".join(sorted(partes)).encode('utf-8')).hexdigest()[:16]
+    return Datos(cubo, huella)
+
+
+def datos_actuales(ruta=RUTA_INCIDENCIAS):
+    """Cubo que ha guardado la app, releído sólo cuando cambia; ``None`` si aún no hay ninguno.
+
+    No sincroniza el almacén ni reescribe el cubo: eso lo hacen la app y
+    precalculo.py.
+    """
+    try:
+        mtime_ns = ruta_cubo(ruta).stat().st_mtime_ns
+    except OSError:
+        return None
+    return _leer_datos(str(ruta), mtime_ns)
+
+
+@functools.lru_cache(maxsize=4)
+def _poblacion_version(ruta, mtime_ns, tamano):
+    with open(ruta, "r", encoding="utf-8") as f:
+        geojson = json.load(f)
+    poblacion = pd.Series(propiedad_numerica(geojson, 'poblacion', np.nan), index=indice_nombres(ruta).claves)
+    return poblacion[poblacion.index != ''].groupby(level=0).first()
+
+
+def poblacion_por_nombre(ruta):
+    """Población de cada nombre canónico del GeoJSON ``ruta`` (NaN si la feature no la trae)."""
+    return _poblacion_version(*version_fichero(ruta))
+
+
+# ----------------------------
+# Consultas
+# ----------------------------
+def _unico(parametros, nombre, defecto=None):
+    valores = parametros.get(nombre, ())
+    if len(valores) > 1:
+        raise ConsultaInvalida(f"'{nombre}' sólo admite un valor")
+    return valores[0] if valores else defecto
+
+
+def _cubo_filtrado(datos, parametros):
+    desde, hasta = _unico(parametros, 'desde'), _unico(parametros, 'hasta')
+    for mes in (desde, hasta):
+        if mes is not None and not (_MES.match(mes) and 1 <= int(mes[5:]) <= 12):
+            raise ConsultaInvalida(f"Mes no válido: '{mes}' (formato AAAA-MM)")
+    return datos.cubo.recortar(desde, hasta)
+
+
+def _temas(cubo, parametros):
+    temas = list(parametros.get('tema', ()))
+    desconocidos = [tema for tema in temas if tema not in cubo.temas]
+    if desconocidos:
+        raise ConsultaInvalida(f"Temas desconocidos: {', '.join(desconocidos)}")
+    return temas or None
+
+
+def _distritos(parametros):
+    alias = alias_localizaciones()
+    distritos = [normalizar_localizacion(valor, alias) or valor for valor in parametros.get('distrito', ())]
+    return distritos or None
+
+
+def _filas(df):
+    # NaN -> null y tipos de numpy -> tipos de JSON
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+def consultar_indice(datos, parametros):
+    cubo = datos.cubo
+    # Primer y último mes con datos; lista vacía si el cubo no tiene incidencias
+    meses = [cubo.meses[0].strftime("%Y-%m"), cubo.meses[-1].strftime("%Y-%m")] if len(cubo.meses) else []
+    return {'meses': meses,
+            'temas': list(cubo.temas), 'distritos': list(cubo.distritos),
+            'recursos': {recurso: sorted(admitidos) for recurso, admitidos in PARAMETROS.items()}}
+
+
+def consultar_conteos(datos, parametros):
+    """Incidencias por barrio o distrito y por 1000 habitantes, como en el mapa de app.py."""
+    nivel = _unico(parametros, 'nivel', 'barrio')
+    if nivel not in ('barrio', 'distrito'):
+        raise ConsultaInvalida("'nivel' debe ser 'barrio' o 'distrito'")
+    cubo = _cubo_filtrado(datos, parametros)
+    temas = _temas(cubo, parametros)
+    distritos = _distritos(parametros)
+    if distritos:
+        try:
+            cubo = cubo.filtrar_distritos(distritos)
+        except ValueError as error:
+            raise ConsultaInvalida(str(error)) from None
+
+    if nivel == 'barrio':
+        conteos, poblacion = cubo.conteo_por_barrio(temas), poblacion_por_nombre(RUTA_BARRIOS)
+    else:
+        conteos, poblacion = cubo.conteo_por_distrito(temas), poblacion_por_nombre(RUTA_DISTRITOS)
+    conteos = conteos.rename(index=str).astype(int)
+    tabla = pd.DataFrame({nivel: conteos.index, 'conteo': conteos.to_numpy(),
+                          'poblacion': poblacion.reindex(conteos.index).to_numpy()})
+    # Sin población conocida (sin polígono o sin la propiedad) la tasa va a null, no dividida por 1 como
+    # hace el mapa
+    tabla['incidencias_per_1000hab'] = (tabla['conteo'] * 1000 / tabla['poblacion']).where(tabla['poblacion'] > 0)
+    tabla.loc[tabla['poblacion'] == 0, 'incidencias_per_1000hab'] = 0.0
+    tabla['incidencias_per_1000hab'] = tabla['incidencias_per_1000hab'].round(2)
+    return {'filas': _filas(tabla)}
+
+
+def _distrito_de_barrio(cubo):
+    pares = cubo.pares_barrio_distrito().astype(str)
+    return pares.groupby('barrio_localizacion')['distrito_localizacion'].first()
+
+
+def _solo_distritos(tabla, distritos):
+    if not distritos:
+        return tabla
+    desconocidos = sorted(set(distritos) - set(tabla['distrito']))
+    if desconocidos:
+        raise ConsultaInvalida(f"Distritos sin barrios: {', '.join(desconocidos)}")
+    return tabla[tabla['distrito'].isin(distritos)]
+
+
+def consultar_clusters(datos, parametros):
+    """Clúster (desde 1) de cada barrio con el K-Means del perfil temático, como en 2_Clustering.py.
+
+    Sobre el histórico completo continúa desde los centroides guardados por la
+    app, como la página, pero sin reescribirlos; con un periodo es el ajuste
+    de semilla fija. Ninguno de los dos depende de cuándo se consulte, así que
+    un mismo ETag corresponde siempre al mismo cuerpo.
+    """
+    try:
+        k = int(_unico(parametros, 'k', K_POR_DEFECTO))
+    except ValueError:
+        raise ConsultaInvalida("'k' debe ser un entero") from None
+    if not 2 <= k <= K_MAXIMO:
+        raise ConsultaInvalida(f"'k' debe estar entre 2 y {K_MAXIMO}")
+    cubo = _cubo_filtrado(datos, parametros)
+    tabla_pct = tabla_proporciones(cubo)
+    # Periodo vacío (o invertido) o con tan pocos barrios que K-Means no puede formar k clústeres
+    if not len(tabla_pct):
+        raise ConsultaInvalida("No hay incidencias en el periodo")
+    if len(tabla_pct) <= k:
+        raise ConsultaInvalida(f"'k' debe ser menor que el número de barrios con incidencias "
+                               f"en el periodo ({len(tabla_pct)})")
+
+    if cubo is datos.cubo:
+        resultado = consultar_clustering_historico(cubo, k)
+    else:
+        resultado = ajustar_clustering(tabla_pct, k)
+
+    etiquetas = resultado.etiquetas.rename(index=str)
+    tabla = pd.DataFrame({'barrio': etiquetas.index,
+                          'distrito': etiquetas.index.map(_distrito_de_barrio(cubo)),
+                          'cluster': etiquetas.to_numpy() + 1})
+    return {'k': k, 'filas': _filas(_solo_distritos(tabla, _distritos(parametros)))}
+
+
+def consultar_conflictividad(datos, parametros):
+    """Total de incidencias y nivel de conflictividad (terciles) de cada barrio, como en la página 3."""
+    cubo = _cubo_filtrado(datos, parametros)
+    temas = _temas(cubo, parametros) or sorted(cubo.conteo_por_tema().index)
+    try:
+        tabla = preparar_datos_conflictividad(cubo, temas)
+    except ValueError as error:
+        # pd.qcut no puede formar terciles con tan pocos barrios o totales repetidos
+        raise ConsultaInvalida(f"No se pueden calcular los niveles: {error}") from None
+    tabla = tabla.rename(index=str)
+    tabla = pd.DataFrame({'barrio': tabla.index,
+                          'distrito': tabla.index.map(_distrito_de_barrio(cubo)),
+                          'total_incidencias': tabla['total_incidencias'].to_numpy(),
+                          'nivel_conflictividad': tabla['nivel_conflictividad'].astype(str).to_numpy()})
+    return {'temas': temas, 'filas': _filas(_solo_distritos(tabla, _distritos(parametros)))}
+
+
+CONSULTAS = {
+    '/': consultar_indice,
+    '/conteos': consultar_conteos,
+    '/clusters': consultar_clusters,
+    '/conflictividad': consultar_conflictividad,
+}
+
+
+# ----------------------------
+# Respuestas
+# ----------------------------
+def normalizar_parametros(recurso, consulta):
+    """Parámetros de la URL como tupla ordenada ``((nombre, (valores...)), ...)``, que sirve de clave."""
+    parametros = parse_qs(consulta, keep_blank_values=False)
+    sobrantes = set(parametros) - PARAMETROS[recurso]
+    if sobrantes:
+        raise ConsultaInvalida(f"Parámetros no admitidos en {recurso}: {', '.join(sorted(sobrantes))}")
+    return tuple(sorted((nombre, tuple(sorted(valores))) for nombre, valores in parametros.items()))
+
+
+def etag(datos, recurso, parametros):
+    clave = json.dumps([datos.huella, recurso, parametros], ensure_ascii=False)
+    return '"' + hashlib.sha1(clave.encode('utf-8')).hexdigest()[:20] + '"'
+
+
+@en_memoria("api")
+def _cuerpo(huella, recurso, parametros, _datos):
+    resultado = CONSULTAS[recurso](_datos, dict(parametros))
+    return json.dumps({'datos': huella, 'recurso': recurso, 'parametros': dict(parametros), **resultado},
+                      ensure_ascii=False).encode('utf-8')
+
+
+class ManejadorApi(BaseHTTPRequestHandler):
+    server_version = "IncidenciasAPI/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        recurso = url.path.rstrip('/') or '/'
+        if recurso not in CONSULTAS:
+            return self._json(HTTPStatus.NOT_FOUND, {'error': f"Recurso desconocido: {recurso}",
+                                                     'recursos': sorted(CONSULTAS)})
+        datos = datos_actuales()
+        if datos is None:
+            return self._json(HTTPStatus.SERVICE_UNAVAILABLE,
+                              {'error': "Aún no hay cubo de conteos: abre la app o ejecuta app/precalculo.py"})
+        try:
+            parametros = normalizar_parametros(recurso, url.query)
+            etiqueta = etag(datos, recurso, parametros)
+            if etiqueta in [e.strip() for e in self.headers.get('If-None-Match', '').split(',')]:
+                return self._responder(HTTPStatus.NOT_MODIFIED, etiqueta=etiqueta)
+            cuerpo = _cuerpo(datos.huella, recurso, parametros, datos)
+        except ConsultaInvalida as error:
+            return self._json(HTTPStatus.BAD_REQUEST, {'error': str(error)})
+        except Exception:
+            logger.exception("Error al responder %s", self.path)
+            return self._json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Error interno"})
+        self._responder(HTTPStatus.OK, cuerpo, etiqueta)
+
+    def _json(self, estado, contenido):
+        self._responder(estado, json.dumps(contenido, ensure_ascii=False).encode('utf-8'))
+
+    def _responder(self, estado, cuerpo=b"", etiqueta=None):
+        self.send_response(estado)
+        if etiqueta is not None:
+            self.send_header("ETag", etiqueta)
+            # Se puede guardar, pero hay que revalidarla: los datos cambian con cada ingesta
+            self.send_header("Cache-Control", "no-cache")
+        if estado != HTTPStatus.NOT_MODIFIED:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        if cuerpo:
+            self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        logger.info("%s - " + formato, self.address_string(), *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API JSON de sólo lectura sobre los agregados de incidencias")
+    parser.add_argument("--host", default=HOST, help="interfaz en la que escuchar (por defecto sólo local)")
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    servidor = ThreadingHTTPServer((args.host, args.puerto), ManejadorApi)
+    logger.info("API en http://%s:%d/", args.host, args.puerto)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
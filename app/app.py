@@ -1,15 +1,20 @@
 import streamlit as st
-import pandas as pd
-import json
-import matplotlib.pyplot as plt
-import folium
-from folium import Choropleth, GeoJson, GeoJsonTooltip
-from streamlit_folium import st_folium
+import numpy as np
+
+from agregados import obtener_cubo
+from arranque import precalentar
+from geometria import asignar_propiedades, claves_features, propiedad_numerica
+from graficos import tarta_temas
+from instrumentacion import iniciar_instrumentacion, tramo
+from mapas import avisar_sin_geometria, mapa_distritos_con_detalle
+from periodo import cubo_del_periodo
 
 # ----------------------------
 # Configuración de página
 # ----------------------------
 st.set_page_config(page_title="Incidencias en Valencia", layout="wide")
+precalentar()  # la primera visita del proceso llena las cachés en segundo plano
+iniciar_instrumentacion("Inicio")
 
 st.title("📍 Análisis Exploratorio de Incidencias Urbanas en Valencia")
 st.markdown("""
@@ -19,100 +24,89 @@ Esta sección presenta un análisis exploratorio de los datos de incidencias ciu
 # ----------------------------
 # Cargar datos
 # ----------------------------
-df = pd.read_csv("./app/data/total-castellano.csv", sep=';')
-df = df.drop(columns=['distrito_solicitante', 'barrio_solicitante'], errors='ignore')
-df = df[df['barrio_localizacion'] != 'En dependencias municipales']
-
-# Mayúsculas para consistencia
-df['barrio_localizacion'] = df['barrio_localizacion'].str.upper()
-df['distrito_localizacion'] = df['distrito_localizacion'].str.upper()
-
-# Filtrar valores no válidos
-no_validos = ['NO CONSTA', 'NO HI CONSTA', 'FORA DE VALÈNCIA', 'FORA  DE VALÈNCIA',
-              'FUERA DE VALÈNCIA', 'EN DEPENDENCIAS MUNICIPALES']
-df = df[
-    (~df['distrito_localizacion'].isin(no_validos)) &
-    (~df['barrio_localizacion'].isin(no_validos))
-]
+with tramo("cubo", cache=True):
+    cubo, _ = cubo_del_periodo(obtener_cubo())
 
 # ----------------------------
-# Cargar GeoJSON
+# Contar incidencias por barrio y por distrito
 # ----------------------------
-with open("./app/data/barris-barrios.geojson", "r", encoding="utf-8") as f:
-    geojson_data = json.load(f)
+# Series indexadas por el nombre canónico, el mismo que lleva cada feature en 'clave'
+with tramo("conteos por barrio y distrito"):
+    conteo_barrios = cubo.conteo_por_barrio().rename(index=str).astype(int)
+    conteo_distritos = cubo.conteo_por_distrito().rename(index=str).astype(int)
 
 # ----------------------------
-# Contar incidencias por barrio
+# Preparar GeoJSON: métricas alineadas con las features de una vez
 # ----------------------------
-conteo_barrios = df['barrio_localizacion'].value_counts().reset_index()
-conteo_barrios.columns = ['nombre', 'conteo']
-conteo_barrios['nombre'] = conteo_barrios['nombre'].astype(str)
-conteo_barrios['conteo'] = conteo_barrios['conteo'].astype(int)
-
-# Crear diccionario de conteo
-conteo_dict = dict(zip(conteo_barrios['nombre'], conteo_barrios['conteo']))
+def preparar_geojson(geojson_data, conteos):
+    claves = claves_features(geojson_data)
+    conteo = conteos.reindex(claves, fill_value=0).to_numpy()
+    poblacion = propiedad_numerica(geojson_data, 'poblacion', 1).astype(int)
+    por_1000 = np.round(np.divide(conteo * 1000, poblacion, out=np.zeros(len(conteo)), where=poblacion > 0), 2)
+    return asignar_propiedades(geojson_data, {
+        'nombre': claves,
+        'poblacion': poblacion,
+        'conteo': conteo,
+        'incidencias_per_1000hab': por_1000,
+    })
 
 # ----------------------------
-# Limpiar y preparar GeoJSON (evitar errores de serialización)
+# Capas del mapa
 # ----------------------------
-for feature in geojson_data['features']:
-    props = feature['properties']
-    nombre = str(props.get('nombre', '')).upper()
-
-    poblacion = props.get('poblacion', 1)
-    try:
-        poblacion = int(poblacion) if poblacion not in [None, '', 'NA'] else 1
-    except:
-        poblacion = 1
-
-    conteo = conteo_dict.get(nombre, 0)
-    try:
-        conteo = int(conteo)
-    except:
-        conteo = 0
-
-    props['nombre'] = str(nombre)
-    props['poblacion'] = int(poblacion)
-    props['conteo'] = int(conteo)
-    props['incidencias_per_1000hab'] = round(conteo / poblacion * 1000, 2) if poblacion > 0 else 0.0
+# Una sola capa con el color del coroplético y el tooltip: la geometría viaja una vez
+color_sin_datos = '#8c8c8c'  # gris
+
+def capa_coropletica(nivel, conteos):
+    def anadir(m, geojson_data):
+        from branca.colormap import linear
+        from folium import GeoJson, GeoJsonTooltip
+
+        geojson_data = preparar_geojson(geojson_data, conteos)
+        maximo = max([f['properties']['conteo'] for f in geojson_data['features']] + [1])
+        escala_colores = linear.YlOrRd_09.scale(0, maximo).to_step(6)
+        escala_colores.caption = "Número de incidencias"
+
+        def style_function(feature):
+            conteo = feature['properties']['conteo']
+            return {
+                'fillColor': escala_colores(conteo) if conteo > 0 else color_sin_datos,
+                'color': 'black',
+                'weight': 1,
+                'opacity': 0.2,
+                'fillOpacity': 0.7
+            }
+
+        GeoJson(
+            geojson_data,
+            style_function=style_function,
+            tooltip=GeoJsonTooltip(
+                fields=["nombre", "conteo", "incidencias_per_1000hab"],
+                aliases=[nivel, "Incidencias", "Incidencias por 1000 hab."],
+                localize=True
+            )
+        ).add_to(m)
+        escala_colores.add_to(m)
+    return anadir
 
 # ----------------------------
 # Mapa Interactivo
 # ----------------------------
-st.subheader("🌍 Mapa interactivo de incidencias por barrio")
-
-m = folium.Map(location=[39.47, -0.38], zoom_start=12)
-
-Choropleth(
-    geo_data=geojson_data,
-    data=conteo_barrios,
-    columns=["nombre", "conteo"],
-    key_on="feature.properties.nombre",
-    fill_color="YlOrRd",
-    fill_opacity=0.7,
-    line_opacity=0.2,
-    legend_name="Número de incidencias"
-).add_to(m)
-
-GeoJson(
-    geojson_data,
-    tooltip=GeoJsonTooltip(
-        fields=["nombre", "conteo", "incidencias_per_1000hab"],
-        aliases=["Barrio", "Incidencias", "Incidencias por 1000 hab."],
-        localize=True
+st.subheader("🌍 Mapa interactivo de incidencias por distrito y barrio")
+
+with tramo("mapa"):
+    mapa_distritos_con_detalle(
+        "incidencias",
+        capa_distritos=capa_coropletica("Distrito", conteo_distritos),
+        capa_barrios=capa_coropletica("Barrio", conteo_barrios),
+        width=1000, height=500
     )
-).add_to(m)
-
-# ✅ Renderizar mapa
-st_folium(m, width=1000, height=500)
+avisar_sin_geometria(conteo_barrios.index, conteo_distritos.index)
 
 # ----------------------------
 # Gráfico de tarta por tema
 # ----------------------------
 st.subheader("🥧 Distribución de incidencias por tipo (Tema)")
 
-tema_counts = df['tema'].value_counts()
-fig2, ax2 = plt.subplots(figsize=(7, 7))
-ax2.pie(tema_counts, labels=tema_counts.index, autopct='%1.1f%%', startangle=90)
-ax2.axis('equal')
-st.pyplot(fig2)
+with tramo("gráfico de temas", cache=True):
+    tema_counts = cubo.conteo_por_tema()
+    st.image(tarta_temas(tema_counts), use_column_width=True)
@@ -0,0 +1,152 @@
+"""Arranque del servidor: precalentamiento de cachés e informe de tiempos de importación.
+
+Cada página llama a ``precalentar()`` al empezar. La primera llamada del
+proceso lanza un hilo que, mientras se dibuja esa página, llena las cachés de
+datos, del cubo y de la geometría e importa las librerías pesadas que las
+páginas cargan bajo demanda; las siguientes llamadas no hacen nada.
+
+Uso del informe (desde la raíz del repositorio):
+
+    python app/arranque.py [--limite SEGUNDOS] [--detalle N]
+
+Mide, en un intérprete nuevo por página, lo que tardan las importaciones de
+cabecera de cada una y cuáles pesan más. Con ``--limite`` termina con error si
+alguna página lo supera, para detectar regresiones en el arranque en frío.
+"""
+import argparse
+import ast
+import importlib
+import logging
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import streamlit as st
+
+DIRECTORIO_APP = Path(__file__).resolve().parent
+PAGINAS = [DIRECTORIO_APP / "app.py", *sorted((DIRECTORIO_APP / "pages").glob("*.py"))]
+
+# Librerías que las páginas importan al usarlas; el hilo de arranque las deja cargadas
+LIBRERIAS_PESADAS = ('folium', 'streamlit_folium', 'branca.colormap', 'matplotlib.figure',
+                     'matplotlib.backends.backend_agg', 'plotly.graph_objs', 'sklearn.cluster', 'sklearn.ensemble')
+
+logger = logging.getLogger(__name__)
+HILO_PRECALENTAR = "precalentar"
+
+
+class _SinContextoEnPrecalentamiento(logging.Filter):
+    # Las cachés avisan de que el hilo no pertenece a ninguna sesión: es lo esperado
+    def filter(self, registro):
+        return registro.threadName != HILO_PRECALENTAR
+
+
+logging.getLogger("streamlit.runtime.scriptrunner.script_run_context").addFilter(_SinContextoEnPrecalentamiento())
+
+
+# ----------------------------
+# Precalentamiento
+# ----------------------------
+def _pasos():
+    """Pasos del precalentamiento, ``(descripción, función)``, de lo que antes se necesita a lo que menos."""
+    from agregados import obtener_cubo
+    from geometria import RUTA_BARRIOS, RUTA_DISTRITOS, cargar_geojson, indice_nombres
+
+    pasos = [("cubo de conteos", obtener_cubo)]
+    for ruta in (RUTA_DISTRITOS, RUTA_BARRIOS):
+        pasos += [(f"GeoJSON {ruta.name}", lambda ruta=ruta: cargar_geojson(ruta)),
+                  (f"índice de nombres {ruta.name}", lambda ruta=ruta: indice_nombres(ruta))]
+    pasos += [(f"import {modulo}", lambda modulo=modulo: importlib.import_module(modulo))
+              for modulo in LIBRERIAS_PESADAS]
+    return pasos
+
+
+def _precalentar(tiempos):
+    for descripcion, paso in _pasos():
+        inicio = time.perf_counter()
+        try:
+            paso()
+        except Exception:
+            # Un paso fallido sólo significa que la página lo hará en vivo
+            logger.exception("Precalentamiento: falló %s", descripcion)
+            continue
+        tiempos[descripcion] = time.perf_counter() - inicio
+    logger.info("Precalentamiento terminado en %.1f s: %s", sum(tiempos.values()),
+                ", ".join(f"{d} {t:.2f} s" for d, t in tiempos.items()))
+
+
+@st.cache_resource(show_spinner=False)
+def precalentar():
+    """Lanza (una vez por proceso) el hilo de precalentamiento; devuelve los tiempos de cada paso según terminan."""
+    tiempos = {}
+    threading.Thread(target=_precalentar, args=(tiempos,), name=HILO_PRECALENTAR, daemon=True).start()
+    return tiempos
+
+
+# ----------------------------
+# Informe de tiempos de importación
+# ----------------------------
+def importaciones_de(fichero):
+    """Sentencias ``import`` de cabecera de ``fichero`` (hasta la primera que no lo es), como texto.
+
+    Las importaciones que vienen después, a mitad de página, se pagan cuando ya
+    hay contenido en pantalla y no cuentan para el arranque.
+    """
+    arbol = ast.parse(Path(fichero).read_text(encoding="utf-8"))
+    sentencias = []
+    for nodo in arbol.body:
+        if isinstance(nodo, (ast.Import, ast.ImportFrom)):
+            sentencias.append(ast.unparse(nodo))
+        elif not (isinstance(nodo, ast.Expr) and isinstance(nodo.value, ast.Constant)):
+            break
+    return sentencias
+
+
+def medir_importaciones(sentencias):
+    """``(segundos, {módulo: segundos acumulados})`` de ejecutar ``sentencias`` en un intérprete nuevo.
+
+    El detalle sale de ``-X importtime`` y recoge sólo los módulos importados
+    directamente (los de primer nivel de anidamiento).
+    """
+    codigo = "import time\n_t = time.perf_counter()\n" + "\n".join(sentencias) + \
+        "\nprint(time.perf_counter() - _t)"
+    salida = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo], cwd=DIRECTORIO_APP,
+                            capture_output=True, text=True, check=True)
+    modulos = {}
+    for linea in salida.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, acumulado, nombre = linea.split("|")
+        if acumulado.strip().isdigit() and not nombre.startswith("   "):
+            modulos[nombre.strip()] = int(acumulado) / 1e6
+    return float(salida.stdout.strip().splitlines()[-1]), modulos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempos de importación de cada página en frío")
+    parser.add_argument("--limite", type=float, help="segundos máximos por página; si se superan, sale con error")
+    parser.add_argument("--detalle", type=int, default=5, help="módulos más lentos a mostrar por página")
+    args = parser.parse_args()
+
+    # Streamlit lo importa el servidor antes que cualquier página: se descuenta
+    base, ya_cargados = medir_importaciones(["import streamlit"])
+    print(f"{'streamlit (base)':45s} {base:6.2f} s")
+    excedidas = []
+    for pagina in PAGINAS:
+        total, modulos = medir_importaciones(["import streamlit", *importaciones_de(pagina)])
+        propio = max(0.0, total - base)
+        print(f"{pagina.name:45s} {propio:6.2f} s")
+        lentos = sorted(((s, m) for m, s in modulos.items() if m not in ya_cargados), reverse=True)
+        for segundos, modulo in lentos[:args.detalle]:
+            print(f"    {modulo:41s} {segundos:6.2f} s")
+        if args.limite is not None and propio > args.limite:
+            excedidas.append(pagina.name)
+
+    if excedidas:
+        print(f"Superan el límite de {args.limite:.2f} s: {', '.join(excedidas)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
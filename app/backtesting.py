@@ -0,0 +1,182 @@
+"""Backtesting con origen móvil de los motores de pronóstico.
+
+Uso (desde la raíz del repositorio):
+
+    python app/backtesting.py [--motor ets] [--cortes 6] [--horizonte 6] [--procesos N]
+    python app/backtesting.py --motor prophet --max-series 300
+
+Para cada serie tema/barrio se ajusta el motor en varios cortes sucesivos
+(entrenando con los datos hasta el corte y evaluando los ``horizonte`` meses
+siguientes). Los ajustes se reparten entre procesos y la tabla de errores por
+serie, corte y horizonte se guarda en data/cache/backtesting para que la
+página de análisis temporal la muestre sin reajustar nada.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from agregados import actualizar_cubo
+from datos import DIRECTORIO_CACHE, RUTA_INCIDENCIAS, leer_manifiesto, sincronizar_almacen
+from instrumentacion import medido
+from prediccion import clave_pronostico, leer_o_ajustar
+from pronostico_vectorizado import METODOS, alinear_por_la_derecha, matriz_series, pronosticar_matriz
+
+DIRECTORIO_BACKTESTING = DIRECTORIO_CACHE / "backtesting"
+
+N_CORTES = 6
+HORIZONTE_BACKTEST = 6
+PASO = 1
+MIN_ENTRENAMIENTO = 12
+
+
+# ------------ Errores ------------
+def _tabla_errores(claves, corte, y_real, y_pred):
+    """Tabla larga (serie, corte, horizonte) a partir de matrices serie × horizonte."""
+    S, H = y_real.shape
+    errores = pd.DataFrame({
+        'tema': np.repeat([c[0] for c in claves], H),
+        'barrio': np.repeat([c[1] for c in claves], H),
+        'corte': np.repeat(corte, H),
+        'h': np.tile(np.arange(1, H + 1), S),
+        'y': y_real.ravel().astype(float),
+        'yhat': y_pred.ravel().astype(float),
+    })
+    errores['error_abs'] = (errores['y'] - errores['yhat']).abs()
+    errores['ape'] = errores['error_abs'] / np.maximum(errores['y'], 1) * 100
+    return errores
+
+
+def resumir(errores, por):
+    """MAE, RMSE y MAPE agrupados por las columnas ``por``, como en la página."""
+    return errores.groupby(por).agg(
+        MAE=('error_abs', 'mean'),
+        RMSE=('error_abs', lambda e: np.sqrt(np.mean(e ** 2))),
+        MAPE=('ape', 'mean'),
+        n=('error_abs', 'size'),
+    )
+
+
+# ------------ Motores vectorizados: un lote por corte ------------
+def _backtest_corte_vectorizado(X, claves, primero, ultimo, meses, metodo, k, horizonte, paso):
+    fin = ultimo + 1 - (horizonte + k * paso)
+    validas = np.flatnonzero((primero >= 0) & (fin - primero >= MIN_ENTRENAMIENTO))
+    if len(validas) == 0:
+        return None
+
+    Y, activo = alinear_por_la_derecha(X[validas], primero[validas], fin[validas])
+    yhat, _, _ = pronosticar_matriz(Y, activo, horizonte, metodo)
+    columnas = fin[validas, None] + np.arange(horizonte)[None, :]
+    y_real = np.take_along_axis(X[validas], columnas, axis=1)
+    return _tabla_errores([claves[s] for s in validas], meses[fin[validas] - 1], y_real, yhat[:, -horizonte:])
+
+
+# ------------ Prophet: una tarea por serie ------------
+def _backtest_serie_prophet(tema, barrio, df_prophet, cortes, horizonte, paso):
+    tablas = []
+    for k in range(cortes):
+        fin = len(df_prophet) - (horizonte + k * paso)
+        if fin < MIN_ENTRENAMIENTO:
+            break
+        df_train = df_prophet.iloc[:fin]
+        df_test = df_prophet.iloc[fin:fin + horizonte]
+
+        # Comparte la caché de pronósticos de la página (el último corte suele coincidir)
+        forecast = leer_o_ajustar(clave_pronostico(tema, barrio, df_train), df_train)
+        y_pred = forecast.set_index('ds').loc[df_test['ds'], 'yhat'].to_numpy()
+        tablas.append(_tabla_errores([(tema, barrio)], [df_train['ds'].iloc[-1]],
+                                     df_test['y'].to_numpy()[None, :], y_pred[None, :]))
+    return pd.concat(tablas) if tablas else None
+
+
+def backtest(cubo, motor, cortes=N_CORTES, horizonte=HORIZONTE_BACKTEST, paso=PASO,
+             procesos=None, max_series=None):
+    """Errores por serie, corte y horizonte del ``motor`` sobre todas las series del cubo."""
+    X, claves, primero, ultimo = matriz_series(cubo)
+
+    # Series con más incidencias primero, por si se limita su número
+    orden = np.argsort(-X.sum(axis=1), kind='stable')
+    orden = orden[primero[orden] >= 0][:max_series]
+
+    if motor == 'prophet':
+        tareas = [(_backtest_serie_prophet, *claves[s],
+                   pd.DataFrame({'ds': cubo.meses[primero[s]:ultimo[s] + 1], 'y': X[s, primero[s]:ultimo[s] + 1]}),
+                   cortes, horizonte, paso)
+                  for s in orden]
+    else:
+        seleccion = np.zeros(len(claves), dtype=bool)
+        seleccion[orden] = True
+        primero_sel = np.where(seleccion, primero, -1)
+        tareas = [(_backtest_corte_vectorizado, X, claves, primero_sel, ultimo, cubo.meses, motor, k, horizonte, paso)
+                  for k in range(cortes)]
+
+    # Con un solo proceso (p. ej. desde la página) no merece la pena crear el pool
+    if procesos == 1:
+        tablas = [funcion(*argumentos) for funcion, *argumentos in tareas]
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = [pool.submit(*tarea) for tarea in tareas]
+            tablas = [f.result() for f in futuros]
+
+    tablas = [t for t in tablas if t is not None]
+    if not tablas:
+        return pd.DataFrame()
+    errores = pd.concat(tablas, ignore_index=True)
+    errores.insert(0, 'motor', motor)
+    return errores
+
+
+# ------------ Resultados guardados ------------
+def _ruta_resultados(motor, version):
+    return DIRECTORIO_BACKTESTING / f"{motor}-{version}.arrow"
+
+
+def guardar_backtest(errores, motor, version):
+    destino = _ruta_resultados(motor, version)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_suffix('.tmp')
+    feather.write_feather(errores, str(temporal))
+    os.replace(temporal, destino)
+
+
+@medido("leer backtesting")
+def cargar_backtest(motor, version):
+    """Tabla de errores guardada para el motor y la versión de datos, o None."""
+    try:
+        return feather.read_feather(str(_ruta_resultados(motor, version)))
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtesting con origen móvil de los pronósticos")
+    parser.add_argument("--motor", default="rapidos", choices=['rapidos', 'todos', 'prophet', *METODOS],
+                        help="'rapidos': todos los motores vectorizados; 'todos': también Prophet")
+    parser.add_argument("--cortes", type=int, default=N_CORTES, help="número de orígenes")
+    parser.add_argument("--horizonte", type=int, default=HORIZONTE_BACKTEST, help="meses evaluados por corte")
+    parser.add_argument("--paso", type=int, default=PASO, help="meses entre orígenes consecutivos")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="procesos en paralelo")
+    parser.add_argument("--max-series", type=int, default=None, help="limitar a las N series con más datos")
+    parser.add_argument("--csv", default=str(RUTA_INCIDENCIAS), help="CSV principal de incidencias")
+    args = parser.parse_args()
+
+    sincronizar_almacen(args.csv)
+    cubo, _ = actualizar_cubo(args.csv)
+    version = leer_manifiesto(args.csv)['version']
+
+    motores = {'rapidos': list(METODOS), 'todos': ['prophet', *METODOS]}.get(args.motor, [args.motor])
+    for motor in motores:
+        errores = backtest(cubo, motor, args.cortes, args.horizonte, args.paso, args.procesos, args.max_series)
+        if errores.empty:
+            print(f"== {motor}: ninguna serie con datos suficientes")
+            continue
+        guardar_backtest(errores, motor, version)
+        print(f"== {motor}: {errores[['tema', 'barrio']].drop_duplicates().shape[0]} series")
+        print(resumir(errores, 'h').round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
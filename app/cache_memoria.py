@@ -0,0 +1,215 @@
+import functools
+import inspect
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# ----------------------------
+# Caché de resultados en memoria con presupuesto de bytes
+# ----------------------------
+# Los resultados derivados (pronósticos, modelos, clusterings, GeoJSON...) se
+# guardan en una sola caché compartida por todas las sesiones, con la clave
+# (espacio, argumentos): los argumentos ya llevan la versión de los datos o la
+# huella de la tabla de entrada. Cada entrada se guarda con su tamaño estimado
+# y, cuando el total supera el presupuesto, se expulsan las usadas hace más
+# tiempo. Las entradas caducan además a las TTL segundos. El presupuesto y la
+# TTL por defecto se configuran con variables de entorno, para ajustarlos al
+# límite de memoria del contenedor.
+VARIABLE_PRESUPUESTO = "INCIDENCIAS_CACHE_MB"
+VARIABLE_TTL = "INCIDENCIAS_CACHE_TTL"
+PRESUPUESTO_MB = float(os.environ.get(VARIABLE_PRESUPUESTO, 512))
+TTL_SEGUNDOS = float(os.environ.get(VARIABLE_TTL, 6 * 3600))
+
+
+# ------------ Tamaño estimado ------------
+def tamano_aproximado(valor, _vistos=None):
+    """Bytes que ocupa ``valor`` contando lo que cuelga de él (cada objeto una sola vez)."""
+    # Se guardan los objetos, no sólo su id: el estado que devuelve __getstate__ es
+    # temporal y, si se liberase, otro objeto podría reutilizar su id
+    vistos = {} if _vistos is None else _vistos
+    if id(valor) in vistos:
+        return 0
+    vistos[id(valor)] = valor
+
+    if isinstance(valor, (pd.DataFrame, pd.Series, pd.Index)):
+        uso = valor.memory_usage(deep=True)
+        return int(uso.sum() if isinstance(uso, pd.Series) else uso)
+    if isinstance(valor, np.ndarray):
+        # Una vista cuenta su array base (una sola vez); la de un búfer ajeno, sus propios bytes
+        if isinstance(valor.base, np.ndarray):
+            return sys.getsizeof(valor) + tamano_aproximado(valor.base, vistos)
+        return valor.nbytes
+    if isinstance(valor, (str, bytes, bytearray, int, float, bool, type(None))):
+        return sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamano_aproximado(k, vistos) + tamano_aproximado(v, vistos)
+                                          for k, v in valor.items())
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return sys.getsizeof(valor) + sum(tamano_aproximado(v, vistos) for v in valor)
+
+    # Objetos (dataclasses, modelos de sklearn...): sus atributos o, si no tienen
+    # (p. ej. los árboles de sklearn, de Cython), el estado con el que se serializan
+    try:
+        estado = vars(valor)
+    except TypeError:
+        estado = valor.__getstate__() if hasattr(valor, '__getstate__') else None
+    if isinstance(estado, (dict, tuple)):
+        return sys.getsizeof(valor) + tamano_aproximado(estado, vistos)
+    try:
+        return len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(valor)
+
+
+# ------------ Caché ------------
+@dataclass
+class Entrada:
+    valor: object
+    bytes: int
+    caduca: float
+
+
+class CacheMemoria:
+    """LRU con presupuesto de bytes y caducidad, con estadísticas por espacio."""
+
+    def __init__(self, presupuesto_mb=PRESUPUESTO_MB, ttl=TTL_SEGUNDOS):
+        self.presupuesto = int(presupuesto_mb * 1024 ** 2)
+        self.ttl = ttl
+        self.bytes = 0
+        self._entradas = OrderedDict()
+        self._bloqueo = threading.Lock()
+        self._calculando = {}
+        self._contadores = {}
+
+    def _contar(self, espacio, contador, n=1):
+        contadores = self._contadores.setdefault(
+            espacio, dict.fromkeys(['aciertos', 'fallos', 'expulsiones', 'caducadas', 'demasiado_grandes'], 0))
+        contadores[contador] += n
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave)
+        self.bytes -= entrada.bytes
+
+    def obtener(self, clave, contar=True):
+        """``(True, valor)`` si ``clave`` está y no ha caducado; si no, ``(False, None)``."""
+        with self._bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada.caduca <= time.monotonic():
+                self._quitar(clave)
+                self._contar(clave[0], 'caducadas')
+                entrada = None
+            if contar:
+                self._contar(clave[0], 'fallos' if entrada is None else 'aciertos')
+            if entrada is None:
+                return False, None
+            self._entradas.move_to_end(clave)
+            return True, entrada.valor
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda ``valor`` expulsando las entradas menos recientes que no quepan; ``False`` si ``valor`` no cabe."""
+        tamano = tamano_aproximado(valor)
+        caduca = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._bloqueo:
+            if clave in self._entradas:
+                self._quitar(clave)
+            if tamano > self.presupuesto:
+                # No cabe ni sola: se devuelve a quien la pidió pero no se guarda
+                self._contar(clave[0], 'demasiado_grandes')
+                return False
+            self._entradas[clave] = Entrada(valor, tamano, caduca)
+            self.bytes += tamano
+            if self.bytes > self.presupuesto:
+                # Antes que expulsar entradas vigentes se quitan las caducadas
+                ahora = time.monotonic()
+                for caducada in [c for c, e in self._entradas.items() if e.caduca <= ahora]:
+                    self._quitar(caducada)
+                    self._contar(caducada[0], 'caducadas')
+            while self.bytes > self.presupuesto:
+                antigua = next(iter(self._entradas))
+                self._quitar(antigua)
+                self._contar(antigua[0], 'expulsiones')
+            return True
+
+    def obtener_o_calcular(self, clave, calcular, ttl=None):
+        """Valor de ``clave``; si no está, ``calcular()`` (una sola vez aunque lo pidan varias sesiones a la vez)."""
+        encontrado, valor = self.obtener(clave)
+        if encontrado:
+            return valor
+        with self._bloqueo:
+            bloqueo_clave = self._calculando.setdefault(clave, threading.Lock())
+        with bloqueo_clave:
+            # Quien esperaba a otra sesión que lo estaba calculando lo encuentra ya hecho
+            encontrado, valor = self.obtener(clave, contar=False)
+            if not encontrado:
+                try:
+                    valor = calcular()
+                    self.guardar(clave, valor, ttl)
+                finally:
+                    with self._bloqueo:
+                        self._calculando.pop(clave, None)
+        return valor
+
+    def borrar(self, espacio=None):
+        """Vacía la caché, o sólo las entradas de ``espacio``."""
+        with self._bloqueo:
+            for clave in [c for c in self._entradas if espacio is None or c[0] == espacio]:
+                self._quitar(clave)
+
+    def estadisticas(self):
+        """Entradas, MB y contadores de cada espacio, en un DataFrame."""
+        with self._bloqueo:
+            filas = {espacio: {'entradas': 0, 'mb': 0.0, **contadores}
+                     for espacio, contadores in self._contadores.items()}
+            for clave, entrada in self._entradas.items():
+                fila = filas.setdefault(clave[0], {'entradas': 0, 'mb': 0.0})
+                fila['entradas'] += 1
+                fila['mb'] += entrada.bytes / 1024 ** 2
+        estadisticas = pd.DataFrame.from_dict(filas, orient='index').rename_axis('espacio')
+        if len(estadisticas):
+            estadisticas['tasa_aciertos'] = estadisticas['aciertos'] / (
+                estadisticas['aciertos'] + estadisticas['fallos']).replace(0, np.nan)
+        return estadisticas
+
+
+@functools.lru_cache(maxsize=1)
+def obtener_cache():
+    """Caché de resultados del proceso, compartida entre páginas y sesiones (y por la API, fuera de Streamlit)."""
+    return CacheMemoria()
+
+
+def en_memoria(espacio, ttl=None, spinner=None):
+    """Decorador: guarda los resultados de la función en la caché compartida.
+
+    Como en ``st.cache_data``, los argumentos cuyo nombre empieza por ``_`` no
+    forman parte de la clave, y el resto tienen que ser hashables. El valor
+    devuelto es compartido: no se debe modificar en el sitio.
+    """
+    def decorador(funcion):
+        firma = inspect.signature(funcion)
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            argumentos = firma.bind(*args, **kwargs)
+            argumentos.apply_defaults()
+            clave = (espacio, *(valor for nombre, valor in argumentos.arguments.items()
+                                if not nombre.startswith('_')))
+
+            def calcular():
+                if spinner and get_script_run_ctx() is not None:
+                    with st.spinner(spinner):
+                        return funcion(*args, **kwargs)
+                return funcion(*args, **kwargs)
+            return obtener_cache().obtener_o_calcular(clave, calcular, ttl)
+
+        envoltura.clear = lambda: obtener_cache().borrar(espacio)
+        return envoltura
+    return decorador
@@ -0,0 +1,248 @@
+import os
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from cache_memoria import en_memoria
+from datos import DIRECTORIO_CACHE, artefacto_actual
+from instrumentacion import medido, tramo
+from procesos import PoolProcesos
+
+# ----------------------------
+# Clustering de barrios por perfil temático
+# ----------------------------
+# El ajuste se cachea por la huella de la tabla barrio × tema: mientras los
+# datos no cambien, la página no vuelve a ajustar nada. Sólo el clustering del
+# histórico completo tiene continuidad entre versiones de los datos: sus
+# centroides de cada k se guardan en disco con la huella de la tabla de la que
+# salen y, al llegar datos nuevos, el ajuste arranca de ellos (menos
+# iteraciones y los clústeres conservan su numeración y su color). El resto de
+# ajustes (un periodo, cada año, la API, las pruebas de rendimiento) ni leen ni
+# escriben esos centroides: parten de una semilla fija, así que la misma tabla
+# da siempre el mismo resultado.
+DIRECTORIO_CLUSTERING = DIRECTORIO_CACHE / "clustering"
+
+K_POR_DEFECTO = 4
+K_MAXIMO = 8
+SEMILLAS_BARRIDO = 5
+SEMILLA = 0
+N_INIT = 10
+
+
+@dataclass
+class ResultadoClustering:
+    """Clúster de cada barrio y centroides (proporción de cada tema) de un ajuste K-Means."""
+    etiquetas: pd.Series
+    centroides: pd.DataFrame
+    inercia: float
+    arranque_previo: bool
+
+
+@dataclass
+class ClusteringAnual:
+    """Clustering de cada año, con los clústeres alineados con los del histórico completo."""
+    resultados: dict
+    etiquetas: pd.DataFrame
+
+
+def _proporciones(tabla):
+    return tabla.div(tabla.sum(axis=1), axis=0)
+
+
+def tabla_proporciones(cubo):
+    """Tabla barrio × tema con la proporción de cada tema en las incidencias del barrio."""
+    return _proporciones(cubo.tabla_barrio_tema())
+
+
+# ------------ Centroides guardados para el arranque en caliente ------------
+def _ruta_centroides(k):
+    return DIRECTORIO_CLUSTERING / f"centroides-historico-k{k}.npz"
+
+
+def guardar_centroides(centroides, huella):
+    destino = _ruta_centroides(len(centroides))
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    # Temporal propio de cada escritor: precalculo.py ajusta varios k a la vez en procesos distintos
+    temporal = destino.with_name(f"{destino.stem}.{uuid.uuid4().hex[:12]}.tmp.npz")
+    np.savez(temporal, temas=centroides.columns.to_numpy(str), centroides=centroides.to_numpy(),
+             huella=np.array(huella))
+    os.replace(temporal, destino)
+
+
+def cargar_centroides(k, temas):
+    """``(centroides, huella)`` del último ajuste del histórico para ``k`` sobre ``temas`` (nuevos a 0), o ``(None, None)``."""
+    try:
+        with np.load(_ruta_centroides(k)) as datos:
+            centroides = pd.DataFrame(datos['centroides'], columns=datos['temas'])
+            huella = str(datos['huella'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+    if len(centroides) != k:
+        return None, None
+    return centroides.reindex(columns=temas, fill_value=0.0), huella
+
+
+# ------------ Ajuste ------------
+def ajustar_clustering(tabla_pct, k=K_POR_DEFECTO, previos=None):
+    """K-Means sobre ``tabla_pct`` desde los centroides ``previos`` o, sin ellos, desde la semilla fija.
+
+    No lee ni guarda nada en disco.
+    """
+    # scikit-learn se importa al ajustar: con el clustering precalculado la página no lo necesita
+    from sklearn.cluster import KMeans
+
+    if previos is not None:
+        modelo = KMeans(n_clusters=k, init=previos.to_numpy(), n_init=1)
+    else:
+        modelo = KMeans(n_clusters=k, random_state=SEMILLA, n_init=N_INIT)
+    with tramo("KMeans.fit_predict", filas=len(tabla_pct)):
+        etiquetas = modelo.fit_predict(tabla_pct.to_numpy())
+
+    centroides = pd.DataFrame(modelo.cluster_centers_, columns=tabla_pct.columns)
+    return ResultadoClustering(pd.Series(etiquetas, index=tabla_pct.index, name='cluster'),
+                               centroides, float(modelo.inertia_), previos is not None)
+
+
+def ajustar_clustering_historico(cubo, k=K_POR_DEFECTO):
+    """Clustering del histórico completo ``cubo``, continuando desde los centroides guardados del histórico."""
+    tabla_pct = tabla_proporciones(cubo)
+    huella = cubo.huella_tabla()
+    previos, huella_previos = cargar_centroides(k, tabla_pct.columns)
+    resultado = ajustar_clustering(tabla_pct, k, previos)
+    # Con la misma tabla no se reescriben: volver a ajustarla parte siempre del mismo punto
+    if huella_previos != huella:
+        guardar_centroides(resultado.centroides, huella)
+    return resultado
+
+
+def consultar_clustering_historico(cubo, k=K_POR_DEFECTO):
+    """El mismo clustering que ``ajustar_clustering_historico`` sobre ``cubo``, pero sin guardar nada.
+
+    Arranca de los centroides guardados: si son los de esta misma tabla, el
+    ajuste no se mueve de ellos; si son de una versión anterior, hace el mismo
+    ajuste que hará (o hizo) la app. En ambos casos la numeración coincide con
+    la de la página.
+    """
+    tabla_pct = tabla_proporciones(cubo)
+    previos, _ = cargar_centroides(k, tabla_pct.columns)
+    return ajustar_clustering(tabla_pct, k, previos)
+
+
+@en_memoria("clustering", spinner="Agrupando barrios...")
+def _clustering(huella, k, historico, _cubo):
+    if not historico:
+        return ajustar_clustering(tabla_proporciones(_cubo), k)
+    precalculado = artefacto_actual(f"clustering-k{k}-{huella}")
+    return precalculado if precalculado is not None else ajustar_clustering_historico(_cubo, k)
+
+
+def obtener_clustering(cubo, k=K_POR_DEFECTO, historico=False):
+    """Clustering de los barrios del cubo, calculado una vez por tabla de entrada y k.
+
+    ``historico`` indica que ``cubo`` es el histórico completo (sin recortar a
+    un periodo): sólo entonces se usa y se actualiza la continuidad de centroides.
+    """
+    return _clustering(cubo.huella_tabla(), k, historico, cubo)
+
+
+# ------------ Clustering por año ------------
+# Cada año se ajusta partiendo de los centroides del histórico completo y luego
+# se emparejan sus clústeres con esos centroides (algoritmo húngaro): el clúster
+# 1 de un año es el más parecido al clúster 1 del histórico, y así los cambios
+# de clúster de un año a otro reflejan cambios de perfil y no de numeración.
+def _ajustar_anio(X, referencia):
+    from scipy.optimize import linear_sum_assignment
+    from sklearn.cluster import KMeans
+
+    modelo = KMeans(n_clusters=len(referencia), init=referencia, n_init=1).fit(X)
+    distancias = ((referencia[:, None, :] - modelo.cluster_centers_[None, :, :]) ** 2).sum(axis=2)
+    _, asignacion = linear_sum_assignment(distancias)
+    nuevo = np.empty(len(referencia), dtype=int)
+    nuevo[asignacion] = np.arange(len(referencia))
+    return nuevo[modelo.labels_], modelo.cluster_centers_[asignacion], modelo.inertia_
+
+
+@medido("KMeans por año (procesos)")
+def clustering_anual(cubo, k=K_POR_DEFECTO, procesos=None):
+    """Clustering de los barrios de cada año en un solo lote repartido entre procesos."""
+    referencia = ajustar_clustering(tabla_proporciones(cubo), k).centroides
+    tablas = {anio: _proporciones(tabla.reindex(columns=referencia.columns, fill_value=0))
+              for anio, tabla in cubo.tablas_barrio_tema_anuales().items() if len(tabla) > k}
+
+    with PoolProcesos(max_workers=procesos or os.cpu_count()) as pool:
+        futuros = {anio: pool.submit(_ajustar_anio, tabla.to_numpy(), referencia.to_numpy())
+                   for anio, tabla in tablas.items()}
+        ajustes = {anio: futuro.result() for anio, futuro in futuros.items()}
+
+    resultados = {}
+    for anio, (etiquetas, centroides, inercia) in ajustes.items():
+        resultados[anio] = ResultadoClustering(
+            pd.Series(etiquetas, index=tablas[anio].index, name='cluster'),
+            pd.DataFrame(centroides, columns=referencia.columns), float(inercia), True)
+    etiquetas = pd.DataFrame({anio: resultado.etiquetas for anio, resultado in resultados.items()})
+    return ClusteringAnual(resultados, etiquetas)
+
+
+def transiciones(anual, desde, hasta):
+    """Barrios cuyo clúster cambia entre los años ``desde`` y ``hasta`` (numerados desde 1)."""
+    pares = anual.etiquetas[[desde, hasta]].dropna().astype(int) + 1
+    cambios = pares[pares[desde] != pares[hasta]]
+    return cambios.rename(columns={desde: f'clúster {desde}', hasta: f'clúster {hasta}'})
+
+
+def matriz_transiciones(anual, desde, hasta):
+    """Número de barrios que pasan de cada clúster de ``desde`` a cada clúster de ``hasta``."""
+    pares = anual.etiquetas[[desde, hasta]].dropna().astype(int) + 1
+    return pd.crosstab(pares[desde], pares[hasta]).rename_axis(index=str(desde), columns=str(hasta))
+
+
+@en_memoria("clustering anual", spinner="Agrupando barrios de todos los años...")
+def _clustering_anual(huella, k, _cubo):
+    precalculado = artefacto_actual(f"clustering-anual-k{k}-{huella}")
+    return precalculado if precalculado is not None else clustering_anual(_cubo, k)
+
+
+def obtener_clustering_anual(cubo, k=K_POR_DEFECTO):
+    """Clustering de todos los años de una vez, cacheado por las tablas anuales y k."""
+    return _clustering_anual(cubo.huella_tablas_anuales(), k, cubo)
+
+
+# ------------ Selección de k ------------
+def _evaluar_k(X, k, semilla):
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+
+    modelo = KMeans(n_clusters=k, random_state=semilla, n_init=1).fit(X)
+    return k, semilla, modelo.inertia_, silhouette_score(X, modelo.labels_)
+
+
+@medido("barrido de k (procesos)")
+def barrido_k(tabla_pct, ks, semillas=SEMILLAS_BARRIDO, procesos=None):
+    """Inercia y silueta de cada combinación de k y semilla, repartidas entre procesos."""
+    X = tabla_pct.to_numpy()
+    ks = [k for k in ks if 2 <= k < len(X)]
+    with PoolProcesos(max_workers=procesos or os.cpu_count()) as pool:
+        futuros = [pool.submit(_evaluar_k, X, k, semilla) for k in ks for semilla in range(semillas)]
+        filas = [f.result() for f in futuros]
+    return pd.DataFrame(filas, columns=['k', 'semilla', 'inercia', 'silueta'])
+
+
+def resumir_barrido(resultados):
+    """Por k: la mejor inercia y la silueta media y máxima entre semillas."""
+    return resultados.groupby('k').agg(
+        inercia=('inercia', 'min'),
+        silueta_media=('silueta', 'mean'),
+        silueta_maxima=('silueta', 'max'),
+    )
+
+
+@en_memoria("barrido de k", spinner="Evaluando valores de k en paralelo...")
+def _barrido(huella, ks, semillas, _tabla_pct):
+    return barrido_k(_tabla_pct, ks, semillas)
+
+
+def obtener_barrido(cubo, ks, semillas=SEMILLAS_BARRIDO):
+    """Barrido de k cacheado por tabla de entrada, valores de k y número de semillas."""
+    return _barrido(cubo.huella_tabla(), tuple(ks), semillas, tabla_proporciones(cubo))
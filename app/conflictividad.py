@@ -0,0 +1,82 @@
+import os
+
+import pandas as pd
+
+from cache_memoria import en_memoria
+from datos import cargar_artefacto, ruta_artefacto, version_incidencias
+from instrumentacion import tramo
+from trabajos import PROCESOS_TRABAJOS, resultado_en_segundo_plano
+
+# ----------------------------
+# Modelo de conflictividad por barrios
+# ----------------------------
+# El entrenamiento va al gestor de trabajos (trabajos.py), que reparte el mismo
+# entre todas las sesiones; los modelos entrenados quedan en la caché de
+# resultados (cache_memoria.py) mientras quepan en su presupuesto.
+
+# Hilos del Random Forest: cada proceso del pool se queda su parte de los
+# núcleos, así que un entrenamiento solo usa varios y, con el pool lleno, los
+# procesos no se pisan
+HILOS_ENTRENAMIENTO = max(1, (os.cpu_count() or 1) // PROCESOS_TRABAJOS)
+
+
+def preparar_datos_conflictividad(cubo, columnas_tema):
+    # Conteo por tema por barrio, ya con todas las columnas_tema y en ese orden
+    tabla_pivot = cubo.tabla_barrio_tema(columnas_tema)
+
+    # Calculamos el total de incidencias por barrio
+    tabla_pivot['total_incidencias'] = tabla_pivot.sum(axis=1)
+
+    # Asignamos nivel de conflictividad
+    tabla_pivot['nivel_conflictividad'] = pd.qcut(tabla_pivot['total_incidencias'], q=3, labels=['Bajo', 'Medio', 'Alto'])
+
+    return tabla_pivot
+
+
+def entrenar_modelo(df, temas):
+    # scikit-learn sólo hace falta al entrenar, que ocurre en el proceso del trabajo
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score, classification_report
+    from sklearn.model_selection import train_test_split
+
+    X = df[temas]
+    y = df['nivel_conflictividad']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
+    modelo = RandomForestClassifier(random_state=42, n_jobs=HILOS_ENTRENAMIENTO)
+    with tramo("RandomForestClassifier.fit", filas=len(X_train)):
+        modelo.fit(X_train, y_train)
+    y_pred = modelo.predict(X_test)
+    reporte = classification_report(y_test, y_pred, output_dict=True)
+    accuracy = accuracy_score(y_test, y_pred)
+    importancia = pd.Series(modelo.feature_importances_, index=temas).sort_values(ascending=False)
+    return modelo, accuracy, reporte, importancia
+
+
+def modelo_conflictividad(cubo, temas):
+    """``(df_prep, modelo, accuracy, reporte, importancia)`` del modelo con los ``temas`` indicados."""
+    df_prep = preparar_datos_conflictividad(cubo, list(temas))
+    return df_prep, *entrenar_modelo(df_prep, list(temas))
+
+
+def nombre_artefacto(cubo, temas):
+    # La tabla de entrada con esas columnas identifica el modelo (incluido el periodo)
+    return f"conflictividad-{cubo.huella_tabla(list(temas))}"
+
+
+@en_memoria("conflictividad")
+def _modelo_precalculado(version, nombre):
+    return cargar_artefacto(version, nombre)
+
+
+def pedir_modelo_conflictividad(cubo, temas_usados):
+    """Modelo precalculado o ya entrenado; si no lo hay, lo entrena en segundo plano y devuelve ``None``."""
+    # El conjunto de temas (sin orden ni repeticiones) y la tabla de entrada identifican el modelo
+    temas = tuple(sorted(frozenset(temas_usados)))
+    nombre = nombre_artefacto(cubo, temas)
+    version = version_incidencias()[1]
+    if ruta_artefacto(version, nombre).exists():
+        precalculado = _modelo_precalculado(version, nombre)
+        if precalculado is not None:
+            return precalculado
+    return resultado_en_segundo_plano(('conflictividad', nombre), modelo_conflictividad, cubo, temas,
+                                      descripcion="Entrenamiento del modelo de conflictividad")
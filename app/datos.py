@@ -0,0 +1,393 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import streamlit as st
+
+from instrumentacion import medido, tramo, tramos_por_elemento
+from normalizacion import huella_alias, normalizar_localizaciones, tabla_alias
+
+# ----------------------------
+# Rutas de datos
+# ----------------------------
+DIRECTORIO_DATOS = Path(__file__).resolve().parent / "data"
+RUTA_INCIDENCIAS = DIRECTORIO_DATOS / "total-castellano.csv"
+DIRECTORIO_CACHE = DIRECTORIO_DATOS / "cache"
+RUTA_BARRIOS = DIRECTORIO_DATOS / "barris-barrios.geojson"
+RUTA_DISTRITOS = DIRECTORIO_DATOS / "districtes-distritos.geojson"
+
+# Columnas de texto que se guardan codificadas como diccionario (category)
+COLUMNAS_CATEGORICAS = ['tema', 'barrio_localizacion', 'distrito_localizacion']
+
+# Columnas del CSV que no usa ninguna página: ni se llegan a parsear
+COLUMNAS_DESCARTADAS = ['distrito_solicitante', 'barrio_solicitante']
+
+# Filas por bloque al ingerir un CSV: la memoria máxima de la ingesta depende de
+# este tamaño y no del tamaño del fichero
+FILAS_POR_BLOQUE = 100_000
+
+# Segundos durante los que se reutiliza la versión de los datos sin volver a consultar el disco
+SEGUNDOS_COMPROBACION_VERSION = 60
+
+# Bytes del final de lo ya ingerido que se comparan para saber si el CSV sólo ha crecido
+BYTES_HUELLA_COLA = 64 * 1024
+
+_bloqueo_ingesta = threading.Lock()
+
+
+# ----------------------------
+# Limpieza común a todas las páginas
+# ----------------------------
+def alias_localizaciones():
+    """Tabla de alias de barrios y distritos, con los nombres de los GeoJSON de la app."""
+    return tabla_alias((str(RUTA_BARRIOS), str(RUTA_DISTRITOS)))
+
+
+def leer_csv(fuente, filas_por_bloque=None, nombres=None):
+    """Lee el CSV sin las columnas descartadas; con ``filas_por_bloque`` devuelve un iterador de bloques.
+
+    ``nombres`` sirve para leer un trozo de CSV sin cabecera (la cola nueva de un fichero).
+    """
+    # Texto repetido leído directamente como categorías: la normalización sólo ve valores únicos
+    return pd.read_csv(fuente, sep=';', dtype={col: 'category' for col in COLUMNAS_CATEGORICAS},
+                       usecols=lambda col: col not in COLUMNAS_DESCARTADAS, chunksize=filas_por_bloque,
+                       names=nombres, header=None if nombres else 'infer')
+
+
+def limpiar_incidencias(df):
+    df = df.drop(columns=COLUMNAS_DESCARTADAS, errors='ignore')
+
+    # Localizaciones con la grafía canónica y sin las que no son válidas (normalizacion.NO_VALIDOS)
+    df = normalizar_localizaciones(df, alias_localizaciones())
+
+    df['fecha_entrada_ayuntamiento'] = pd.to_datetime(df['fecha_entrada_ayuntamiento'], errors='coerce')
+    df = df.dropna(subset=['fecha_entrada_ayuntamiento'])
+
+    df = df.sort_values(by='fecha_entrada_ayuntamiento', kind='stable').reset_index(drop=True)
+
+    # Texto repetido -> categorías (se guardan como columnas diccionario en la caché)
+    for col in df.columns:
+        if col in COLUMNAS_CATEGORICAS or df[col].dtype == object:
+            df[col] = df[col].astype('category')
+    return df
+
+
+# ----------------------------
+# Almacén columnar en disco (Arrow IPC / Feather v2)
+# ----------------------------
+# Cada CSV tiene un directorio en data/cache con un manifiesto y una o varias
+# partes .arrow sin comprimir (mapeables en memoria). El CSV se lee por bloques
+# de FILAS_POR_BLOQUE filas y cada bloque, ya limpio, se escribe como una parte:
+# nunca hay en memoria más que un bloque. La cola nueva del CSV o un fichero
+# delta añaden sus propias partes.
+def directorio_almacen(ruta):
+    return DIRECTORIO_CACHE / Path(ruta).stem
+
+
+def leer_manifiesto(ruta):
+    try:
+        with open(directorio_almacen(ruta) / "manifiesto.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_manifiesto(ruta, manifiesto):
+    destino = directorio_almacen(ruta) / "manifiesto.json"
+    temporal = destino.with_suffix('.tmp')
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1)
+    os.replace(temporal, destino)
+
+
+def _a_tabla_arrow(df):
+    """Convierte al esquema del almacén: fechas en ns y texto como diccionario<int32, string>."""
+    tabla = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    columnas = []
+    for nombre, col in zip(tabla.column_names, tabla.columns):
+        if pa.types.is_timestamp(col.type):
+            col = col.cast(pa.timestamp('ns'))
+        elif not pa.types.is_integer(col.type):
+            # Categorías, texto o columnas vacías (null/float) -> diccionario de cadenas
+            if pa.types.is_dictionary(col.type):
+                col = col.cast(col.type.value_type)
+            if col.null_count == len(col):
+                col = pa.chunked_array([pa.nulls(len(col), pa.string())])
+            col = pc.dictionary_encode(col.cast(pa.string())).cast(pa.dictionary(pa.int32(), pa.string()))
+        columnas.append(col)
+    return pa.Table.from_arrays(columnas, names=tabla.column_names)
+
+
+def _alinear_esquema(tabla, esquema):
+    """Ajusta una parte nueva al esquema de las anteriores (columnas ausentes como nulos)."""
+    columnas = []
+    for campo in esquema:
+        if campo.name in tabla.column_names:
+            columnas.append(tabla[campo.name].cast(campo.type))
+        else:
+            columnas.append(pa.nulls(len(tabla), campo.type))
+    return pa.Table.from_arrays(columnas, schema=esquema)
+
+
+def _escribir_parte(ruta, tabla):
+    nombre = f"parte-{uuid.uuid4().hex[:12]}.arrow"
+    destino = directorio_almacen(ruta) / nombre
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_suffix('.tmp')
+    feather.write_feather(tabla, str(temporal), compression='uncompressed')
+    os.replace(temporal, destino)
+    return nombre
+
+
+@medido("leer partes Arrow")
+def leer_partes(ruta, partes, columnas=None):
+    tablas = [feather.read_table(str(directorio_almacen(ruta) / parte),
+                                 columns=list(columnas) if columnas else None, memory_map=True)
+              for parte in partes]
+    return pa.concat_tables(tablas).to_pandas(split_blocks=True)
+
+
+def _esquema_almacen(ruta, manifiesto):
+    with pa.memory_map(str(directorio_almacen(ruta) / manifiesto['partes'][0]), 'r') as fuente:
+        return pa.ipc.open_file(fuente).schema
+
+
+def _huella_cola(ruta, tamano):
+    with open(ruta, "rb") as f:
+        f.seek(max(0, tamano - BYTES_HUELLA_COLA))
+        return hashlib.sha1(f.read(tamano - f.tell())).hexdigest()
+
+
+def _fin_ultima_linea(f, desde, hasta):
+    """Posición tras el último salto de línea entre ``desde`` y ``hasta`` (``desde`` si no hay ninguno).
+
+    La última fila puede estar a medio escribir: sólo se ingiere hasta ahí.
+    """
+    fin = hasta
+    while fin > desde:
+        inicio = max(desde, fin - BYTES_HUELLA_COLA)
+        f.seek(inicio)
+        salto = f.read(fin - inicio).rfind(b"\n")
+        if salto >= 0:
+            return inicio + salto + 1
+        fin = inicio
+    return desde
+
+
+class _LecturaAcotada(io.RawIOBase):
+    """Vista de sólo lectura de un fichero binario que termina tras ``limite`` bytes."""
+
+    def __init__(self, f, limite):
+        self._f = f
+        self._restantes = limite
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        n = min(len(destino), self._restantes)
+        if n <= 0:
+            return 0
+        leidos = self._f.readinto(memoryview(destino)[:n])
+        self._restantes -= leidos
+        return leidos
+
+
+def _ingerir_bloques(ruta, bloques, esquema=None):
+    """Limpia cada bloque del CSV y lo escribe como una parte; devuelve los nombres de las partes."""
+    partes, df = [], None
+    for bloque in tramos_por_elemento("pd.read_csv (bloque)", bloques):
+        with tramo("limpieza", filas=len(bloque)):
+            df = limpiar_incidencias(bloque)
+        if len(df):
+            with tramo("escribir parte Arrow", filas=len(df)):
+                tabla = _a_tabla_arrow(df)
+                esquema = esquema or tabla.schema
+                partes.append(_escribir_parte(ruta, _alinear_esquema(tabla, esquema)))
+    if not partes and esquema is None and df is not None:
+        # Sin ninguna fila válida el almacén sigue necesitando una parte con el esquema
+        partes.append(_escribir_parte(ruta, _a_tabla_arrow(df)))
+    return partes
+
+
+def reconstruir_almacen(ruta):
+    """Parsea el CSV completo por bloques y sustituye todas las partes del almacén."""
+    estado = os.stat(ruta)
+    with open(ruta, "rb") as f:
+        cabecera = f.readline()
+        tamano = _fin_ultima_linea(f, 0, estado.st_size)
+        f.seek(0)
+        partes = _ingerir_bloques(ruta, leer_csv(io.BufferedReader(_LecturaAcotada(f, tamano)),
+                                                 FILAS_POR_BLOQUE))
+
+    anterior = leer_manifiesto(ruta) or {}
+    manifiesto = {
+        'origen': str(ruta),
+        'version': uuid.uuid4().hex[:12],
+        'mtime_ns': estado.st_mtime_ns,
+        'tamano_fichero': estado.st_size,
+        'tamano': tamano,
+        'cabecera': cabecera.decode('utf-8'),
+        'huella_cola': _huella_cola(ruta, tamano),
+        'partes': partes,
+        'deltas': [],
+        'normalizacion': huella_alias(alias_localizaciones()),
+    }
+    _escribir_manifiesto(ruta, manifiesto)
+
+    # Las partes anteriores ya no forman parte de ninguna versión
+    for parte in anterior.get('partes', []):
+        (directorio_almacen(ruta) / parte).unlink(missing_ok=True)
+    return manifiesto
+
+
+def _anadir_partes(ruta, manifiesto, bloques):
+    partes = _ingerir_bloques(ruta, bloques, _esquema_almacen(ruta, manifiesto))
+    if partes:
+        manifiesto['partes'].extend(partes)
+        manifiesto['version'] = uuid.uuid4().hex[:12]
+    return manifiesto, bool(partes)
+
+
+def ingerir_cola(ruta, manifiesto):
+    """Parsea y limpia por bloques sólo las filas añadidas al CSV desde la última ingesta."""
+    estado = os.stat(ruta)
+    nombres = list(pd.read_csv(io.StringIO(manifiesto['cabecera']), sep=';', nrows=0).columns)
+    with open(ruta, "rb") as f:
+        fin = _fin_ultima_linea(f, manifiesto['tamano'], estado.st_size)
+        if fin > manifiesto['tamano']:
+            f.seek(manifiesto['tamano'])
+            cola = io.BufferedReader(_LecturaAcotada(f, fin - manifiesto['tamano']))
+            manifiesto, _ = _anadir_partes(ruta, manifiesto, leer_csv(cola, FILAS_POR_BLOQUE, nombres))
+    manifiesto['tamano'] = fin
+    manifiesto['huella_cola'] = _huella_cola(ruta, manifiesto['tamano'])
+    manifiesto['mtime_ns'] = estado.st_mtime_ns
+    manifiesto['tamano_fichero'] = estado.st_size
+    _escribir_manifiesto(ruta, manifiesto)
+    return manifiesto
+
+
+def renormalizar_almacen(ruta, manifiesto):
+    """Vuelve a normalizar las localizaciones de las partes ya ingeridas (incluidos los deltas)."""
+    anteriores = manifiesto['partes']
+    partes, esquema = [], None
+    for parte in anteriores:
+        tabla = _a_tabla_arrow(normalizar_localizaciones(leer_partes(ruta, [parte]), alias_localizaciones()))
+        esquema = esquema or tabla.schema
+        partes.append(_escribir_parte(ruta, _alinear_esquema(tabla, esquema)))
+
+    manifiesto['partes'] = partes
+    manifiesto['version'] = uuid.uuid4().hex[:12]
+    manifiesto['normalizacion'] = huella_alias(alias_localizaciones())
+    _escribir_manifiesto(ruta, manifiesto)
+    for parte in anteriores:
+        (directorio_almacen(ruta) / parte).unlink(missing_ok=True)
+    return manifiesto
+
+
+def _es_ampliacion(ruta, manifiesto, estado):
+    """El CSV sólo ha crecido por el final respecto a lo ya ingerido."""
+    return (estado.st_size > manifiesto['tamano']
+            and _huella_cola(ruta, manifiesto['tamano']) == manifiesto['huella_cola'])
+
+
+def _sincronizar(ruta):
+    estado = os.stat(ruta)
+    manifiesto = leer_manifiesto(ruta)
+    if manifiesto is None:
+        return reconstruir_almacen(ruta)
+    if manifiesto.get('normalizacion') != huella_alias(alias_localizaciones()):
+        manifiesto = renormalizar_almacen(ruta, manifiesto)
+    if (manifiesto['mtime_ns'], manifiesto['tamano_fichero']) == (estado.st_mtime_ns, estado.st_size):
+        return manifiesto
+    # Con deltas ingeridos, un CSV distinto se toma como una exportación completa que ya los incluye
+    if not manifiesto['deltas'] and _es_ampliacion(ruta, manifiesto, estado):
+        return ingerir_cola(ruta, manifiesto)
+    return reconstruir_almacen(ruta)
+
+
+def sincronizar_almacen(ruta=RUTA_INCIDENCIAS):
+    """Pone el almacén al día con el CSV (incrementalmente si sólo se han añadido filas)."""
+    with _bloqueo_ingesta:
+        return _sincronizar(ruta)
+
+
+def ingerir_delta(ruta_delta, ruta=RUTA_INCIDENCIAS):
+    """Añade al almacén las incidencias de un fichero delta con el mismo formato que el CSV."""
+    with _bloqueo_ingesta:
+        manifiesto = _sincronizar(ruta)
+        manifiesto, anadidas = _anadir_partes(ruta, manifiesto, leer_csv(ruta_delta, FILAS_POR_BLOQUE))
+        if anadidas:
+            manifiesto['deltas'].append(str(ruta_delta))
+            _escribir_manifiesto(ruta, manifiesto)
+        return manifiesto
+
+
+# ----------------------------
+# Carga cacheada por versión de los datos
+# ----------------------------
+@st.cache_data(ttl=SEGUNDOS_COMPROBACION_VERSION, show_spinner="Comprobando datos nuevos...")
+def _version_reciente(ruta):
+    return ruta, sincronizar_almacen(ruta)['version']
+
+
+def version_incidencias(ruta=RUTA_INCIDENCIAS):
+    """(ruta, versión) actual de los datos, comprobada como mucho una vez por minuto."""
+    return _version_reciente(str(ruta))
+
+
+# ----------------------------
+# Artefactos precalculados (app/precalculo.py)
+# ----------------------------
+# Resultados calculados fuera de la app para una versión concreta de los datos,
+# uno por directorio de versión. Las páginas los usan si existen para la
+# versión actual; si no (o para selecciones a medida), calculan en vivo.
+DIRECTORIO_PRECALCULO = DIRECTORIO_CACHE / "precalculo"
+
+
+def ruta_artefacto(version, nombre):
+    return DIRECTORIO_PRECALCULO / version / f"{nombre}.pkl"
+
+
+def guardar_artefacto(version, nombre, objeto):
+    destino = ruta_artefacto(version, nombre)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_suffix('.tmp')
+    with open(temporal, "wb") as f:
+        pickle.dump(objeto, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporal, destino)
+
+
+@medido("cargar artefacto precalculado")
+def cargar_artefacto(version, nombre):
+    """Artefacto ``nombre`` precalculado para ``version``, o None si no existe o no se puede leer."""
+    try:
+        with open(ruta_artefacto(version, nombre), "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def artefacto_actual(nombre, ruta=RUTA_INCIDENCIAS):
+    """Artefacto ``nombre`` de la versión actual de los datos, o None."""
+    return cargar_artefacto(version_incidencias(ruta)[1], nombre)
+
+
+def podar_artefactos(version):
+    """Borra los artefactos de las demás versiones; devuelve cuántas versiones se han borrado."""
+    if not DIRECTORIO_PRECALCULO.exists():
+        return 0
+    antiguas = [d for d in DIRECTORIO_PRECALCULO.iterdir() if d.is_dir() and d.name != version]
+    for directorio in antiguas:
+        shutil.rmtree(directorio, ignore_errors=True)
+    return len(antiguas)
@@ -0,0 +1,279 @@
+import json
+import math
+import os
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from cache_memoria import en_memoria
+from datos import RUTA_BARRIOS, RUTA_DISTRITOS, alias_localizaciones, artefacto_actual
+from instrumentacion import medido
+from normalizacion import normalizar_localizacion
+
+# ----------------------------
+# Geometría simplificada para los mapas
+# ----------------------------
+# Los polígonos se cuantizan a una rejilla y se simplifican (Douglas-Peucker)
+# con una tolerancia que depende del zoom del mapa: a zoom 12 no se distinguen
+# detalles de menos de medio píxel y no tiene sentido mandarlos al navegador.
+# Los bordes compartidos entre polígonos vecinos se simplifican una sola vez,
+# así que los barrios siguen encajando sin huecos ni solapes.
+ZOOM_MAPAS = 12
+ZOOM_DETALLE = 14
+PIXELES_TOLERANCIA = 0.5
+PIXELES_REJILLA = 0.1
+
+
+def _grados_por_pixel(zoom):
+    # Teselas de 256 píxeles que cubren 360 grados de longitud a zoom 0
+    return 360 / (256 * 2 ** zoom)
+
+
+def tolerancia_para_zoom(zoom):
+    return PIXELES_TOLERANCIA * _grados_por_pixel(zoom)
+
+
+def decimales_para_zoom(zoom):
+    return max(0, math.ceil(-math.log10(PIXELES_REJILLA * _grados_por_pixel(zoom))))
+
+
+# ------------ Simplificación ------------
+def _douglas_peucker(puntos, tolerancia):
+    """Máscara de los puntos de la polilínea ``puntos`` (n × 2) que se conservan."""
+    conservar = np.zeros(len(puntos), dtype=bool)
+    conservar[[0, -1]] = True
+    pila = [(0, len(puntos) - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, d = puntos[i], puntos[j] - puntos[i]
+        tramo = puntos[i + 1:j] - a
+        norma = math.hypot(*d)
+        if norma == 0:
+            distancia = np.hypot(tramo[:, 0], tramo[:, 1])
+        else:
+            distancia = np.abs(d[0] * tramo[:, 1] - d[1] * tramo[:, 0]) / norma
+        k = int(distancia.argmax())
+        if distancia[k] > tolerancia:
+            conservar[i + 1 + k] = True
+            pila += [(i, i + 1 + k), (i + 1 + k, j)]
+    return conservar
+
+
+def _simplificar_anillos(anillos, tolerancia):
+    """Simplifica anillos cerrados (listas de puntos enteros) respetando los bordes compartidos.
+
+    Cada anillo se parte en arcos por los puntos donde cambia el conjunto de
+    anillos que pasan por él; un arco compartido se simplifica una vez y se
+    reutiliza (en el sentido que toque) en todos los anillos que lo contienen.
+    """
+    anillos_de = {}
+    for a, anillo in enumerate(anillos):
+        for punto in anillo[:-1]:
+            anillos_de.setdefault(punto, set()).add(a)
+
+    # Un punto que es nudo en algún anillo lo es en todos: los bordes compartidos
+    # no siempre tienen los mismos vértices intermedios a ambos lados
+    nudos = set()
+    for anillo in anillos:
+        puntos = anillo[:-1]
+        vecinos = [anillos_de[p] for p in puntos]
+        nudos.update(p for i, p in enumerate(puntos)
+                     if len(vecinos[i]) > 2 or vecinos[i] != vecinos[i - 1]
+                     or vecinos[i] != vecinos[(i + 1) % len(puntos)])
+
+    arcos = {}
+    resultado = []
+    for anillo in anillos:
+        puntos = anillo[:-1]
+        n = len(puntos)
+        fijos = [i for i, p in enumerate(puntos) if p in nudos]
+        if not fijos:
+            # Anillo aislado: se fija el primer punto y el más alejado de él
+            coordenadas = np.array(puntos, dtype=float)
+            fijos = [0, int(np.hypot(*(coordenadas - coordenadas[0]).T).argmax())]
+
+        nuevo = []
+        for inicio, fin in zip(fijos, fijos[1:] + [fijos[0] + n]):
+            arco = tuple(puntos[i % n] for i in range(inicio, fin + 1))
+            canonico = min(arco, arco[::-1])
+            if canonico not in arcos:
+                conservar = _douglas_peucker(np.array(canonico, dtype=float), tolerancia)
+                arcos[canonico] = [p for p, c in zip(canonico, conservar) if c]
+            simplificado = arcos[canonico] if canonico == arco else arcos[canonico][::-1]
+            nuevo.extend(simplificado[:-1])
+        nuevo.append(nuevo[0])
+
+        # Un anillo que se queda sin superficie se deja como estaba
+        resultado.append(nuevo if len(nuevo) >= 4 else anillo)
+    return resultado
+
+
+def _poligonos(geometria):
+    if geometria['type'] == 'Polygon':
+        return [geometria['coordinates']]
+    if geometria['type'] == 'MultiPolygon':
+        return geometria['coordinates']
+    return []
+
+
+def simplificar_geojson(geojson, tolerancia, decimales):
+    """Copia de ``geojson`` con las coordenadas cuantizadas a ``decimales`` y simplificadas."""
+    escala = 10 ** decimales
+
+    # Anillos con coordenadas enteras en la rejilla y sin puntos repetidos seguidos
+    anillos = []
+    for feature in geojson['features']:
+        for poligono in _poligonos(feature['geometry']):
+            for anillo in poligono:
+                enteros = [(round(x * escala), round(y * escala)) for x, y, *_ in anillo]
+                anillos.append([p for i, p in enumerate(enteros) if i == 0 or p != enteros[i - 1]])
+    simplificados = iter(_simplificar_anillos(anillos, tolerancia * escala))
+
+    def reconstruir(poligono):
+        return [[[x / escala, y / escala] for x, y in next(simplificados)] for _ in poligono]
+
+    features = []
+    for feature in geojson['features']:
+        geometria = feature['geometry']
+        coordenadas = [reconstruir(poligono) for poligono in _poligonos(geometria)]
+        features.append({
+            'type': 'Feature',
+            'properties': _limpiar_propiedades(feature.get('properties') or {}),
+            'geometry': {'type': geometria['type'],
+                         'coordinates': coordenadas[0] if geometria['type'] == 'Polygon' else coordenadas},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _limpiar_propiedades(propiedades):
+    # Sólo valores escalares: el resto se pasa a texto para que la feature se pueda serializar
+    return {k: v if isinstance(v, (str, int, float, bool)) or v is None else str(v)
+            for k, v in propiedades.items()}
+
+
+def _clave_feature(feature, alias):
+    # Nombre canónico de la feature, el mismo con el que se normalizan las incidencias
+    nombre = (feature.get('properties') or {}).get('nombre')
+    return (normalizar_localizacion(nombre, alias) or '') if nombre else ''
+
+
+# ------------ Caché por versión del fichero ------------
+def nombre_artefacto(ruta, mtime_ns, tamano, zoom):
+    return f"geojson-{os.path.splitext(os.path.basename(ruta))[0]}-{mtime_ns}-{tamano}-z{zoom}"
+
+
+@medido("simplificar GeoJSON")
+def geojson_simplificado(ruta, mtime_ns, tamano, zoom):
+    """GeoJSON de ``ruta`` simplificado para ``zoom``, con la clave de cada feature, ya serializado."""
+    with open(ruta, "r", encoding="utf-8") as f:
+        geojson = json.load(f)
+    simplificado = simplificar_geojson(geojson, tolerancia_para_zoom(zoom), decimales_para_zoom(zoom))
+    alias = alias_localizaciones()
+    for feature in simplificado['features']:
+        feature['properties']['clave'] = _clave_feature(feature, alias)
+    return json.dumps(simplificado, ensure_ascii=False, separators=(',', ':'))
+
+
+@en_memoria("geojson")
+def _geojson_version(ruta, mtime_ns, tamano, zoom):
+    precalculado = artefacto_actual(nombre_artefacto(ruta, mtime_ns, tamano, zoom))
+    return precalculado if precalculado is not None else geojson_simplificado(ruta, mtime_ns, tamano, zoom)
+
+
+@en_memoria("geojson distrito")
+def _barrios_distrito_version(ruta, mtime_ns, tamano, zoom, coddistrit):
+    geojson = json.loads(_geojson_version(ruta, mtime_ns, tamano, zoom))
+    geojson['features'] = [feature for feature in geojson['features']
+                           if str(feature['properties'].get('coddistrit')) == coddistrit]
+    return json.dumps(geojson, ensure_ascii=False, separators=(',', ':'))
+
+
+def version_fichero(ruta):
+    estado = os.stat(ruta)
+    return str(ruta), estado.st_mtime_ns, estado.st_size
+
+
+def geojson_serializado(ruta=RUTA_BARRIOS, zoom=ZOOM_MAPAS):
+    """GeoJSON simplificado para ``zoom`` ya serializado, calculado una vez por versión del fichero."""
+    return _geojson_version(*version_fichero(ruta), zoom)
+
+
+def cargar_geojson(ruta=RUTA_BARRIOS, zoom=ZOOM_MAPAS):
+    """Copia propia (modificable) del GeoJSON simplificado para ``zoom``."""
+    return json.loads(geojson_serializado(ruta, zoom))
+
+
+def cargar_barrios_de_distrito(coddistrit, ruta=RUTA_BARRIOS, zoom=ZOOM_DETALLE):
+    """Sólo los barrios del distrito ``coddistrit``, con la geometría del zoom de detalle."""
+    return json.loads(_barrios_distrito_version(*version_fichero(ruta), zoom, str(coddistrit)))
+
+
+def limites(geojson):
+    """``[[lat_min, lon_min], [lat_max, lon_max]]`` de todas las features, para ``fit_bounds``."""
+    puntos = np.array([punto for feature in geojson['features'] for poligono in _poligonos(feature['geometry'])
+                       for anillo in poligono for punto in anillo])
+    (lon_min, lat_min), (lon_max, lat_max) = puntos.min(axis=0), puntos.max(axis=0)
+    return [[float(lat_min), float(lon_min)], [float(lat_max), float(lon_max)]]
+
+
+# ----------------------------
+# Índice nombre canónico -> features
+# ----------------------------
+# Cada feature lleva en ``clave`` su nombre canónico (con acentos, variantes y
+# alias resueltos como en las incidencias). Las métricas se pegan a los
+# polígonos reindexando una Series por esas claves, y el índice permite avisar
+# de los nombres que no encuentran polígono en lugar de pintarlos a 0 o en gris.
+@dataclass
+class IndiceNombres:
+    """Nombre canónico de cada feature (en orden) y posiciones de las features de cada nombre."""
+    claves: pd.Index
+    posiciones: dict
+
+    def sin_geometria(self, nombres):
+        """Nombres de ``nombres`` que no corresponden a ninguna feature."""
+        return sorted(set(map(str, nombres)) - set(self.posiciones))
+
+    def sin_datos(self, nombres):
+        """Nombres de features que no aparecen en ``nombres``."""
+        return sorted(set(self.posiciones) - set(map(str, nombres)))
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _indice_version(ruta, mtime_ns, tamano):
+    with open(ruta, "r", encoding="utf-8") as f:
+        features = json.load(f)['features']
+    alias = alias_localizaciones()
+    claves = pd.Index([_clave_feature(feature, alias) for feature in features], dtype=object)
+    posiciones = pd.Series(np.arange(len(claves))).groupby(claves.to_numpy()).indices
+    posiciones.pop('', None)
+    return IndiceNombres(claves, posiciones)
+
+
+def indice_nombres(ruta=RUTA_BARRIOS):
+    """Índice de nombres canónicos del GeoJSON ``ruta``, construido una vez por versión del fichero."""
+    return _indice_version(*version_fichero(ruta))
+
+
+def claves_features(geojson):
+    """Nombre canónico de cada feature de ``geojson``, en orden."""
+    return pd.Index([feature['properties'].get('clave', '') for feature in geojson['features']], dtype=object)
+
+
+def propiedad_numerica(geojson, nombre, defecto):
+    """Array con la propiedad ``nombre`` de cada feature (``defecto`` si falta o no es numérica)."""
+    valores = pd.to_numeric(pd.Series([feature['properties'].get(nombre) for feature in geojson['features']],
+                                      dtype=object), errors='coerce')
+    return valores.fillna(defecto).to_numpy()
+
+
+def asignar_propiedades(geojson, columnas):
+    """Asigna a cada feature el valor de cada columna (arrays alineados con las features) de una pasada."""
+    tabla = pd.DataFrame(columnas)
+    for feature, fila in zip(geojson['features'], tabla.to_dict('records')):
+        feature['properties'].update(fila)
+    return geojson
@@ -0,0 +1,91 @@
+import io
+
+from cache_memoria import en_memoria
+from instrumentacion import medido
+
+# ----------------------------
+# Gráficos de matplotlib como imágenes cacheadas
+# ----------------------------
+# Cada gráfico se dibuja en una Figure propia, sin pasar por pyplot (que guarda
+# todas las figuras en un registro global hasta que se cierran), se convierte
+# a PNG y se libera. El PNG queda en la caché de resultados con la clave de los
+# datos que representa: mientras no cambien, las siguientes ejecuciones de
+# cualquier sesión lo envían tal cual, sin importar matplotlib ni dibujar nada.
+# Las páginas lo muestran con ``st.image(png, use_column_width=True)``.
+DPI = 200  # el mismo que usa st.pyplot
+
+
+@medido("dibujar PNG (matplotlib)")
+def _png(dibujar, tamano):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figura = Figure(figsize=tamano)
+    FigureCanvasAgg(figura)
+    try:
+        dibujar(figura)
+        buffer = io.BytesIO()
+        figura.savefig(buffer, format='png', dpi=DPI, bbox_inches='tight')
+    finally:
+        figura.clear()
+    return buffer.getvalue()
+
+
+def _clave(datos):
+    # Los agregados de los gráficos son pequeños: su contenido es la clave
+    return tuple(datos.reset_index().itertuples(index=False, name=None))
+
+
+# ------------ Tarta de temas (app.py) ------------
+@en_memoria("gráficos")
+def _tarta_temas(datos, _conteos):
+    def dibujar(figura):
+        ax = figura.subplots()
+        ax.pie(_conteos, labels=_conteos.index, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')
+    return _png(dibujar, (7, 7))
+
+
+def tarta_temas(conteos):
+    """PNG de la tarta con el reparto de ``conteos`` (incidencias por tema)."""
+    return _tarta_temas(('tarta', _clave(conteos)), conteos)
+
+
+# ------------ Tema dominante por clúster (2_Clustering.py) ------------
+@en_memoria("gráficos")
+def _barras_tema_dominante(datos, _df):
+    def dibujar(figura):
+        ax = figura.subplots()
+        for _, row in _df.iterrows():
+            ax.bar(row['cluster'], row['proporcion'], label=row['tema'])
+        ax.set_title("Tema más relevante por clúster")
+        ax.set_ylabel("Proporción media del tema dominante")
+        ax.set_xlabel("Clúster")
+        ax.set_ylim(0, 1)
+        ax.set_xticks(_df['cluster'])
+        ax.legend(title='Tema')
+    return _png(dibujar, (7, 4))
+
+
+def barras_tema_dominante(df_tema_dominante):
+    """PNG de barras con la proporción del tema dominante de cada clúster (columnas cluster, tema, proporcion)."""
+    return _barras_tema_dominante(('tema dominante', _clave(df_tema_dominante)), df_tema_dominante)
+
+
+# ------------ Barrido de k (2_Clustering.py) ------------
+@en_memoria("gráficos")
+def _curvas_barrido(datos, _resumen):
+    def dibujar(figura):
+        ax_inercia, ax_silueta = figura.subplots(1, 2)
+        ax_inercia.plot(_resumen.index, _resumen['inercia'], marker='o')
+        ax_inercia.set_title("Inercia (mejor semilla)")
+        ax_inercia.set_xlabel("k")
+        ax_silueta.plot(_resumen.index, _resumen['silueta_media'], marker='o', color='green')
+        ax_silueta.set_title("Silueta media")
+        ax_silueta.set_xlabel("k")
+    return _png(dibujar, (10, 3.5))
+
+
+def curvas_barrido(resumen):
+    """PNG con la inercia y la silueta media de cada k de ``resumen`` (ver clustering.resumir_barrido)."""
+    return _curvas_barrido(('barrido', _clave(resumen)), resumen)
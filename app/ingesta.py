@@ -0,0 +1,40 @@
+"""Ingesta de incidencias nuevas sin recalcular todo.
+
+Uso (desde la raíz del repositorio):
+
+    python app/ingesta.py                      # ingiere la cola añadida a total-castellano.csv
+    python app/ingesta.py --delta nuevas.csv   # ingiere un fichero delta con el mismo formato
+
+Actualiza el almacén columnar y el cubo de conteos y lista las series
+(tema, barrio) que han cambiado; los resultados derivados de las demás siguen
+siendo válidos porque se indexan por la huella de sus datos de entrada.
+"""
+import argparse
+
+from agregados import actualizar_cubo
+from datos import RUTA_INCIDENCIAS, ingerir_delta, sincronizar_almacen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta incremental de incidencias")
+    parser.add_argument("--delta", help="fichero CSV con incidencias nuevas")
+    parser.add_argument("--csv", default=str(RUTA_INCIDENCIAS), help="CSV principal de incidencias")
+    args = parser.parse_args()
+
+    if args.delta:
+        manifiesto = ingerir_delta(args.delta, args.csv)
+    else:
+        manifiesto = sincronizar_almacen(args.csv)
+
+    cubo, cambios = actualizar_cubo(args.csv)
+    print(f"Versión de datos: {manifiesto['version']} ({len(manifiesto['partes'])} partes)")
+    if cambios is None:
+        print("Cubo reconstruido por completo: todos los resultados derivados se recalcularán.")
+    else:
+        print(f"Series (tema, barrio) con incidencias nuevas: {len(cambios)}")
+        for tema, barrio in sorted(cambios):
+            print(f"  {tema} / {barrio}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from cache_memoria import obtener_cache
+
+# ----------------------------
+# Instrumentación por tramos
+# ----------------------------
+# Cada etapa del pipeline va dentro de ``with tramo("nombre"):``. Un tramo
+# registra su tiempo, el pico de memoria (RSS) que alcanza respecto al inicio,
+# las filas que procesa si se indican y, en los tramos que envuelven una
+# función cacheada (``cache=True``), si fue acierto o fallo de caché: en un
+# fallo la función se ejecuta y abre sus propios tramos dentro; en un acierto,
+# no. Los tramos se ven en un panel de la barra lateral (con ``?depurar=1`` en
+# la URL) y, con la variable de entorno INCIDENCIAS_TRAMOS_JSON=1, se emiten
+# como una línea JSON por tramo con el identificador de la sesión. Sin panel ni
+# log, ``tramo`` no mide nada.
+PARAMETRO_PANEL = "depurar"
+VARIABLE_LOG = "INCIDENCIAS_TRAMOS_JSON"
+EJECUCIONES_POR_SESION = 20
+
+logger = logging.getLogger("incidencias.tramos")
+if os.environ.get(VARIABLE_LOG) == "1":
+    _manejador = logging.StreamHandler()
+    _manejador.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_manejador)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Ejecución del script en curso (una por hilo de sesión) y pila de tramos abiertos
+_ejecucion = ContextVar("ejecucion", default=None)
+_pila = ContextVar("pila_tramos", default=())
+
+
+def _memoria_mb(campo):
+    # VmRSS / VmHWM de Linux; sin /proc no se mide la memoria
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith(campo):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _reiniciar_pico():
+    # Devuelve VmHWM al RSS actual. Es de todo el proceso: con varias sesiones
+    # midiendo a la vez, los picos son aproximados
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class Ejecucion:
+    """Tramos de una ejecución de una página, con el panel donde se van mostrando."""
+
+    def __init__(self, pagina, sesion, numero, panel, panel_cache=None):
+        self.pagina = pagina
+        self.sesion = sesion
+        self.numero = numero
+        self.inicio = time.time()
+        self.tramos = []
+        self.abiertos = 0
+        self.panel = panel
+        self.panel_cache = panel_cache
+
+    def como_dict(self):
+        return {'pagina': self.pagina, 'sesion': self.sesion, 'ejecucion': self.numero,
+                'inicio': round(self.inicio, 3), 'tramos': self.tramos}
+
+
+class Tramo:
+    def __init__(self, nombre, filas=None, cache=False):
+        self.nombre = nombre
+        self.filas = filas
+        self.cache = cache
+        self.hijos = 0
+        self.pico_hijos = 0.0
+
+    def _estado_cache(self):
+        # La página puede anotar otro estado (p. ej. "en segundo plano") con ``t.cache = ...``
+        if isinstance(self.cache, str) or not self.cache:
+            return self.cache or None
+        return 'fallo' if self.hijos else 'acierto'
+
+    def __enter__(self):
+        pila = _pila.get()
+        if pila:
+            padre = pila[-1]
+            padre.hijos += 1
+            # El pico que llevaba el padre se guarda antes de reiniciarlo para este tramo
+            padre.pico_hijos = max(padre.pico_hijos, _memoria_mb("VmHWM"))
+        self._token = _pila.set(pila + (self,))
+        ejecucion = _ejecucion.get()
+        self._orden = ejecucion.abiertos if ejecucion is not None else 0
+        if ejecucion is not None:
+            ejecucion.abiertos += 1
+        _reiniciar_pico()
+        self._rss = _memoria_mb("VmRSS")
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        segundos = time.perf_counter() - self._inicio
+        pico = max(_memoria_mb("VmHWM"), self.pico_hijos)
+        _pila.reset(self._token)
+        pila = _pila.get()
+        if pila:
+            pila[-1].pico_hijos = max(pila[-1].pico_hijos, pico)
+
+        registro = {'tramo': self.nombre, 'nivel': len(pila), 'orden': self._orden, 'ms': round(segundos * 1000, 2),
+                    'pico_mb': round(max(0.0, pico - self._rss), 1), 'filas': self.filas,
+                    'cache': self._estado_cache(),
+                    'error': tipo.__name__ if tipo else None}
+        ejecucion = _ejecucion.get()
+        if ejecucion is not None:
+            ejecucion.tramos.append(registro)
+            if ejecucion.panel is not None and not pila:
+                _dibujar_tramos(ejecucion)
+        if logger.isEnabledFor(logging.INFO):
+            contexto = ejecucion.como_dict() if ejecucion is not None else {}
+            contexto.pop('tramos', None)
+            logger.info(json.dumps({**contexto, 'hilo': threading.current_thread().name, **registro},
+                                   ensure_ascii=False))
+        return False
+
+
+class _TramoInactivo:
+    # Lo que devuelve ``tramo`` cuando no hay nada que registrar: no mide ni guarda nada
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        return False
+
+    def __setattr__(self, nombre, valor):
+        pass
+
+
+_INACTIVO = _TramoInactivo()
+
+
+def tramo(nombre, filas=None, cache=False):
+    """Contexto que mide la etapa ``nombre``; ``t.filas = n`` dentro del bloque anota las filas."""
+    ejecucion = _ejecucion.get()
+    if (ejecucion is None or ejecucion.panel is None) and not logger.isEnabledFor(logging.INFO):
+        return _INACTIVO
+    return Tramo(nombre, filas, cache)
+
+
+def medido(nombre):
+    """Decorador: cada llamada a la función es un tramo ``nombre``."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with tramo(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def tramos_por_elemento(nombre, iterable):
+    """Recorre ``iterable`` midiendo como tramo la obtención de cada elemento (p. ej. cada bloque del CSV)."""
+    iterador = iter(iterable)
+    while True:
+        with tramo(nombre) as t:
+            elemento = next(iterador, _INACTIVO)
+            if elemento is not _INACTIVO and hasattr(elemento, '__len__'):
+                t.filas = len(elemento)
+        if elemento is _INACTIVO:
+            return
+        yield elemento
+
+
+# ------------ Panel en la barra lateral ------------
+def _dibujar_tramos(ejecucion):
+    # Cada tramo bajo el que lo contiene, en el orden en que se abrieron
+    tramos = pd.DataFrame(ejecucion.tramos).sort_values('orden')
+    resumen = (tramos.groupby(['nivel', 'tramo'], sort=False)
+               .agg(llamadas=('ms', 'size'), ms=('ms', 'sum'), pico_mb=('pico_mb', 'max'),
+                    filas=('filas', lambda f: f.sum(min_count=1)), aciertos=('cache', lambda c: (c == 'acierto').sum()),
+                    fallos=('cache', lambda c: c.isin(['fallo', 'en segundo plano']).sum()))
+               .reset_index())
+    resumen['tramo'] = ['· ' * nivel + nombre for nivel, nombre in zip(resumen['nivel'], resumen['tramo'])]
+    ejecucion.panel.dataframe(resumen.drop(columns='nivel').round(1), hide_index=True, use_container_width=True)
+    if ejecucion.panel_cache is not None:
+        _dibujar_cache(ejecucion.panel_cache)
+
+
+def _dibujar_cache(panel):
+    cache = obtener_cache()
+    with panel.container():
+        st.caption(f"Caché de resultados: {cache.bytes / 1024 ** 2:.1f} de {cache.presupuesto / 1024 ** 2:.0f} MB "
+                   "(todas las sesiones).")
+        estadisticas = cache.estadisticas()
+        if len(estadisticas):
+            st.dataframe(estadisticas.round(2), use_container_width=True)
+
+
+def iniciar_instrumentacion(pagina):
+    """Empieza el registro de tramos de esta ejecución de ``pagina`` y, con ``?depurar=1``, dibuja el panel."""
+    contexto = get_script_run_ctx()
+    sesion = contexto.session_id if contexto is not None else None
+    historial = st.session_state.setdefault('tramos_sesion', deque(maxlen=EJECUCIONES_POR_SESION))
+
+    panel = panel_cache = None
+    if st.query_params.get(PARAMETRO_PANEL) == "1":
+        with st.sidebar.expander("⏱️ Instrumentación", expanded=True):
+            st.caption("Tiempo, pico de memoria, filas y caché de cada etapa de esta ejecución.")
+            panel = st.empty()
+            panel_cache = st.empty()
+            _dibujar_cache(panel_cache)
+            st.download_button("Descargar tramos de la sesión (JSON)",
+                               json.dumps([e.como_dict() for e in historial], ensure_ascii=False, indent=1),
+                               file_name=f"tramos-{sesion}.json", mime="application/json")
+
+    ejecucion = Ejecucion(pagina, sesion, historial[-1].numero + 1 if historial else 1, panel, panel_cache)
+    historial.append(ejecucion)
+    _ejecucion.set(ejecucion)
+    _pila.set(())
+    return ejecucion
+
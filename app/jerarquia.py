@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+
+from agregados import obtener_cubo
+from cache_memoria import en_memoria
+from datos import RUTA_INCIDENCIAS, cargar_artefacto, ruta_artefacto, version_incidencias
+from instrumentacion import medido
+from prediccion import HORIZONTE_MAXIMO, TEST_SIZE, clave_pronostico, leer_o_ajustar
+from pronostico_vectorizado import PronosticosLote, alinear_por_la_derecha, matriz_series, pronosticar_matriz
+from trabajos import resultado_en_segundo_plano
+
+# ----------------------------
+# Pronóstico jerárquico: ciudad → distrito → barrio, y ciudad → tema
+# ----------------------------
+# Sólo se ajustan las series agregadas (total de la ciudad, cada distrito y cada
+# tema): unas decenas de ajustes en lugar de uno por combinación tema/barrio.
+# Tras reconciliarlas para que distritos y temas sumen la ciudad, se reparten
+# entre localizaciones y temas con las proporciones recientes de cada celda, de
+# modo que los barrios suman su distrito y los distritos suman la ciudad.
+RECONCILIACIONES = {
+    'proporcional': 'Proporcional al total de la ciudad',
+    'ols': 'Mínimos cuadrados (OLS)',
+}
+
+# Meses recientes con los que se calculan las proporciones del reparto; el
+# histórico completo sólo pesa para no dejar sin reparto celdas sin datos recientes
+VENTANA_PROPORCIONES = 12
+PESO_HISTORICO = 1e-3
+ITERACIONES_IPF = 20
+MIN_MESES_AJUSTE = 2
+
+
+def _razon(a, b):
+    return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b > 0)
+
+
+# ------------ Series agregadas ------------
+def series_agregadas(cubo, test_size=TEST_SIZE):
+    """Series que se ajustan de verdad: la ciudad, cada distrito y cada tema.
+
+    Devuelve las etiquetas ``(tema, lugar)`` de cada fila, la matriz (serie × mes)
+    hasta el corte común de entrenamiento y el primer mes con datos de cada fila
+    (-1 si no tiene ninguno).
+    """
+    fin = len(cubo.meses) - test_size
+    conteos = cubo.conteos[:, :, :fin].astype(np.int64)
+    por_distrito = np.zeros((len(cubo.distritos), fin), dtype=np.int64)
+    np.add.at(por_distrito, cubo.distrito_de_loc, conteos.sum(axis=1))
+
+    X = np.vstack([conteos.sum(axis=(0, 1))[None, :], por_distrito, conteos.sum(axis=0)])
+    etiquetas = ([('TODOS', 'TODOS')] + [('TODOS', distrito) for distrito in cubo.distritos]
+                 + [(tema, 'TODOS') for tema in cubo.temas])
+
+    con_datos = X > 0
+    primero = np.where(con_datos.any(axis=1), con_datos.argmax(axis=1), -1)
+    return etiquetas, X, primero
+
+
+def entrenamientos_agregados(cubo, test_size=TEST_SIZE):
+    """``(tema, lugar) -> df_train`` de las series agregadas que se pueden ajustar."""
+    etiquetas, X, primero = series_agregadas(cubo, test_size)
+    fin = X.shape[1]
+    return {etiqueta: pd.DataFrame({'ds': cubo.meses[primero[s]:fin], 'y': X[s, primero[s]:]})
+            for s, etiqueta in enumerate(etiquetas)
+            if primero[s] >= 0 and fin - primero[s] >= MIN_MESES_AJUSTE}
+
+
+def _pronosticar_agregados(cubo, motor, horizonte, test_size):
+    """``yhat``, ``yhat_lower`` y ``yhat_upper`` de las series agregadas sobre el eje común de meses."""
+    etiquetas, X, primero = series_agregadas(cubo, test_size)
+    fin = X.shape[1]
+    validas = np.flatnonzero((primero >= 0) & (fin - primero >= MIN_MESES_AJUSTE))
+    bandas = np.zeros((3, len(etiquetas), fin + horizonte))
+
+    if motor == 'prophet':
+        # Misma clave que la página: la ciudad y los temas comparten caché con ella
+        for s, (etiqueta, df_train) in zip(validas, entrenamientos_agregados(cubo, test_size).items()):
+            forecast = leer_o_ajustar(clave_pronostico(*etiqueta, df_train, periodos=horizonte), df_train,
+                                      periodos=horizonte)
+            bandas[:, s, primero[s]:] = forecast[['yhat', 'yhat_lower', 'yhat_upper']].to_numpy().T
+    else:
+        Y, activo = alinear_por_la_derecha(X[validas], primero[validas], np.full(len(validas), fin))
+        for k, banda in enumerate(pronosticar_matriz(Y, activo, horizonte, motor)):
+            bandas[k, validas, fin + horizonte - banda.shape[1]:] = banda
+
+    # Antes del primer mes con datos la serie no existe
+    bandas[:, np.arange(fin + horizonte)[None, :] < np.where(primero >= 0, primero, fin + horizonte)[:, None]] = 0
+    return bandas
+
+
+# ------------ Reconciliación y reparto ------------
+def _reconciliar(ciudad, distritos, temas, metodo):
+    """Ajusta los pronósticos para que distritos y temas sumen el total de la ciudad."""
+    if metodo == 'ols':
+        # OLS en cada árbol de dos niveles: el total se acerca a la suma de los hijos
+        # y cada hijo recibe una parte igual de la discrepancia que queda
+        totales = [(len(hijos) * ciudad + hijos.sum(axis=0)) / (len(hijos) + 1) for hijos in (distritos, temas)]
+        ciudad = np.mean(totales, axis=0)
+        distritos, temas = (np.clip(hijos + (ciudad - hijos.sum(axis=0)) / len(hijos), 0, None)
+                            for hijos in (distritos, temas))
+    # Reparto proporcional del total (tras OLS sólo corrige el efecto del recorte a cero)
+    distritos, temas = (hijos * _razon(ciudad, hijos.sum(axis=0)) for hijos in (distritos, temas))
+    return ciudad, distritos, temas
+
+
+def _repartir(cubo, fin, distritos, temas):
+    """Reparte los pronósticos entre localizaciones y temas con ajuste proporcional iterativo (IPF).
+
+    Devuelve un array (localización, tema, mes) cuyas filas suman exactamente la
+    parte de su distrito y cuyas columnas se aproximan al total de cada tema.
+    """
+    conteos = cubo.conteos[:, :, :fin].astype(float)
+    semilla = conteos[:, :, -VENTANA_PROPORCIONES:].sum(axis=2) + PESO_HISTORICO * conteos.sum(axis=2)
+
+    por_loc = semilla.sum(axis=1)
+    por_distrito = np.bincount(cubo.distrito_de_loc, weights=por_loc, minlength=len(cubo.distritos))
+    filas = distritos[cubo.distrito_de_loc] * _razon(por_loc, por_distrito[cubo.distrito_de_loc])[:, None]
+
+    celdas = np.repeat(semilla[:, :, None], distritos.shape[1], axis=2)
+    for _ in range(ITERACIONES_IPF):
+        celdas *= _razon(temas, celdas.sum(axis=0))[None, :, :]
+        celdas *= _razon(filas, celdas.sum(axis=1))[:, None, :]
+    return celdas, semilla
+
+
+def _bandas_derivadas(yhat, padre, padre_lower, padre_upper):
+    # Intervalo del padre escalado como un ruido de Poisson: la desviación crece con la raíz del nivel
+    escala = np.sqrt(_razon(yhat, padre))
+    return np.clip(yhat - (padre - padre_lower) * escala, 0, None), yhat + (padre_upper - padre) * escala
+
+
+@medido("pronóstico jerárquico")
+def pronosticar_jerarquia(cubo, motor='ets', reconciliacion='proporcional', horizonte=HORIZONTE_MAXIMO,
+                          test_size=TEST_SIZE):
+    """Pronósticos coherentes de todas las combinaciones tema/barrio a partir de las series agregadas.
+
+    Devuelve un ``PronosticosLote`` con las mismas claves que ``pronosticar_cubo``,
+    pero con un corte de entrenamiento común (``test_size`` meses antes del
+    final del cubo): en las series cuyos datos acaban antes, los meses de prueba
+    quedan dentro del entrenamiento (ver ``PronosticosLote.primer_mes_pronosticado``).
+    """
+    fin = len(cubo.meses) - test_size
+    D = len(cubo.distritos)
+    yhat, lower, upper = _pronosticar_agregados(cubo, motor, horizonte, test_size)
+    ciudad, distritos, temas = _reconciliar(yhat[0], yhat[1:1 + D], yhat[1 + D:], reconciliacion)
+    celdas, semilla = _repartir(cubo, fin, distritos, temas)
+
+    # Misma disposición que matriz_series: barrio × tema, con 'TODOS' al final de cada eje
+    B, T, M = len(cubo.barrios), len(cubo.temas), celdas.shape[2]
+    completo = np.zeros((B + 1, T + 1, M))
+    np.add.at(completo, cubo.barrio_de_loc, np.concatenate([celdas, celdas.sum(axis=1, keepdims=True)], axis=1))
+    completo[B, :T] = completo[:B, :T].sum(axis=0)
+    completo[B, T] = ciudad
+
+    # Padre ajustado de cada serie: el distrito principal del barrio, el propio tema o la ciudad
+    principal = (pd.Series(semilla.sum(axis=1)).groupby(cubo.barrio_de_loc).idxmax()
+                 .reindex(range(B), fill_value=0).to_numpy())
+    padres = np.zeros((3, B + 1, T + 1, M))
+    padres[:, :B] = np.stack([yhat, lower, upper])[:, 1 + cubo.distrito_de_loc[principal], None, :]
+    padres[:, B, :T] = np.stack([yhat, lower, upper])[:, 1 + D:]
+    padres[:, B, T] = np.stack([yhat, lower, upper])[:, 0]
+    completo_lower, completo_upper = _bandas_derivadas(completo, *padres)
+
+    X, claves, primero, ultimo = matriz_series(cubo)
+    validas = np.flatnonzero((primero >= 0) & (ultimo - primero + 1 >= test_size + 2))
+    indice = {claves[s]: i for i, s in enumerate(validas)}
+    return PronosticosLote(indice, cubo.meses[primero[validas]], fin - primero[validas], horizonte,
+                           *(matriz.reshape(-1, M)[validas] for matriz in (completo, completo_lower, completo_upper)))
+
+
+def numero_de_ajustes(cubo):
+    """Series que ajusta el modo jerárquico frente a las de ajustar cada combinación."""
+    return 1 + len(cubo.distritos) + len(cubo.temas), (len(cubo.barrios) + 1) * (len(cubo.temas) + 1)
+
+
+@en_memoria("pronósticos jerárquicos", spinner="Pronosticando la jerarquía ciudad → distrito → barrio...")
+def _jerarquia_version(ruta, version, motor, reconciliacion, periodo):
+    if periodo is None:
+        precalculado = cargar_artefacto(version, f"jerarquia-{motor}-{reconciliacion}")
+        if precalculado is not None:
+            return precalculado
+    cubo = obtener_cubo(ruta)
+    return pronosticar_jerarquia(cubo if periodo is None else cubo.recortar(*periodo), motor=motor,
+                                 reconciliacion=reconciliacion)
+
+
+def obtener_pronosticos_jerarquicos(motor='ets', reconciliacion='proporcional', ruta=RUTA_INCIDENCIAS,
+                                    periodo=None):
+    """Pronósticos jerárquicos de todas las series, una vez por versión de datos, motor, reconciliación y periodo."""
+    return _jerarquia_version(*version_incidencias(ruta), motor, reconciliacion, periodo)
+
+
+def pedir_pronosticos_jerarquicos(motor='ets', reconciliacion='proporcional', ruta=RUTA_INCIDENCIAS, periodo=None):
+    """Como ``obtener_pronosticos_jerarquicos``, pero con Prophet no ajusta en la petición.
+
+    Si no están precalculados ni en memoria, los ajustes de Prophet (unas
+    decenas de series) se hacen en segundo plano y se devuelve ``None``.
+    """
+    if motor != 'prophet':
+        return obtener_pronosticos_jerarquicos(motor, reconciliacion, ruta, periodo)
+    ruta, version = version_incidencias(ruta)
+    if periodo is None and ruta_artefacto(version, f"jerarquia-{motor}-{reconciliacion}").exists():
+        return _jerarquia_version(ruta, version, motor, reconciliacion, periodo)
+    # Misma clave que _jerarquia_version: el resultado del trabajo queda en su caché
+    cubo = obtener_cubo(ruta)
+    return resultado_en_segundo_plano(('pronósticos jerárquicos', ruta, version, motor, reconciliacion, periodo),
+                                      pronosticar_jerarquia, cubo if periodo is None else cubo.recortar(*periodo),
+                                      motor, reconciliacion,
+                                      descripcion="Ajuste de Prophet de las series agregadas")
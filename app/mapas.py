@@ -0,0 +1,76 @@
+import streamlit as st
+
+from instrumentacion import tramo
+from geometria import (RUTA_BARRIOS, RUTA_DISTRITOS, ZOOM_MAPAS, cargar_barrios_de_distrito, cargar_geojson,
+                       indice_nombres, limites)
+
+CENTRO_VALENCIA = [39.47, -0.38]
+
+
+# ----------------------------
+# Mapa de distritos con detalle de barrios bajo demanda
+# ----------------------------
+# Los mapas abren con los distritos; al pulsar uno se cargan y se dibujan sólo
+# los barrios de ese distrito. El distrito elegido se guarda en session_state
+# (uno por mapa) y cada vista usa su propia clave del componente, para que el
+# último clic de una vista no vuelva a disparar el cambio en la siguiente.
+def _estado(clave):
+    return f"mapa_{clave}_distrito", f"mapa_{clave}_vista"
+
+
+def _cambiar_distrito(clave, coddistrit):
+    distrito, vista = _estado(clave)
+    st.session_state[distrito] = coddistrit
+    st.session_state[vista] = st.session_state.get(vista, 0) + 1
+
+
+def mapa_distritos_con_detalle(clave, capa_distritos, capa_barrios, width=1000, height=500):
+    """Dibuja el mapa ``clave``: distritos y, tras pulsar uno, sus barrios.
+
+    ``capa_distritos(m, geojson)`` y ``capa_barrios(m, geojson)`` añaden al mapa
+    ``m`` las capas de cada nivel a partir de su GeoJSON. Devuelve el código del
+    distrito mostrado, o ``None`` en la vista de distritos.
+    """
+    # folium y su componente se importan al dibujar el primer mapa, no al cargar la página
+    import folium
+    from streamlit_folium import st_folium
+
+    estado_distrito, estado_vista = _estado(clave)
+    coddistrit = st.session_state.get(estado_distrito)
+
+    m = folium.Map(location=CENTRO_VALENCIA, zoom_start=ZOOM_MAPAS)
+    if coddistrit is None:
+        st.caption("Pulsa un distrito para ver sus barrios.")
+        with tramo("capas folium"):
+            capa_distritos(m, cargar_geojson(RUTA_DISTRITOS))
+    else:
+        st.button("⬅ Volver a los distritos", key=f"mapa_{clave}_volver",
+                  on_click=_cambiar_distrito, args=(clave, None))
+        with tramo("capas folium"):
+            barrios = cargar_barrios_de_distrito(coddistrit)
+            capa_barrios(m, barrios)
+            if barrios['features']:
+                m.fit_bounds(limites(barrios))
+
+    with tramo("st_folium"):
+        salida = st_folium(m, width=width, height=height,
+                           key=f"mapa_{clave}_{st.session_state.get(estado_vista, 0)}",
+                           returned_objects=['last_active_drawing'])
+
+    pulsado = (salida or {}).get('last_active_drawing')
+    if coddistrit is None and pulsado:
+        _cambiar_distrito(clave, str(pulsado['properties']['coddistrit']))
+        st.rerun()
+    return coddistrit
+
+
+def avisar_sin_geometria(barrios, distritos):
+    """Avisa de los barrios y distritos con datos que no tienen polígono en los mapas."""
+    for nivel, ruta, nombres in (('Barrios', RUTA_BARRIOS, barrios), ('Distritos', RUTA_DISTRITOS, distritos)):
+        indice = indice_nombres(ruta)
+        faltan = indice.sin_geometria(nombres)
+        if faltan:
+            st.warning(f"{nivel} con datos que no aparecen en el mapa ({len(faltan)}): {', '.join(faltan)}")
+        vacios = indice.sin_datos(nombres)
+        if vacios:
+            st.caption(f"{nivel} del mapa sin datos, en gris ({len(vacios)}): {', '.join(vacios)}")
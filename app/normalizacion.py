@@ -0,0 +1,167 @@
+import functools
+import hashlib
+import json
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# ----------------------------
+# Normalización de localizaciones
+# ----------------------------
+# Cada columna de localización se factoriza y sólo se normalizan sus valores
+# únicos (unos cientos frente a millones de filas). Cada valor se compara por
+# su clave (mayúsculas, sin acentos ni signos) con una tabla de alias que
+# incluye los nombres de los GeoJSON y sus variantes en castellano, y se
+# sustituye por la grafía canónica, que es la de los GeoJSON.
+COLUMNAS_LOCALIZACION = ['barrio_localizacion', 'distrito_localizacion']
+
+# Localizaciones que no corresponden a ningún barrio/distrito de Valencia
+NO_VALIDOS = ['NO CONSTA', 'NO HI CONSTA', 'FORA DE VALÈNCIA', 'FORA  DE VALÈNCIA',
+              'FUERA DE VALÈNCIA', 'EN DEPENDENCIAS MUNICIPALES']
+
+# Variantes (sobre todo en castellano) -> nombre del GeoJSON
+ALIAS_LOCALIZACIONES = {
+    # Distritos
+    'CIUDAD VIEJA': 'CIUTAT VELLA',
+    'ENSANCHE': "L'EIXAMPLE",
+    'EIXAMPLE': "L'EIXAMPLE",
+    'EXTRAMUROS': 'EXTRAMURS',
+    'ZAIDIA': 'LA SAIDIA',
+    'LA ZAIDIA': 'LA SAIDIA',
+    'LLANO DEL REAL': 'EL PLA DEL REAL',
+    'PLA DEL REAL': 'EL PLA DEL REAL',
+    'OLIVERETA': "L'OLIVERETA",
+    'CUATRO CARRERAS': 'QUATRE CARRERES',
+    'POBLADOS MARITIMOS': 'POBLATS MARITIMS',
+    'CAMINOS AL GRAO': 'CAMINS AL GRAU',
+    'RASCAÑA': 'RASCANYA',
+    'POBLADOS DEL NORTE': 'POBLATS DEL NORD',
+    'POBLES DEL NORD': 'POBLATS DEL NORD',
+    'POBLADOS DEL OESTE': "POBLATS DE L'OEST",
+    "POBLES DE L'OEST": "POBLATS DE L'OEST",
+    'POBLADOS DEL SUR': 'POBLATS DEL SUD',
+    'POBLES DEL SUD': 'POBLATS DEL SUD',
+    # Barrios
+    'AYORA': 'AIORA',
+    'CABAÑAL-CAÑAMELAR': 'CABANYAL-CANYAMELAR',
+    'CAMINO DE VERA': 'CAMI DE VERA',
+    'CAMINO FONDO': 'CAMI FONDO',
+    'CAMINO REAL': 'CAMI REAL',
+    'CASAS DE BARCENA': 'LES CASES DE BARCENA',
+    'CASTELLAR-OLIVERAL': "CASTELLAR-L'OLIVERAL",
+    'CIUDAD DE LAS ARTES Y DE LAS CIENCIAS': 'CIUTAT DE LES ARTS I DE LES CIENCIES',
+    'CIUDAD FALLERA': 'CIUTAT FALLERA',
+    'CIUDAD JARDIN': 'CIUTAT JARDI',
+    'CIUDAD UNIVERSITARIA': 'CIUTAT UNIVERSITARIA',
+    'EL BOTANICO': 'EL BOTANIC',
+    'EL CALVARIO': 'EL CALVARI',
+    'EL CARMEN': 'EL CARME',
+    'EL GRAO': 'EL GRAU',
+    'EL MERCADO': 'EL MERCAT',
+    'HORNO DE ALCEDO': "EL FORN D'ALCEDO",
+    'HUERTO DE SENABRE': "L'HORT DE SENABRE",
+    'ISLA PERDIDA': "L'ILLA PERDUDA",
+    'JAIME ROIG': 'JAUME ROIG',
+    'LA AMISTAD': "L'AMISTAT",
+    'LA CRUZ CUBIERTA': 'LA CREU COBERTA',
+    'CRUZ DEL GRAO': 'LA CREU DEL GRAU',
+    'LA EXPOSICION': 'EXPOSICIO',
+    'LA FONTETA DE SAN LUIS': 'LA FONTETA S.LLUIS',
+    'LA FUENSANTA': 'LA FONTSANTA',
+    'LA LUZ': 'LA LLUM',
+    'LA MALVARROSA': 'LA MALVA-ROSA',
+    'LA PECHINA': 'LA PETXINA',
+    'LA RAYOSA': 'LA RAIOSA',
+    'LA SEO': 'LA SEU',
+    'LA VEGA BAJA': 'LA VEGA BAIXA',
+    'MARCHALENES': 'MARXALENES',
+    'MASARROCHOS': 'MASSARROJOS',
+    'MONTOLIVETE': 'MONTOLIVET',
+    'NAZARET': 'NATZARET',
+    'ORRIOLS': 'ELS ORRIOLS',
+    'PEÑARROJA': 'PENYA-ROJA',
+    'PUEBLO NUEVO': 'POBLE NOU',
+    'RUZAFA': 'RUSSAFA',
+    'SAN ANTONIO': 'SANT ANTONI',
+    'SAN FRANCISCO': 'SANT FRANCESC',
+    'SAN ISIDRO': 'SANT ISIDRE',
+    'SAN LORENZO': 'SANT LLORENS',
+    'SAN MARCELINO': "SANT MARCEL.LI",
+    'SAN PABLO': 'SANT PAU',
+    'TENDETES': 'LES TENDETES',
+    'TRES CRUCES': 'TRES FORQUES',
+    'TRINIDAD': 'TRINITAT',
+    'VARA DE CUART': 'VARA DE QUART',
+}
+
+
+def clave_localizacion(valor):
+    """Forma de comparación: mayúsculas, sin acentos, sin apóstrofos, guiones ni puntos y espacios simples."""
+    texto = ''.join(c for c in unicodedata.normalize('NFKD', str(valor)) if not unicodedata.combining(c))
+    texto = re.sub(r"[.·]", '', texto.upper())
+    return ' '.join(re.sub(r"['’`´\-]", ' ', texto).split())
+
+
+def _grafia(valor):
+    return ' '.join(str(valor).split()).upper()
+
+
+@functools.lru_cache(maxsize=4)
+def tabla_alias(rutas_geojson=()):
+    """Clave de localización -> grafía canónica (``None`` si la localización no es válida)."""
+    alias = {}
+    for ruta in rutas_geojson:
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                features = json.load(f)['features']
+        except (OSError, ValueError, KeyError):
+            continue
+        for feature in features:
+            nombre = (feature.get('properties') or {}).get('nombre')
+            if nombre:
+                alias[clave_localizacion(nombre)] = _grafia(nombre)
+
+    for variante, canonico in ALIAS_LOCALIZACIONES.items():
+        alias[clave_localizacion(variante)] = alias.get(clave_localizacion(canonico), _grafia(canonico))
+    for valor in NO_VALIDOS:
+        alias[clave_localizacion(valor)] = None
+    return alias
+
+
+def huella_alias(alias):
+    """Huella de la tabla de alias: si cambia, los datos ya ingeridos se vuelven a normalizar."""
+    return hashlib.sha1(json.dumps(sorted(alias.items()), ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def normalizar_localizacion(valor, alias):
+    """Grafía canónica de un valor suelto (``None`` si no es una localización válida)."""
+    return alias.get(clave_localizacion(valor), _grafia(valor))
+
+
+def normalizar_columna(serie, alias):
+    """Columna de localización normalizada como categoría, procesando sólo sus valores únicos.
+
+    Devuelve la columna (códigos enteros compactos sobre categorías ordenadas) y
+    una máscara con las filas cuya localización no es válida.
+    """
+    categorica = serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype('category')
+    canonicos = [normalizar_localizacion(valor, alias) for valor in categorica.cat.categories]
+    posicion, categorias = pd.factorize(pd.Series(canonicos, dtype=object), sort=True)
+
+    codigos = categorica.cat.codes.to_numpy()
+    nuevos = np.where(codigos >= 0, posicion[codigos], -1) if len(posicion) else codigos
+    invalidas = (codigos >= 0) & (nuevos < 0)
+    columna = pd.Categorical.from_codes(nuevos, categories=pd.Index(categorias, dtype=object))
+    return pd.Series(columna, index=serie.index, name=serie.name), invalidas
+
+
+def normalizar_localizaciones(df, alias, columnas=COLUMNAS_LOCALIZACION):
+    """Normaliza las columnas de localización de ``df`` y quita las filas no válidas."""
+    invalidas = np.zeros(len(df), dtype=bool)
+    for col in columnas:
+        if col in df.columns:
+            df[col], invalidas_col = normalizar_columna(df[col], alias)
+            invalidas |= invalidas_col
+    return df[~invalidas]
@@ -5,56 +5,89 @@
 
 
 import pandas as pd
-#from prophet import Prophet
-#from sklearn.metrics import mean_absolute_error, mean_squared_error
-#import numpy as np
-#import plotly.graph_objs as go
+import numpy as np
 import streamlit as st
 
-# ------------ FUNCIÓN PARA PREPARAR LOS DATOS ------------------
-def construir_df_prophet(df, tema='TODOS', barrio='TODOS'):
-    df_filtrado = df.copy()
-    if tema != 'TODOS':
-        df_filtrado = df_filtrado[df_filtrado['tema'] == tema]
-    if barrio != 'TODOS':
-        df_filtrado = df_filtrado[df_filtrado['barrio_localizacion'] == barrio]
-
-    df_filtrado = df_filtrado.set_index('fecha_entrada_ayuntamiento')
-    df_agg = df_filtrado.resample('MS').size().reset_index(name='y')
-    df_agg.rename(columns={'fecha_entrada_ayuntamiento': 'ds'}, inplace=True)
-    return df_agg
+from agregados import obtener_cubo
+from arranque import precalentar
+from backtesting import HORIZONTE_BACKTEST, N_CORTES, backtest, cargar_backtest, guardar_backtest, resumir
+from cache_memoria import en_memoria
+from datos import version_incidencias
+from instrumentacion import iniciar_instrumentacion, tramo
+from jerarquia import (RECONCILIACIONES, numero_de_ajustes, obtener_pronosticos_jerarquicos,
+                       pedir_pronosticos_jerarquicos)
+from prediccion import (HORIZONTE_MAXIMO, TEST_SIZE, construir_df_prophet, pedir_pronostico,
+                        separar_entrenamiento)
+from periodo import cubo_del_periodo
+from pronostico_vectorizado import METODOS, obtener_pronosticos_rapidos
+
+# Motores disponibles: Prophet (preciso, un ajuste por serie) o los vectorizados (todas las series a la vez)
+MOTORES = {'prophet': 'Prophet (alta precisión)', **{m: f"{nombre} (rápido)" for m, nombre in METODOS.items()}}
 
 # ------------ FUNCIÓN PRINCIPAL DE PRONÓSTICO ------------------
-def ejecutar_forecast(df, tema='TODOS', barrio='TODOS', periodos_pred=6, test_size=6):
-    df_prophet = construir_df_prophet(df, tema=tema, barrio=barrio)
+def ejecutar_forecast(cubo, tema='TODOS', barrio='TODOS', periodos_pred=6, test_size=TEST_SIZE, motor='prophet',
+                      reconciliacion=None, periodo=None):
+    with tramo("serie mensual") as t:
+        df_prophet = construir_df_prophet(cubo, tema=tema, barrio=barrio)
+        t.filas = len(df_prophet)
 
     if df_prophet.shape[0] < test_size + 2:
         st.error("❌ No hay suficientes datos para entrenar y evaluar.")
         return
 
-    df_train = df_prophet.iloc[:-test_size]
-    df_test = df_prophet.iloc[-test_size:]
-
-    modelo = Prophet()
-    modelo.fit(df_train)
-
-    future = modelo.make_future_dataframe(periods=periodos_pred, freq='MS')
-    forecast = modelo.predict(future)
-
-    forecast[['yhat', 'yhat_lower', 'yhat_upper']] = forecast[['yhat', 'yhat_lower', 'yhat_upper']].clip(lower=0)
+    df_train, df_test = separar_entrenamiento(df_prophet, test_size)
+
+    # Pronóstico cacheado hasta el horizonte máximo; el slider sólo lo recorta
+    evaluable = True
+    with tramo(f"pronóstico {motor}", cache=True) as t:
+        if reconciliacion is not None:
+            lote = pedir_pronosticos_jerarquicos(motor, reconciliacion, periodo=periodo)
+            if lote is None:
+                t.cache = "en segundo plano"
+                st.info("ℹ️ Prophet se está ajustando en segundo plano; mientras tanto se muestra el pronóstico "
+                        "jerárquico rápido (ETS), que se sustituirá en cuanto termine.")
+                lote = obtener_pronosticos_jerarquicos('ets', reconciliacion, periodo=periodo)
+            forecast_completo = lote.serie(tema=tema, barrio=barrio)
+            # El corte de la jerarquía es común: si la serie acaba antes que el cubo, su prueba no es ciega
+            evaluable = lote.primer_mes_pronosticado(tema=tema, barrio=barrio) <= df_test['ds'].iloc[0]
+        elif motor == 'prophet':
+            forecast_completo = pedir_pronostico(df_train, tema=tema, barrio=barrio)
+            if forecast_completo is None:
+                t.cache = "en segundo plano"
+                # Mientras Prophet se ajusta en segundo plano se muestra el pronóstico rápido
+                st.info("ℹ️ Prophet se está ajustando en segundo plano; mientras tanto se muestra el pronóstico "
+                        "rápido (ETS), que se sustituirá en cuanto termine.")
+                forecast_completo = obtener_pronosticos_rapidos('ets', periodo=periodo).serie(tema=tema,
+                                                                                             barrio=barrio)
+        else:
+            forecast_completo = obtener_pronosticos_rapidos(motor, periodo=periodo).serie(tema=tema, barrio=barrio)
+    fin_prediccion = df_train['ds'].iloc[-1] + pd.DateOffset(months=periodos_pred)
+    forecast = forecast_completo[forecast_completo['ds'] <= fin_prediccion]
 
     # ------------------ MÉTRICAS ------------------
-    forecast_eval = forecast.set_index('ds').loc[df_test['ds']]
-    y_true = df_test['y'].values
-    y_pred = forecast_eval['yhat'].values
+    if evaluable:
+        forecast_eval = forecast_completo.set_index('ds').loc[df_test['ds']]
+        y_true = df_test['y'].values
+        y_pred = forecast_eval['yhat'].values
 
-    mae = mean_absolute_error(y_true, y_pred)
-    rmse = mean_squared_error(y_true, y_pred, squared=False)
-    mape = np.mean(np.abs((y_true - y_pred) / np.maximum(y_true, 1))) * 100
+        # Con numpy, como el MAPE: importar sklearn.metrics costaría más que el cálculo
+        mae = np.mean(np.abs(y_true - y_pred))
+        rmse = np.sqrt(np.mean((y_true - y_pred) ** 2))
+        mape = np.mean(np.abs((y_true - y_pred) / np.maximum(y_true, 1))) * 100
 
+        col_mae, col_rmse, col_mape = st.columns(3)
+        col_mae.metric("MAE", f"{mae:.2f}")
+        col_rmse.metric("RMSE", f"{rmse:.2f}")
+        col_mape.metric("MAPE", f"{mape:.1f} %")
+    else:
+        st.info(f"ℹ️ Esta serie no tiene datos después de {df_test['ds'].iloc[-1]:%Y-%m}: en el modo "
+                "jerárquico sus meses de prueba forman parte del entrenamiento, así que no se muestran métricas.")
 
 
     # ------------------ GRÁFICO INTERACTIVO ------------------
+    # plotly es una dependencia propia de la app (no de streamlit): se importa al dibujar
+    import plotly.graph_objs as go
+
     fig = go.Figure()
 
     fig.add_trace(go.Scatter(x=df_prophet['ds'], y=df_prophet['y'],
@@ -85,51 +118,92 @@ def ejecutar_forecast(df, tema='TODOS', barrio='TODOS', periodos_pred=6, test_si
 
     fig.update_layout(title=dict(text=f"Predicción de incidencias sobre {tema} en {barrio} ",
                                  font=dict(size=22)),
-                      xaxis=dict(title='Fecha', titlefont=dict(size=16)),
-                      yaxis=dict(title='Número de incidencias', titlefont=dict(size=16)),
+                      xaxis=dict(title=dict(text='Fecha', font=dict(size=16))),
+                      yaxis=dict(title=dict(text='Número de incidencias', font=dict(size=16))),
                       hovermode='x unified',
                       template='plotly_white',
                       height=750)
 
-    st.plotly_chart(fig, use_container_width=True)
+    with tramo("gráfico plotly"):
+        st.plotly_chart(fig, use_container_width=True)
+
+# ------------ BACKTESTING CON ORIGEN MÓVIL ------------------
+@en_memoria("backtesting")
+def _backtest_guardado(motor, version):
+    return cargar_backtest(motor, version)
+
+
+def mostrar_backtesting(cubo, tema, barrio, motor):
+    with st.expander("📏 Backtesting con origen móvil"):
+        st.markdown(f"""
+        Errores del motor en **{N_CORTES} cortes** sucesivos, evaluando los **{HORIZONTE_BACKTEST} meses**
+        siguientes a cada corte, para todas las series tema/barrio.
+        """)
+        version = version_incidencias()[1]
+        with tramo("backtesting", cache=True):
+            errores = _backtest_guardado(motor, version)
+
+        if errores is None:
+            if motor == 'prophet':
+                st.info("Aún no hay backtesting de Prophet para estos datos. "
+                        "Ejecútalo fuera de la app con `python app/backtesting.py --motor prophet`.")
+                return
+            if not st.button("Calcular backtesting"):
+                return
+            with st.spinner("Evaluando todas las series..."):
+                errores = backtest(cubo, motor, procesos=1)
+                guardar_backtest(errores, motor, version)
+                _backtest_guardado.clear()
+
+        st.markdown("**Todas las series, por horizonte**")
+        st.dataframe(resumir(errores, 'h').round(2))
+
+        serie = errores[(errores['tema'] == tema) & (errores['barrio'] == barrio)]
+        if not serie.empty:
+            st.markdown(f"**{tema} en {barrio}, por horizonte**")
+            st.dataframe(resumir(serie, 'h').round(2))
+
+        # Comparación con los demás motores ya evaluados sobre los mismos datos
+        otros = [t for m in MOTORES if (t := _backtest_guardado(m, version)) is not None]
+        if len(otros) > 1:
+            st.markdown("**Comparación de motores**")
+            comparacion = resumir(pd.concat(otros), 'motor').rename(index=MOTORES)
+            st.dataframe(comparacion.round(2))
+
 
 # ----------- "WIDGETS" ADAPTADOS A STREAMLIT ------------------
-def iniciar_forecast_interactivo(df):
+def iniciar_forecast_interactivo(cubo, periodo=None):
     st.markdown("###  Predicción de incidencias")
     
-    periodos_slider = st.slider("Periodos a predecir", min_value=1, max_value=24, value=6)
-    tema_dropdown = st.selectbox("Tema", options=['TODOS'] + sorted(df['tema'].dropna().unique()))
-    barrio_dropdown = st.selectbox("Barrio", options=['TODOS'] + sorted(df['barrio_localizacion'].dropna().unique()))
-
-    ejecutar_forecast(df, tema=tema_dropdown, barrio=barrio_dropdown, periodos_pred=periodos_slider)
+    motor = st.selectbox("Motor de predicción", options=list(MOTORES), format_func=MOTORES.get)
+    jerarquico = st.checkbox("Modo jerárquico (ciudad → distrito → barrio)")
+    reconciliacion = None
+    if jerarquico:
+        reconciliacion = st.selectbox("Reconciliación", options=list(RECONCILIACIONES),
+                                      format_func=RECONCILIACIONES.get)
+        ajustes, combinaciones = numero_de_ajustes(cubo)
+        st.caption(f"Se ajustan {ajustes} series agregadas (ciudad, distritos y temas) en lugar de "
+                   f"{combinaciones}; los barrios se reparten de ellas y suman su distrito y la ciudad.")
+    periodos_slider = st.slider("Periodos a predecir", min_value=1, max_value=HORIZONTE_MAXIMO, value=6)
+    tema_dropdown = st.selectbox("Tema", options=['TODOS'] + sorted(cubo.temas))
+    barrio_dropdown = st.selectbox("Barrio", options=['TODOS'] + sorted(cubo.barrios))
+
+    ejecutar_forecast(cubo, tema=tema_dropdown, barrio=barrio_dropdown, periodos_pred=periodos_slider, motor=motor,
+                      reconciliacion=reconciliacion, periodo=periodo)
+    # El backtesting se guarda por versión de datos: siempre sobre el histórico completo
+    mostrar_backtesting(obtener_cubo(), tema_dropdown, barrio_dropdown, motor)
 
 # ---------- LLAMADA FINAL ----------
 # (esto se pondría al final de la página de análisis temporal)
 # df = ...  # carga previa
-# iniciar_forecast_interactivo(df)
-
-#import pandas as pd
-
-# Carga tus datos aquí
-df = pd.read_csv("./app/data/total-castellano.csv", sep=';')
-
-df = df.drop(columns=['distrito_solicitante', 'barrio_solicitante'], errors='ignore')
-df = df[df['barrio_localizacion'] != 'En dependencias municipales']
-
-df['barrio_localizacion'] = df['barrio_localizacion'].str.strip().str.upper()
-df['distrito_localizacion'] = df['distrito_localizacion'].str.strip().str.upper()
-
-df['fecha_entrada_ayuntamiento'] = pd.to_datetime(df['fecha_entrada_ayuntamiento'], errors='coerce')
-df = df.dropna(subset=['fecha_entrada_ayuntamiento'])
-df = df.sort_values(by='fecha_entrada_ayuntamiento', ascending=False)
+# iniciar_forecast_interactivo(cubo)
 
-no_validos = ['NO CONSTA', 'NO HI CONSTA', 'FORA DE VALÈNCIA', 'FORA  DE VALÈNCIA', 'FUERA DE VALÈNCIA' 'EN DEPENDENCIAS MUNICIPALES']
+precalentar()
+iniciar_instrumentacion("Análisis temporal")
 
-# Filtrar el DataFrame para quedarte solo con filas válidas
-df = df[
-    (~df['distrito_localizacion'].isin(no_validos)) &
-    (~df['barrio_localizacion'].isin(no_validos))
-]
+# Cubo de conteos compartido entre páginas, recortado al periodo de la barra lateral
+with tramo("cubo", cache=True):
+    cubo, periodo = cubo_del_periodo(obtener_cubo())
 
 # Ejecuta la app
-iniciar_forecast_interactivo(df)
+iniciar_forecast_interactivo(cubo, periodo)
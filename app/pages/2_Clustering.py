@@ -1,13 +1,19 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import folium
-from folium import GeoJson, GeoJsonTooltip
-from streamlit_folium import st_folium
-from sklearn.cluster import KMeans
 import streamlit as st
-import json
+
+from agregados import obtener_cubo
+from arranque import precalentar
+from clustering import (K_MAXIMO, K_POR_DEFECTO, SEMILLAS_BARRIDO, matriz_transiciones, obtener_barrido,
+                        obtener_clustering, obtener_clustering_anual, resumir_barrido, transiciones)
+from geometria import asignar_propiedades, claves_features
+from graficos import barras_tema_dominante, curvas_barrido
+from instrumentacion import iniciar_instrumentacion, tramo
+from mapas import avisar_sin_geometria, mapa_distritos_con_detalle
+from periodo import cubo_del_periodo
 
 st.set_page_config(layout="wide")
+precalentar()
+iniciar_instrumentacion("Clustering")
 st.title("Clustering de Barrios según Tipología de Incidencias")
 
 st.markdown("""
@@ -18,38 +24,43 @@ Gracias a este enfoque, se pueden detectar zonas que comparten problemáticas si
 """)
 
 # --------- CARGA DE DATOS ---------
-df = pd.read_csv("./app/data/total-castellano.csv", sep=';')
-df = df.drop(columns=['distrito_solicitante', 'barrio_solicitante'], errors='ignore')
-df = df[df['barrio_localizacion'] != 'En dependencias municipales']
-df['fecha_entrada_ayuntamiento'] = pd.to_datetime(df['fecha_entrada_ayuntamiento'], errors='coerce')
-df['año'] = df['fecha_entrada_ayuntamiento'].dt.year
-
-df['barrio_localizacion'] = df['barrio_localizacion'].str.upper().str.strip()
-df['distrito_localizacion'] = df['distrito_localizacion'].str.upper().str.strip()
-
-no_validos = ['NO CONSTA', 'NO HI CONSTA', 'FORA DE VALÈNCIA', 'FORA  DE VALÈNCIA', 'FUERA DE VALÈNCIA', 'EN DEPENDENCIAS MUNICIPALES']
-df = df[(~df['distrito_localizacion'].isin(no_validos)) & (~df['barrio_localizacion'].isin(no_validos))]
-
-# --------- PREPROCESAMIENTO ---------
-df_barrios = df.copy()
-df_barrios['n'] = 1
-
-tabla = df_barrios.pivot_table(
-    index='barrio_localizacion',
-    columns='tema',
-    values='n',
-    aggfunc='sum',
-    fill_value=0
-)
-
-tabla_pct = tabla.div(tabla.sum(axis=1), axis=0)
-
-# --------- CLUSTERING (k=4) ---------
-k = 4
-modelo = KMeans(n_clusters=k, random_state=0)
-clusters = modelo.fit_predict(tabla_pct)
-tabla_pct = tabla_pct.reset_index()
-tabla_pct['cluster'] = clusters
+with tramo("cubo", cache=True):
+    cubo, periodo_meses = cubo_del_periodo(obtener_cubo())
+
+# --------- SELECCIÓN DE K ---------
+with st.expander("🔎 Selección del número de clústeres"):
+    st.markdown(f"""
+    Ajusta K-Means para cada k del rango con **{SEMILLAS_BARRIDO} semillas** distintas, en paralelo,
+    y muestra la inercia (método del codo) y la silueta media de cada k.
+    """)
+    rango_k = st.slider("Rango de k", min_value=2, max_value=12, value=(2, K_MAXIMO))
+    if st.button("Evaluar valores de k"):
+        with tramo("barrido de k", cache=True):
+            resumen = resumir_barrido(obtener_barrido(cubo, range(rango_k[0], rango_k[1] + 1)))
+
+        with tramo("gráfico del barrido", cache=True):
+            st.image(curvas_barrido(resumen), use_column_width=True)
+        st.dataframe(resumen.round(3))
+
+k = st.slider("Número de clústeres (k)", min_value=2, max_value=K_MAXIMO, value=K_POR_DEFECTO)
+
+# --------- CLUSTERING (cacheado por la huella de la tabla barrio × tema) ---------
+periodo = st.radio("Periodo", ["Todo el histórico", "Por año"], horizontal=True)
+
+with tramo("clustering", cache=True):
+    resultado = obtener_clustering(cubo, k, historico=periodo_meses is None)
+if periodo == "Por año":
+    # Todos los años se calculan juntos una vez; cambiar de año sólo elige uno ya hecho
+    with tramo("clustering por año", cache=True):
+        anual = obtener_clustering_anual(cubo, k)
+    anios = list(anual.resultados)
+    if not anios:
+        st.info(f"ℹ️ Ningún año del periodo tiene más de {k} barrios con incidencias: "
+                "reduce k o amplía el periodo.")
+        st.stop()
+    anio = st.select_slider("Año", options=anios, value=anios[-1])
+    resultado = anual.resultados[anio]
+tabla_pct = resultado.etiquetas.reset_index()
 
 st.subheader("Distribución de Barrios por Clúster")
 
@@ -69,7 +80,7 @@ st.dataframe(tabla_clusters)
 # --------- TEMA MÁS RELEVANTE POR CLÚSTER ---------
 st.subheader("🏆 Tema más relevante por clúster")
 
-centroides = pd.DataFrame(modelo.cluster_centers_, columns=tabla.columns)
+centroides = resultado.centroides
 tema_dominante = centroides.idxmax(axis=1)
 valor_dominante = centroides.max(axis=1)
 
@@ -79,62 +90,46 @@ df_tema_dominante = pd.DataFrame({
     'proporcion': valor_dominante
 })
 
-fig, ax = plt.subplots(figsize=(7, 4))
-for i, row in df_tema_dominante.iterrows():
-    ax.bar(row['cluster'], row['proporcion'], label=row['tema'])
-
-ax.set_title("Tema más relevante por clúster")
-ax.set_ylabel("Proporción media del tema dominante")
-ax.set_xlabel("Clúster")
-ax.set_ylim(0, 1)
-ax.set_xticks(df_tema_dominante['cluster'])
-ax.legend(title='Tema')
-st.pyplot(fig)
-
-# --------- CARGAR GEOJSON ---------
-@st.cache_data
-def cargar_geojson_limpio(ruta):
-    with open(ruta, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    features_limpias = []
-    for feature in data.get("features", []):
-        try:
-            props = feature.get("properties", {})
-            props_limpias = {}
-            for k, v in props.items():
-                if isinstance(v, (str, int, float, bool)) or v is None:
-                    props_limpias[k] = v
-                else:
-                    props_limpias[k] = str(v)
-
-            feature["properties"] = props_limpias
-
-            # Validar que la feature se puede serializar
-            json.dumps(feature)
-            features_limpias.append(feature)
-        except Exception as e:
-            st.warning(f"Feature descartada por error de serialización: {e}")
-
-    data["features"] = features_limpias
-    return data
-
-geojson_data = cargar_geojson_limpio("./app/data/barris-barrios.geojson")
-
-# --------- ASIGNAR CLUSTER A CADA BARRIO ---------
-cluster_dict = dict(zip(tabla_pct['barrio_localizacion'], tabla_pct['cluster']))
-
-for feature in geojson_data["features"]:
-    barrio = feature["properties"].get("nombre", "").upper().strip()
-    cluster = cluster_dict.get(barrio)
-    feature["properties"]["cluster"] = int(cluster) if cluster is not None else -1
-    feature["properties"]["cluster_display"] = int(cluster) + 1 if cluster is not None else 0
+with tramo("gráfico de temas dominantes", cache=True):
+    st.image(barras_tema_dominante(df_tema_dominante), use_column_width=True)
+
+# --------- CAMBIOS DE CLÚSTER ENTRE AÑOS ---------
+if periodo == "Por año" and anios.index(anio) > 0:
+    anio_previo = anios[anios.index(anio) - 1]
+    st.subheader(f"🔀 Cambios de clúster entre {anio_previo} y {anio}")
+
+    cambios = transiciones(anual, anio_previo, anio)
+    col_cambios, col_matriz = st.columns(2)
+    col_cambios.markdown(f"**{len(cambios)} barrios cambian de clúster**")
+    col_cambios.dataframe(cambios)
+    col_matriz.markdown("**Barrios que pasan de cada clúster (filas) a cada clúster (columnas)**")
+    col_matriz.dataframe(matriz_transiciones(anual, anio_previo, anio))
+
+    with st.expander("Clúster de cada barrio por año"):
+        st.dataframe((anual.etiquetas + 1).astype('Int64'))
+
+# --------- ASIGNAR CLUSTER A CADA BARRIO Y DISTRITO ---------
+clusters_barrio = resultado.etiquetas.rename(index=str)
+
+# Un distrito toma el clúster más frecuente entre sus barrios
+pares = cubo.pares_barrio_distrito()
+pares['cluster'] = pares['barrio_localizacion'].astype(str).map(clusters_barrio)
+clusters_distrito = (pares.dropna().groupby('distrito_localizacion', observed=True)['cluster']
+                     .agg(lambda c: c.mode().iloc[0]).rename(index=str))
+
+def asignar_clusters(geojson_data, clusters):
+    cluster = clusters.reindex(claves_features(geojson_data)).fillna(-1).to_numpy(int)
+    return asignar_propiedades(geojson_data, {'cluster': cluster, 'cluster_display': cluster + 1})
 
 colores_clusters = {
     0: '#e41a1c',  # rojo
     1: '#377eb8',  # azul
     2: '#4daf4a',  # verde
-    3: '#984ea3'   # morado
+    3: '#984ea3',  # morado
+    4: '#ff7f00',  # naranja
+    5: '#a65628',  # marrón
+    6: '#f781bf',  # rosa
+    7: '#e6ab02'   # amarillo
 }
 color_sin_cluster = '#8c8c8c'  # gris
 
@@ -155,27 +150,37 @@ def style_function(feature):
             'fillOpacity': 0.7
         }
 
-tooltip = GeoJsonTooltip(
-    fields=['nombre', 'cluster_display'],
-    aliases=['Barrio:', 'Clúster:'],
-    localize=True,
-    sticky=False,
-    labels=True,
-    style="""
-        background-color: #F0EFEF;
-        border: 1px solid black;
-        border-radius: 3px;
-        box-shadow: 3px;
-    """
-)
-
-m = folium.Map(location=[39.47, -0.38], zoom_start=12)
-
-GeoJson(
-    geojson_data,
-    style_function=style_function,
-    tooltip=tooltip,
-    name='Barrios'
-).add_to(m)
-
-st_folium(m, width=900, height=600)
+def capa_clusters(nivel, clusters):
+    def anadir(m, geojson_data):
+        from folium import GeoJson, GeoJsonTooltip
+
+        tooltip = GeoJsonTooltip(
+            fields=['nombre', 'cluster_display'],
+            aliases=[f'{nivel}:', 'Clúster:' if nivel == 'Barrio' else 'Clúster mayoritario:'],
+            localize=True,
+            sticky=False,
+            labels=True,
+            style="""
+                background-color: #F0EFEF;
+                border: 1px solid black;
+                border-radius: 3px;
+                box-shadow: 3px;
+            """
+        )
+
+        GeoJson(
+            asignar_clusters(geojson_data, clusters),
+            style_function=style_function,
+            tooltip=tooltip,
+            name=f'{nivel}s'
+        ).add_to(m)
+    return anadir
+
+with tramo("mapa"):
+    mapa_distritos_con_detalle(
+        "clustering",
+        capa_distritos=capa_clusters('Distrito', clusters_distrito),
+        capa_barrios=capa_clusters('Barrio', clusters_barrio),
+        width=900, height=600
+    )
+avisar_sin_geometria(clusters_barrio.index, clusters_distrito.index)
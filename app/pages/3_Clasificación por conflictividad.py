@@ -1,55 +1,16 @@
-import pandas as pd
 #import numpy as np
 import streamlit as st
-#from sklearn.ensemble import RandomForestClassifier
-#from sklearn.model_selection import train_test_split
-#from sklearn.metrics import classification_report, accuracy_score
 #import plotly.express as px
 
-# ----------- FUNCIONES -----------
-
-def preparar_datos_conflictividad(df, columnas_tema):
-    df_copy = df.copy()
-    df_copy['fecha'] = pd.to_datetime(df_copy['fecha_entrada_ayuntamiento'])
-
-    # Pivotar para obtener un conteo por tema por barrio
-    tabla_pivot = pd.pivot_table(df_copy[df_copy['tema'].isin(columnas_tema)],
-                                  index='barrio_localizacion',
-                                  columns='tema',
-                                  aggfunc='size',
-                                  fill_value=0)
-
-    # Aseguramos que todas las columnas_tema estén en el DataFrame
-    for col in columnas_tema:
-        if col not in tabla_pivot.columns:
-            tabla_pivot[col] = 0
-
-    tabla_pivot = tabla_pivot[columnas_tema]  # ordenamos columnas
-
-    # Calculamos el total de incidencias por barrio
-    tabla_pivot['total_incidencias'] = tabla_pivot.sum(axis=1)
-
-    # Asignamos nivel de conflictividad
-    tabla_pivot['nivel_conflictividad'] = pd.qcut(tabla_pivot['total_incidencias'], q=3, labels=['Bajo', 'Medio', 'Alto'])
-
-    return tabla_pivot
-
-
-def entrenar_modelo(df, temas):
-    X = df[temas]
-    y = df['nivel_conflictividad']
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
-    modelo = RandomForestClassifier(random_state=42)
-    modelo.fit(X_train, y_train)
-    y_pred = modelo.predict(X_test)
-    reporte = classification_report(y_test, y_pred, output_dict=True)
-    accuracy = accuracy_score(y_test, y_pred)
-    importancia = pd.Series(modelo.feature_importances_, index=temas).sort_values(ascending=False)
-    return modelo, accuracy, reporte, importancia
+from agregados import obtener_cubo
+from arranque import precalentar
+from conflictividad import pedir_modelo_conflictividad
+from instrumentacion import iniciar_instrumentacion, tramo
+from periodo import cubo_del_periodo
 
 # ----------- INTERFAZ STREAMLIT -----------
 
-def mostrar_modelo_conflictividad(df):
+def mostrar_modelo_conflictividad(cubo):
     st.title("Modelo de Conflictividad por Barrios")
     
 
@@ -138,25 +99,31 @@ def mostrar_modelo_conflictividad(df):
 
 
 
-    columnas_tema = sorted(df['tema'].dropna().unique())
-    df_encoded = pd.get_dummies(df[['barrio_localizacion', 'tema']], columns=['tema'])
-    temas_encoded = [col for col in df_encoded.columns if col.startswith('tema_')]
-
     st.subheader("Selección de temas a considerar")
-    temas_usados = st.multiselect("Selecciona los temas a incluir en el modelo:", opciones := sorted(df['tema'].dropna().unique()), default=opciones)
+    temas_usados = st.multiselect("Selecciona los temas a incluir en el modelo:", opciones := sorted(cubo.conteo_por_tema().index), default=opciones)
 
     if not temas_usados:
         st.warning("⚠️ Selecciona al menos un tema.")
         return
 
-    df_filtrado = df[df['tema'].isin(temas_usados)]
-    df_prep = preparar_datos_conflictividad(df_filtrado, temas_usados)
+    with tramo("modelo de conflictividad", cache=True) as t:
+        resultado = pedir_modelo_conflictividad(cubo, temas_usados)
+        if resultado is None:
+            t.cache = "en segundo plano"
+    if resultado is None:
+        # Mientras se entrena el modelo de la nueva selección se muestra el anterior, si lo hay
+        resultado = st.session_state.get('modelo_conflictividad')
+        if resultado is None:
+            return
+        st.info("ℹ️ Mostrando el modelo anterior mientras se entrena el de la nueva selección de temas.")
+    else:
+        st.session_state['modelo_conflictividad'] = resultado
+    df_prep, modelo, acc, reporte, importancia = resultado
 
     st.subheader("Niveles de conflictividad")
     st.dataframe(df_prep[['total_incidencias', 'nivel_conflictividad']].sort_values('total_incidencias', ascending=False))
 
     st.subheader("Entrenamiento del modelo")
-    modelo, acc, reporte, importancia = entrenar_modelo(df_prep, temas_usados)
 
     st.markdown(f"**Precisión global del modelo:** `{acc:.2%}`")
 
@@ -170,27 +137,13 @@ def mostrar_modelo_conflictividad(df):
 
 
 
-df = pd.read_csv("data/total-castellano.csv", sep=';')
-df = df.drop(columns=['distrito_solicitante', 'barrio_solicitante'], errors='ignore')
-df = df[df['barrio_localizacion'] != 'En dependencias municipales']
-
-df['barrio_localizacion'] = df['barrio_localizacion'].str.strip().str.upper()
-df['distrito_localizacion'] = df['distrito_localizacion'].str.strip().str.upper()
-
-df['fecha_entrada_ayuntamiento'] = pd.to_datetime(df['fecha_entrada_ayuntamiento'], errors='coerce')
-df = df.dropna(subset=['fecha_entrada_ayuntamiento'])
-df = df.sort_values(by='fecha_entrada_ayuntamiento', ascending=False)
-
-no_validos = ['NO CONSTA', 'NO HI CONSTA', 'FORA DE VALÈNCIA', 'FORA  DE VALÈNCIA', 'FUERA DE VALÈNCIA' 'EN DEPENDENCIAS MUNICIPALES']
-
-# Filtrar el DataFrame para quedarte solo con filas válidas
-df = df[
-    (~df['distrito_localizacion'].isin(no_validos)) &
-    (~df['barrio_localizacion'].isin(no_validos))
-]
+precalentar()
+iniciar_instrumentacion("Clasificación por conflictividad")
+with tramo("cubo", cache=True):
+    cubo, _ = cubo_del_periodo(obtener_cubo())
 
 # ----------- LLAMADA PRINCIPAL -----------
-# IMPORTANTE: asegúrate de haber cargado tu DataFrame con incidencias en una variable `df`
+# IMPORTANTE: asegúrate de haber cargado el cubo de conteos en una variable `cubo`
 
-mostrar_modelo_conflictividad(df)
+mostrar_modelo_conflictividad(cubo)
 
@@ -0,0 +1,45 @@
+import streamlit as st
+
+# ----------------------------
+# Filtro global de periodo
+# ----------------------------
+# Todas las páginas dibujan el mismo selector en la barra lateral y trabajan con
+# el cubo recortado a esos meses (una vista del cubo completo, ver
+# ``CuboIncidencias.recortar``). El periodo se guarda en session_state fuera de
+# la clave del widget, que Streamlit olvida al cambiar de página.
+PERIODO = "periodo"
+_WIDGET = "periodo_widget"
+
+
+def _guardar_periodo():
+    st.session_state[PERIODO] = st.session_state[_WIDGET]
+
+
+def seleccionar_periodo(cubo):
+    """Selector de meses en la barra lateral; devuelve ``(desde, hasta)`` o ``None`` si es todo el histórico.
+
+    Los meses van como texto ``'AAAA-MM'``: se leen en el selector y sirven tal
+    cual de clave para las cachés de los resultados de cada periodo.
+    """
+    meses = list(cubo.meses.strftime("%Y-%m"))
+    completo = (meses[0], meses[-1])
+
+    def valido(periodo):
+        return isinstance(periodo, (tuple, list)) and len(periodo) == 2 and all(m in meses for m in periodo)
+
+    guardado = st.session_state.get(PERIODO)
+    if not valido(st.session_state.get(_WIDGET)):
+        st.session_state[_WIDGET] = tuple(guardado) if valido(guardado) else completo
+
+    st.sidebar.select_slider("Periodo", options=meses, key=_WIDGET, on_change=_guardar_periodo)
+    desde, hasta = st.session_state[_WIDGET]
+    return None if (desde, hasta) == completo else (desde, hasta)
+
+
+def cubo_del_periodo(cubo):
+    """Dibuja el selector de periodo y devuelve ``(cubo recortado, periodo)``."""
+    periodo = seleccionar_periodo(cubo)
+    if periodo is None:
+        return cubo, None
+    st.sidebar.caption(f"Mostrando de {periodo[0]} a {periodo[1]}.")
+    return cubo.recortar(*periodo), periodo
@@ -0,0 +1,81 @@
+"""Preajuste en lote de los pronósticos de todas las combinaciones tema/barrio.
+
+Uso (desde la raíz del repositorio):
+
+    python app/preajuste.py [--procesos N] [--jerarquico]
+
+Ajusta Prophet para cada combinación de los desplegables "Tema" y "Barrio" de
+la página de análisis temporal, repartiendo los ajustes entre procesos, y deja
+los pronósticos en data/cache/pronosticos. La página sólo tiene que leerlos.
+Con ``--jerarquico`` sólo ajusta las series agregadas del modo jerárquico
+(ciudad, distritos y temas), lo bastante pocas para hacerlo en cada ingesta.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from agregados import actualizar_cubo
+from datos import RUTA_INCIDENCIAS, sincronizar_almacen
+from jerarquia import entrenamientos_agregados
+from prediccion import (TEST_SIZE, ajustar_y_guardar, clave_pronostico, construir_df_prophet,
+                        leer_pronostico_guardado, podar_pronosticos_guardados, separar_entrenamiento)
+
+
+def combinaciones(cubo):
+    for tema in ['TODOS'] + sorted(cubo.temas):
+        for barrio in ['TODOS'] + sorted(cubo.barrios):
+            yield tema, barrio
+
+
+def entrenamientos(cubo):
+    """``(tema, barrio) -> df_train`` de cada combinación con datos suficientes, como en la página."""
+    series = {}
+    for tema, barrio in combinaciones(cubo):
+        df_prophet = construir_df_prophet(cubo, tema=tema, barrio=barrio)
+        if df_prophet.shape[0] >= TEST_SIZE + 2:
+            series[tema, barrio], _ = separar_entrenamiento(df_prophet)
+    return series
+
+
+def preajustar(cubo, procesos=None, jerarquico=False):
+    """Ajusta y guarda los pronósticos Prophet que aún no estén en la caché de disco."""
+    series = entrenamientos_agregados(cubo) if jerarquico else entrenamientos(cubo)
+    pendientes = {}
+    for (tema, barrio), df_train in series.items():
+        clave = clave_pronostico(tema, barrio, df_train)
+        if leer_pronostico_guardado(clave) is None:
+            pendientes[clave] = (tema, barrio, df_train)
+
+    print(f"Pronósticos por ajustar: {len(pendientes)}")
+    with ProcessPoolExecutor(max_workers=procesos or os.cpu_count()) as pool:
+        futuros = {pool.submit(ajustar_y_guardar, clave, df_train): (tema, barrio)
+                   for clave, (tema, barrio, df_train) in pendientes.items()}
+        for i, futuro in enumerate(as_completed(futuros), start=1):
+            tema, barrio = futuros[futuro]
+            try:
+                futuro.result()
+            except Exception as e:
+                print(f"  [{i}/{len(futuros)}] {tema} / {barrio}: error {e}")
+            else:
+                print(f"  [{i}/{len(futuros)}] {tema} / {barrio}")
+
+    podados = podar_pronosticos_guardados()
+    if podados:
+        print(f"Pronósticos antiguos eliminados: {podados}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preajuste de pronósticos por tema y barrio")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="procesos en paralelo")
+    parser.add_argument("--jerarquico", action="store_true",
+                        help="ajustar sólo la ciudad, los distritos y los temas del modo jerárquico")
+    parser.add_argument("--csv", default=str(RUTA_INCIDENCIAS), help="CSV principal de incidencias")
+    args = parser.parse_args()
+
+    sincronizar_almacen(args.csv)
+    cubo, _ = actualizar_cubo(args.csv)
+    preajustar(cubo, args.procesos, args.jerarquico)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Precálculo en lote de todo lo que muestran las páginas.
+
+Uso (desde la raíz del repositorio):
+
+    python app/precalculo.py [--procesos N] [--k 2 3 4 ...] [--prophet]
+
+Pone al día el almacén columnar y el cubo de conteos y, repartiendo el trabajo
+entre procesos, deja en data/cache/precalculo/<versión> los pronósticos de los
+motores vectorizados (por serie y jerárquicos), el clustering de cada k (del
+histórico completo y por año), el modelo de conflictividad con todos los temas
+y los GeoJSON simplificados de los mapas. Las páginas los leen si existen para
+la versión actual de los datos y sólo calculan en vivo las selecciones a medida
+(otro periodo, otros temas...). Con ``--prophet`` además preajusta Prophet para
+todas las combinaciones (ver preajuste.py).
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from agregados import actualizar_cubo
+from clustering import K_MAXIMO, ajustar_clustering_historico, clustering_anual
+from conflictividad import modelo_conflictividad, nombre_artefacto as nombre_conflictividad
+from datos import (RUTA_BARRIOS, RUTA_DISTRITOS, RUTA_INCIDENCIAS, guardar_artefacto, podar_artefactos,
+                   sincronizar_almacen)
+from geometria import (ZOOM_DETALLE, ZOOM_MAPAS, geojson_simplificado, nombre_artefacto as nombre_geojson,
+                       version_fichero)
+from jerarquia import RECONCILIACIONES, pronosticar_jerarquia
+from preajuste import preajustar
+from pronostico_vectorizado import METODOS, pronosticar_cubo
+
+# GeoJSON que dibujan los mapas: distritos y barrios al abrir, barrios de un distrito al pulsarlo
+GEOJSON_MAPAS = [(RUTA_DISTRITOS, ZOOM_MAPAS), (RUTA_BARRIOS, ZOOM_MAPAS), (RUTA_BARRIOS, ZOOM_DETALLE)]
+
+
+def tareas(ks):
+    """Lista de tareas independientes, ``(tipo, *parámetros)``."""
+    return ([('pronosticos', metodo) for metodo in METODOS]
+            + [('jerarquia', motor, reconciliacion) for motor in METODOS for reconciliacion in RECONCILIACIONES]
+            + [('clustering', k) for k in ks]
+            + [('clustering-anual', k) for k in ks]
+            + [('conflictividad',)]
+            + [('geojson', str(ruta), zoom) for ruta, zoom in GEOJSON_MAPAS])
+
+
+def ejecutar_tarea(ruta, version, tarea):
+    """Calcula y guarda el artefacto de ``tarea``; devuelve su nombre."""
+    tipo, *parametros = tarea
+    if tipo == 'geojson':
+        ruta_geojson, zoom = parametros
+        fichero = version_fichero(ruta_geojson)
+        nombre, artefacto = nombre_geojson(*fichero, zoom), geojson_simplificado(*fichero, zoom)
+    else:
+        # Cada proceso lee el cubo ya actualizado por el proceso principal
+        cubo, _ = actualizar_cubo(ruta)
+        if tipo == 'pronosticos':
+            nombre, artefacto = f"pronosticos-{parametros[0]}", pronosticar_cubo(cubo, metodo=parametros[0])
+        elif tipo == 'jerarquia':
+            motor, reconciliacion = parametros
+            nombre = f"jerarquia-{motor}-{reconciliacion}"
+            artefacto = pronosticar_jerarquia(cubo, motor=motor, reconciliacion=reconciliacion)
+        elif tipo == 'clustering':
+            k = parametros[0]
+            nombre = f"clustering-k{k}-{cubo.huella_tabla()}"
+            artefacto = ajustar_clustering_historico(cubo, k)
+        elif tipo == 'clustering-anual':
+            k = parametros[0]
+            nombre = f"clustering-anual-k{k}-{cubo.huella_tablas_anuales()}"
+            artefacto = clustering_anual(cubo, k, procesos=1)
+        elif tipo == 'conflictividad':
+            # Los temas que la página selecciona por defecto: todos los que tienen incidencias
+            temas = tuple(sorted(cubo.conteo_por_tema().index))
+            nombre, artefacto = nombre_conflictividad(cubo, temas), modelo_conflictividad(cubo, temas)
+        else:
+            raise ValueError(f"Tarea desconocida: {tipo}")
+    guardar_artefacto(version, nombre, artefacto)
+    return nombre
+
+
+def precalcular(ruta=RUTA_INCIDENCIAS, ks=range(2, K_MAXIMO + 1), procesos=None):
+    """Calcula todos los artefactos de la versión actual de los datos; devuelve la versión."""
+    version = sincronizar_almacen(ruta)['version']
+    actualizar_cubo(ruta)
+
+    pendientes = tareas(ks)
+    print(f"Versión de los datos: {version}. Tareas: {len(pendientes)}")
+    with ProcessPoolExecutor(max_workers=procesos or os.cpu_count()) as pool:
+        futuros = {pool.submit(ejecutar_tarea, str(ruta), version, tarea): tarea for tarea in pendientes}
+        for i, futuro in enumerate(as_completed(futuros), start=1):
+            descripcion = ' '.join(map(str, futuros[futuro]))
+            try:
+                nombre = futuro.result()
+            except Exception as e:
+                print(f"  [{i}/{len(futuros)}] {descripcion}: error {e}")
+            else:
+                print(f"  [{i}/{len(futuros)}] {descripcion} -> {nombre}")
+
+    podadas = podar_artefactos(version)
+    if podadas:
+        print(f"Versiones antiguas eliminadas: {podadas}")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precálculo de los resultados de todas las páginas")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="procesos en paralelo")
+    parser.add_argument("--k", type=int, nargs="+", default=list(range(2, K_MAXIMO + 1)),
+                        help="números de clústeres a precalcular")
+    parser.add_argument("--prophet", action="store_true", help="preajustar también Prophet para todas las series")
+    parser.add_argument("--csv", default=str(RUTA_INCIDENCIAS), help="CSV principal de incidencias")
+    args = parser.parse_args()
+
+    precalcular(args.csv, args.k, args.procesos)
+    if args.prophet:
+        cubo, _ = actualizar_cubo(args.csv)
+        preajustar(cubo, args.procesos)
+
+
+if __name__ == "__main__":
+    main()
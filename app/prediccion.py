@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+
+import pyarrow.feather as feather
+from cache_memoria import en_memoria
+from datos import DIRECTORIO_CACHE
+from instrumentacion import medido, tramo
+from trabajos import resultado_en_segundo_plano
+
+# ----------------------------
+# Configuración del pronóstico
+# ----------------------------
+# Se ajusta siempre hasta el horizonte máximo del slider: cambiar "Periodos a
+# predecir" sólo recorta el pronóstico ya calculado.
+HORIZONTE_MAXIMO = 24
+TEST_SIZE = 6
+PARAMETROS_PROPHET = {}
+
+DIRECTORIO_PRONOSTICOS = DIRECTORIO_CACHE / "pronosticos"
+MAX_PRONOSTICOS_EN_DISCO = 20000
+
+COLUMNAS_PRONOSTICO = ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+
+# Con un handler propio, cmdstanpy no instala el suyo que imprime cada ajuste
+logging.getLogger('cmdstanpy').addHandler(logging.NullHandler())
+
+
+# ------------ FUNCIÓN PARA PREPARAR LOS DATOS ------------------
+def construir_df_prophet(cubo, tema='TODOS', barrio='TODOS'):
+    # Serie mensual (ds, y) sacada del cubo de conteos, sin recorrer las incidencias
+    return cubo.serie_mensual(tema=tema, barrio=barrio)
+
+
+def separar_entrenamiento(df_prophet, test_size=TEST_SIZE):
+    return df_prophet.iloc[:-test_size], df_prophet.iloc[-test_size:]
+
+
+# ------------ AJUSTE ------------------
+def ajustar_prophet(df_train, periodos=HORIZONTE_MAXIMO, parametros=PARAMETROS_PROPHET):
+    from prophet import Prophet
+
+    modelo = Prophet(**parametros)
+    with tramo("Prophet.fit", filas=len(df_train)):
+        modelo.fit(df_train)
+
+    future = modelo.make_future_dataframe(periods=periodos, freq='MS')
+    forecast = modelo.predict(future)[COLUMNAS_PRONOSTICO]
+    forecast[['yhat', 'yhat_lower', 'yhat_upper']] = forecast[['yhat', 'yhat_lower', 'yhat_upper']].clip(lower=0)
+    return forecast
+
+
+# ------------ CACHÉ DE PRONÓSTICOS ------------------
+def clave_pronostico(tema, barrio, df_train, parametros=PARAMETROS_PROPHET, periodos=HORIZONTE_MAXIMO):
+    """Clave (tema, barrio, corte de entrenamiento, parámetros) más la huella de la serie.
+
+    La huella hace que una ingesta sólo invalide los pronósticos cuya serie ha cambiado.
+    """
+    h = hashlib.sha1(json.dumps([tema, barrio, str(df_train['ds'].iloc[-1]), periodos, parametros],
+                                sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    h.update(df_train['ds'].to_numpy('datetime64[ns]').tobytes())
+    h.update(df_train['y'].to_numpy('int64').tobytes())
+    return h.hexdigest()[:20]
+
+
+def _ruta_pronostico(clave):
+    return DIRECTORIO_PRONOSTICOS / f"{clave}.arrow"
+
+
+@medido("leer pronóstico en disco")
+def leer_pronostico_guardado(clave):
+    ruta = _ruta_pronostico(clave)
+    try:
+        forecast = feather.read_feather(str(ruta))
+    except (OSError, ValueError):
+        return None
+    os.utime(ruta)  # marca de uso reciente para la poda
+    return forecast
+
+
+def guardar_pronostico(clave, forecast):
+    destino = _ruta_pronostico(clave)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_suffix('.tmp')
+    feather.write_feather(forecast.reset_index(drop=True), str(temporal))
+    os.replace(temporal, destino)
+
+
+def podar_pronosticos_guardados(maximo=MAX_PRONOSTICOS_EN_DISCO):
+    """Borra los pronósticos en disco usados hace más tiempo por encima de ``maximo``."""
+    if not DIRECTORIO_PRONOSTICOS.exists():
+        return 0
+    ficheros = sorted(DIRECTORIO_PRONOSTICOS.glob("*.arrow"), key=lambda p: p.stat().st_mtime)
+    sobrantes = ficheros[:max(0, len(ficheros) - maximo)]
+    for fichero in sobrantes:
+        fichero.unlink(missing_ok=True)
+    return len(sobrantes)
+
+
+def ajustar_y_guardar(clave, df_train, parametros=PARAMETROS_PROPHET, periodos=HORIZONTE_MAXIMO):
+    forecast = ajustar_prophet(df_train, periodos=periodos, parametros=parametros)
+    guardar_pronostico(clave, forecast)
+    return forecast
+
+
+def leer_o_ajustar(clave, df_train, parametros=PARAMETROS_PROPHET, periodos=HORIZONTE_MAXIMO):
+    """Pronóstico guardado en disco para ``clave``, o ajustado y guardado si no lo hay."""
+    forecast = leer_pronostico_guardado(clave)
+    if forecast is None:
+        forecast = ajustar_y_guardar(clave, df_train, parametros=parametros, periodos=periodos)
+    return forecast
+
+
+@en_memoria("prophet", spinner="Ajustando el modelo Prophet...")
+def _pronostico_prophet(clave, _df_train):
+    return leer_o_ajustar(clave, _df_train)
+
+
+def pedir_pronostico(df_train, tema='TODOS', barrio='TODOS'):
+    """Pronóstico Prophet si ya está en memoria o en disco; si no, lo ajusta en segundo plano y devuelve ``None``."""
+    clave = clave_pronostico(tema, barrio, df_train)
+    if _ruta_pronostico(clave).exists():
+        return _pronostico_prophet(clave, df_train)
+    return resultado_en_segundo_plano(('prophet', clave), ajustar_y_guardar, clave, df_train,
+                                      descripcion=f"Ajuste de Prophet ({tema}, {barrio})")
@@ -0,0 +1,36 @@
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# ----------------------------
+# Pools de procesos creados desde la app
+# ----------------------------
+# Las páginas se ejecutan en hilos del servidor de Streamlit: un proceso creado
+# con fork hereda los bloqueos que otros hilos tenían tomados en ese instante y
+# puede quedarse esperándolos para siempre. Por eso los pools usan spawn, que
+# arranca cada proceso de cero. Pero spawn hace que cada proceso nuevo vuelva a
+# ejecutar el ``__main__`` del padre, y Streamlit instala como ``__main__`` el
+# script de la página: cada proceso volvería a ejecutar la página entera. Los
+# procesos se arrancan al enviar trabajos, así que mientras se envía uno se
+# deja en ``__main__`` un módulo vacío.
+CONTEXTO = get_context("spawn")
+
+_bloqueo_main = threading.Lock()
+
+
+class PoolProcesos(ProcessPoolExecutor):
+    """ProcessPoolExecutor con spawn cuyos procesos no ejecutan el script de la página."""
+
+    def __init__(self, max_workers=None):
+        super().__init__(max_workers=max_workers, mp_context=CONTEXTO)
+
+    def submit(self, fn, /, *args, **kwargs):
+        with _bloqueo_main:
+            main = sys.modules['__main__']
+            sys.modules['__main__'] = types.ModuleType('__main__')
+            try:
+                return super().submit(fn, *args, **kwargs)
+            finally:
+                sys.modules['__main__'] = main
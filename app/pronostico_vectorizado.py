@@ -0,0 +1,271 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from agregados import obtener_cubo
+from cache_memoria import en_memoria
+from datos import RUTA_INCIDENCIAS, cargar_artefacto, version_incidencias
+from instrumentacion import medido
+from prediccion import HORIZONTE_MAXIMO, TEST_SIZE
+
+# ----------------------------
+# Motores de pronóstico vectorizados
+# ----------------------------
+# Alternativa ligera a Prophet: todas las series se ajustan a la vez sobre una
+# matriz (serie × mes) con NumPy. Las series se alinean por la derecha (todas
+# terminan en la última columna de entrenamiento), de modo que el horizonte es
+# común y la estacionalidad se mide por posición relativa dentro de cada serie.
+METODOS = {
+    'regresion': 'Regresión estacional',
+    'ets': 'ETS Holt-Winters',
+    'naive': 'Naive estacional',
+}
+
+PERIODO = 12
+# Intervalo del 80 %, el mismo que usa Prophet por defecto (interval_width=0.8)
+Z_INTERVALO = 1.2816
+RIDGE = 1e-3
+REJILLA_ETS = [(alpha, beta, gamma)
+               for alpha in (0.1, 0.3, 0.6) for beta in (0.0, 0.05) for gamma in (0.05, 0.2)]
+
+
+# ------------ Núcleo sobre matrices alineadas por la derecha ------------
+def _regresion_estacional(Y, activo, horizonte):
+    S, L = Y.shape
+    inicio = L - activo.sum(axis=1)
+    posicion = np.arange(L + horizonte)
+
+    # Diseño común: constante, tendencia y 11 dummies de "mes" relativo a cada serie
+    fase = (posicion[None, :] - inicio[:, None]) % PERIODO
+    X = np.zeros((S, L + horizonte, 2 + PERIODO - 1))
+    X[:, :, 0] = 1.0
+    X[:, :, 1] = posicion / max(L, 1)
+    for k in range(1, PERIODO):
+        X[:, :, 1 + k] = fase == k
+
+    W = activo.astype(float)
+    Xh = X[:, :L, :]
+    A = np.einsum('st,stp,stq->spq', W, Xh, Xh) + RIDGE * np.eye(X.shape[2])[None]
+    b = np.einsum('st,stp,st->sp', W, Xh, Y)
+    beta = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+    yhat = np.einsum('stp,sp->st', X, beta)
+    n = activo.sum(axis=1)
+    residuos = (Y - yhat[:, :L]) * W
+    sigma = np.sqrt((residuos ** 2).sum(axis=1) / np.maximum(n - X.shape[2], 1))
+    return yhat, np.repeat(sigma[:, None], L + horizonte, axis=1)
+
+
+def _ets(Y, activo, horizonte):
+    S, L = Y.shape
+    inicio = L - activo.sum(axis=1)
+    alpha, beta, gamma = (np.array(p)[None, :] for p in zip(*REJILLA_ETS))
+    G = len(REJILLA_ETS)
+
+    # Inicialización con el primer año (o lo que haya) de cada serie
+    ventana = np.arange(PERIODO)[None, :] + inicio[:, None]
+    en_ventana = ventana < L
+    primeros = np.where(en_ventana, np.take_along_axis(Y, np.minimum(ventana, L - 1), axis=1), np.nan)
+    nivel = np.repeat(np.nanmean(primeros, axis=1)[:, None], G, axis=1)
+    estacion = np.repeat(np.nan_to_num(primeros - nivel[:, :1])[:, None, :], G, axis=1)
+    tendencia = np.zeros((S, G))
+
+    ajustado = np.full((S, G, L), np.nan)
+    sse = np.zeros((S, G))
+    for t in range(L):
+        activa = activo[:, t][:, None]
+        idx = ((t - inicio) % PERIODO)[:, None, None]
+        s_t = np.take_along_axis(estacion, np.broadcast_to(idx, (S, G, 1)), axis=2)[:, :, 0]
+        prediccion = nivel + tendencia + s_t
+        y = Y[:, t][:, None]
+        ajustado[:, :, t] = prediccion
+
+        nuevo_nivel = alpha * (y - s_t) + (1 - alpha) * (nivel + tendencia)
+        nueva_tendencia = beta * (nuevo_nivel - nivel) + (1 - beta) * tendencia
+        nueva_estacion = gamma * (y - nuevo_nivel) + (1 - gamma) * s_t
+        calentado = activa & ((t - inicio) >= PERIODO)[:, None]
+        sse += np.where(calentado, (y - prediccion) ** 2, 0.0)
+
+        nivel = np.where(activa, nuevo_nivel, nivel)
+        tendencia = np.where(activa, nueva_tendencia, tendencia)
+        np.put_along_axis(estacion, np.broadcast_to(idx, (S, G, 1)),
+                          np.where(activa, nueva_estacion, s_t)[:, :, None], axis=2)
+
+    # Mejor combinación de parámetros por serie según el error a un paso
+    mejor = sse.argmin(axis=1)
+    filas = np.arange(S)
+    nivel, tendencia, estacion = nivel[filas, mejor], tendencia[filas, mejor], estacion[filas, mejor]
+    n_calentado = np.maximum((activo.sum(axis=1) - PERIODO), 1)
+    sigma = np.sqrt(sse[filas, mejor] / n_calentado)
+
+    h = np.arange(1, horizonte + 1)
+    fase_futura = (L - 1 + h[None, :] - inicio[:, None]) % PERIODO
+    futuro = (nivel[:, None] + h[None, :] * tendencia[:, None]
+              + np.take_along_axis(estacion, fase_futura, axis=1))
+    yhat = np.concatenate([ajustado[filas, mejor], futuro], axis=1)
+
+    # Varianza a h pasos de ETS(A,A,A): sigma² (1 + sum_{j<h} c_j²)
+    a, b, g = (np.array(p)[mejor] for p in zip(*REJILLA_ETS))
+    j = np.arange(1, horizonte)[None, :]
+    c = a[:, None] * (1 + j * b[:, None]) + g[:, None] * (j % PERIODO == 0)
+    factor = np.sqrt(1 + np.concatenate([np.zeros((S, 1)), np.cumsum(c ** 2, axis=1)], axis=1))
+    escala = np.concatenate([np.ones((S, L)), factor], axis=1)
+    return yhat, sigma[:, None] * escala
+
+
+def _naive_estacional(Y, activo, horizonte):
+    S, L = Y.shape
+    n = activo.sum(axis=1)
+    estacional = n >= PERIODO
+
+    # Histórico: el valor del mismo mes del año anterior (o del mes anterior si no hay un año)
+    retardo = np.where(estacional, PERIODO, 1)[:, None]
+    posicion = np.arange(L)[None, :]
+    origen = posicion - retardo
+    valido = activo & (origen >= (L - n)[:, None])
+    ajustado = np.where(valido, np.take_along_axis(Y, np.maximum(origen, 0), axis=1), np.nan)
+
+    residuos = np.where(valido, Y - ajustado, 0.0)
+    sigma = np.sqrt((residuos ** 2).sum(axis=1) / np.maximum(valido.sum(axis=1), 1))
+
+    h = np.arange(1, horizonte + 1)[None, :]
+    origen_futuro = np.where(estacional[:, None], L - PERIODO + (h - 1) % PERIODO, L - 1)
+    futuro = np.take_along_axis(Y, origen_futuro, axis=1)
+    ciclos = np.where(estacional[:, None], (h - 1) // PERIODO + 1, h)
+
+    yhat = np.concatenate([ajustado, futuro], axis=1)
+    escala = np.concatenate([np.ones((S, L)), np.sqrt(ciclos)], axis=1)
+    return yhat, sigma[:, None] * escala
+
+
+_MOTORES = {'regresion': _regresion_estacional, 'ets': _ets, 'naive': _naive_estacional}
+
+
+def pronosticar_matriz(Y, activo, horizonte=HORIZONTE_MAXIMO, metodo='regresion'):
+    """Pronostica todas las filas de ``Y`` (series alineadas por la derecha) en una pasada.
+
+    Devuelve ``yhat``, ``yhat_lower`` e ``yhat_upper`` de forma (serie, L + horizonte),
+    recortados a cero como en Prophet.
+    """
+    Y = np.where(activo, Y, 0.0).astype(float)
+    yhat, sigma = _MOTORES[metodo](Y, activo, horizonte)
+    return (np.clip(yhat, 0, None),
+            np.clip(yhat - Z_INTERVALO * sigma, 0, None),
+            np.clip(yhat + Z_INTERVALO * sigma, 0, None))
+
+
+# ------------ Lotes de series ------------
+@dataclass
+class PronosticosLote:
+    """Pronósticos de muchas series calculados en una sola pasada."""
+    indice: dict
+    inicio: pd.DatetimeIndex
+    longitud: np.ndarray
+    horizonte: int
+    yhat: np.ndarray
+    yhat_lower: np.ndarray
+    yhat_upper: np.ndarray
+
+    def __contains__(self, clave):
+        return clave in self.indice
+
+    def serie(self, tema='TODOS', barrio='TODOS'):
+        """Pronóstico (histórico + futuro) de una serie, con las mismas columnas que el de Prophet."""
+        s = self.indice[(tema, barrio)]
+        desde = self.yhat.shape[1] - self.horizonte - self.longitud[s]
+        return pd.DataFrame({
+            'ds': pd.date_range(self.inicio[s], periods=self.longitud[s] + self.horizonte, freq='MS'),
+            'yhat': self.yhat[s, desde:],
+            'yhat_lower': self.yhat_lower[s, desde:],
+            'yhat_upper': self.yhat_upper[s, desde:],
+        })
+
+    def primer_mes_pronosticado(self, tema='TODOS', barrio='TODOS'):
+        """Primer mes que la serie no ha usado para ajustar: desde él, el pronóstico no ha visto los datos."""
+        s = self.indice[(tema, barrio)]
+        return self.inicio[s] + pd.DateOffset(months=int(self.longitud[s]))
+
+
+def alinear_por_la_derecha(X, primero, fin):
+    """Submatrices ``X[s, primero[s]:fin[s]]`` alineadas por la derecha y su máscara."""
+    L = int((fin - primero).max())
+    columnas = fin[:, None] - L + np.arange(L)[None, :]
+    activo = columnas >= primero[:, None]
+    Y = np.take_along_axis(X, np.clip(columnas, 0, X.shape[1] - 1), axis=1)
+    return np.where(activo, Y, 0), activo
+
+
+def pronosticar_series(series_train, horizonte=HORIZONTE_MAXIMO, metodo='regresion'):
+    """Pronostica en lote un diccionario ``(tema, barrio) -> df_train`` (columnas ``ds``, ``y``)."""
+    claves = list(series_train)
+    longitud = np.array([len(series_train[c]) for c in claves])
+    L = longitud.max()
+    Y = np.zeros((len(claves), L))
+    for s, clave in enumerate(claves):
+        Y[s, L - longitud[s]:] = series_train[clave]['y'].to_numpy()
+    activo = np.arange(L)[None, :] >= (L - longitud)[:, None]
+
+    yhat, lower, upper = pronosticar_matriz(Y, activo, horizonte, metodo)
+    inicio = pd.DatetimeIndex([series_train[c]['ds'].iloc[0] for c in claves])
+    return PronosticosLote({c: s for s, c in enumerate(claves)}, inicio, longitud, horizonte, yhat, lower, upper)
+
+
+def matriz_series(cubo):
+    """Todas las series tema/barrio (incluido 'TODOS') como matriz (serie × mes) del cubo.
+
+    Devuelve la matriz, la lista de claves ``(tema, barrio)`` de cada fila y, por
+    fila, el primer y el último mes con datos (-1 si la serie está vacía).
+    """
+    conteos = cubo.conteos_barrio_tema_mes()
+    B, T, M = conteos.shape
+    completo = np.zeros((B + 1, T + 1, M), dtype=np.int64)
+    completo[:B, :T] = conteos
+    completo[:B, T] = conteos.sum(axis=1)
+    completo[B, :T] = conteos.sum(axis=0)
+    completo[B, T] = conteos.sum(axis=(0, 1))
+
+    barrios = list(cubo.barrios) + ['TODOS']
+    temas = list(cubo.temas) + ['TODOS']
+    X = completo.reshape((B + 1) * (T + 1), M)
+    claves = [(tema, barrio) for barrio in barrios for tema in temas]
+
+    con_datos = X > 0
+    vacias = ~con_datos.any(axis=1)
+    primero = np.where(vacias, -1, con_datos.argmax(axis=1))
+    ultimo = np.where(vacias, -1, M - 1 - con_datos[:, ::-1].argmax(axis=1))
+    return X, claves, primero, ultimo
+
+
+@medido("pronóstico vectorizado")
+def pronosticar_cubo(cubo, metodo='regresion', horizonte=HORIZONTE_MAXIMO, test_size=TEST_SIZE):
+    """Pronostica todas las combinaciones tema/barrio (incluido 'TODOS') en una sola pasada.
+
+    Cada serie usa la misma ventana que la página: del primer al último mes con
+    datos, reservando los ``test_size`` últimos meses para evaluar.
+    """
+    X, claves, primero, ultimo = matriz_series(cubo)
+    validas = np.flatnonzero((primero >= 0) & (ultimo - primero + 1 >= test_size + 2))
+
+    fin = ultimo[validas] + 1 - test_size
+    Y, activo = alinear_por_la_derecha(X[validas], primero[validas], fin)
+    yhat, lower, upper = pronosticar_matriz(Y, activo, horizonte, metodo)
+
+    indice = {claves[s]: i for i, s in enumerate(validas)}
+    return PronosticosLote(indice, cubo.meses[primero[validas]], fin - primero[validas], horizonte,
+                           yhat, lower, upper)
+
+
+@en_memoria("pronósticos vectorizados", spinner="Calculando pronósticos de todas las series...")
+def _lote_version(ruta, version, metodo, periodo):
+    if periodo is None:
+        precalculado = cargar_artefacto(version, f"pronosticos-{metodo}")
+        if precalculado is not None:
+            return precalculado
+    cubo = obtener_cubo(ruta)
+    return pronosticar_cubo(cubo if periodo is None else cubo.recortar(*periodo), metodo=metodo)
+
+
+def obtener_pronosticos_rapidos(metodo='regresion', ruta=RUTA_INCIDENCIAS, periodo=None):
+    """Pronósticos de todas las series con un motor vectorizado, una vez por versión de datos y periodo."""
+    return _lote_version(*version_incidencias(ruta), metodo, periodo)
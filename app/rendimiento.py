@@ -0,0 +1,299 @@
+"""Banco de pruebas de rendimiento con datos sintéticos a varios tamaños.
+
+Uso (desde la raíz del repositorio):
+
+    python app/rendimiento.py [--filas 1M 5M 20M] [--etapas lectura ingesta ...] [--repeticiones 1]
+    python app/rendimiento.py --filas 1M --comparar data/cache/rendimiento/<anterior>.json [--tolerancia 1.25]
+
+Para cada tamaño genera (una vez, ver sintetico.py) un CSV de incidencias
+sintéticas y mide cada etapa del pipeline en un proceso nuevo: tiempo y pico de
+memoria (RSS) sin interferencias de las demás etapas ni de cachés en memoria.
+Las cachés en disco de las etapas (almacén columnar y cubo) van al directorio
+de trabajo, no a data/cache. El informe se guarda en JSON en
+data/cache/rendimiento; con ``--comparar`` se contrasta con uno anterior y el
+programa termina con error si alguna etapa es más lenta o gasta más memoria
+que la tolerancia.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import datos
+from datos import DIRECTORIO_CACHE, FILAS_POR_BLOQUE, RUTA_BARRIOS, leer_csv, leer_manifiesto, limpiar_incidencias
+from sintetico import filas_de, generar_csv, leer_plantilla
+
+DIRECTORIO_RENDIMIENTO = DIRECTORIO_CACHE / "rendimiento"
+DIRECTORIO_TRABAJO = Path(tempfile.gettempdir()) / "rendimiento-incidencias"
+TAMANOS_POR_DEFECTO = ['1M', '5M', '20M']
+TOLERANCIA = 1.25
+# Diferencias de tiempo por debajo de esto son ruido, sea cual sea la proporción
+MARGEN_SEGUNDOS = 0.1
+
+
+# ----------------------------
+# Etapas
+# ----------------------------
+# Cada etapa recibe el CSV, prepara lo que necesita (sin medir) y devuelve la
+# función que se mide. Esa función puede devolver datos extra para el informe;
+# si incluye 'segundos', sustituye al tiempo medido.
+def _cubo(ruta):
+    from agregados import actualizar_cubo, cargar_cubo
+
+    cubo, _ = cargar_cubo(ruta)
+    if cubo is None:
+        if leer_manifiesto(ruta) is None:
+            datos.sincronizar_almacen(ruta)
+        cubo, _ = actualizar_cubo(ruta)
+    return cubo
+
+
+def etapa_lectura(ruta):
+    def medir():
+        return {'filas_leidas': sum(len(bloque) for bloque in leer_csv(ruta, FILAS_POR_BLOQUE))}
+    return medir
+
+
+def etapa_limpieza(ruta):
+    # Sólo cuenta limpiar_incidencias; la lectura de cada bloque queda fuera del tiempo
+    def medir():
+        segundos, filas = 0.0, 0
+        for bloque in leer_csv(ruta, FILAS_POR_BLOQUE):
+            inicio = time.perf_counter()
+            filas += len(limpiar_incidencias(bloque))
+            segundos += time.perf_counter() - inicio
+        return {'segundos': segundos, 'filas_validas': filas}
+    return medir
+
+
+def etapa_ingesta(ruta):
+    def medir():
+        manifiesto = datos.reconstruir_almacen(ruta)
+        return {'partes': len(manifiesto['partes'])}
+    return medir
+
+
+def etapa_conteos(ruta):
+    from agregados import cubo_de_partes
+
+    if leer_manifiesto(ruta) is None:
+        datos.sincronizar_almacen(ruta)
+    partes = leer_manifiesto(ruta)['partes']
+
+    def medir():
+        cubo = cubo_de_partes(ruta, partes)
+        cubo.conteo_por_barrio()
+        cubo.conteo_por_tema()
+        return {'celdas_cubo': int(cubo.conteos.size)}
+    return medir
+
+
+def etapa_series(ruta):
+    from prediccion import construir_df_prophet
+
+    cubo = _cubo(ruta)
+
+    def medir():
+        series = 0
+        for tema in ['TODOS', *cubo.temas]:
+            for barrio in ['TODOS', *cubo.barrios]:
+                construir_df_prophet(cubo, tema=tema, barrio=barrio)
+                series += 1
+        return {'series': series}
+    return medir
+
+
+def etapa_clustering(ruta):
+    from clustering import K_POR_DEFECTO, ajustar_clustering, tabla_proporciones
+
+    cubo = _cubo(ruta)
+
+    def medir():
+        # Ajuste en frío con la semilla fija: no arranca de los centroides guardados
+        # del histórico ni los escribe, así que cada medida hace el mismo trabajo
+        ajustar_clustering(tabla_proporciones(cubo), K_POR_DEFECTO)
+    return medir
+
+
+def etapa_conflictividad(ruta):
+    from conflictividad import modelo_conflictividad
+
+    cubo = _cubo(ruta)
+
+    def medir():
+        modelo_conflictividad(cubo, tuple(sorted(cubo.conteo_por_tema().index)))
+    return medir
+
+
+def etapa_mapa(ruta):
+    import folium
+    from geometria import ZOOM_MAPAS, asignar_propiedades, claves_features, geojson_simplificado, version_fichero
+
+    conteos = _cubo(ruta).conteo_por_barrio().rename(index=str)
+
+    def medir():
+        # Lo que hace la página principal: GeoJSON simplificado, métricas por feature y HTML del mapa
+        geojson = json.loads(geojson_simplificado(*version_fichero(RUTA_BARRIOS), ZOOM_MAPAS))
+        claves = claves_features(geojson)
+        geojson = asignar_propiedades(geojson, {'conteo': conteos.reindex(claves, fill_value=0).to_numpy()})
+        m = folium.Map(location=[39.47, -0.38], zoom_start=ZOOM_MAPAS)
+        folium.GeoJson(geojson, tooltip=folium.GeoJsonTooltip(fields=['clave', 'conteo'])).add_to(m)
+        return {'bytes_html': len(m.get_root().render())}
+    return medir
+
+
+ETAPAS = {
+    'lectura': etapa_lectura,
+    'limpieza': etapa_limpieza,
+    'ingesta': etapa_ingesta,
+    'conteos': etapa_conteos,
+    'series': etapa_series,
+    'clustering': etapa_clustering,
+    'conflictividad': etapa_conflictividad,
+    'mapa': etapa_mapa,
+}
+
+
+# ----------------------------
+# Medición
+# ----------------------------
+def _memoria_mb(campo):
+    # VmRSS / VmHWM de Linux; donde no hay /proc se usa el pico del proceso
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith(campo + ":"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reiniciar_pico():
+    # El pico (VmHWM) vuelve al RSS actual y así sólo refleja la etapa, no su preparación
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _medir_etapa(directorio, ruta, etapa):
+    """Mide ``etapa`` sobre ``ruta`` con las cachés en disco dentro de ``directorio``; corre en un proceso nuevo."""
+    datos.DIRECTORIO_CACHE = Path(directorio) / "cache"
+
+    medir = ETAPAS[etapa](ruta)
+    gc.collect()
+    _reiniciar_pico()
+    antes = _memoria_mb("VmRSS")
+    inicio = time.perf_counter()
+    extra = medir() or {}
+    segundos = time.perf_counter() - inicio
+    pico = _memoria_mb("VmHWM")
+    return {'segundos': round(extra.pop('segundos', segundos), 4), 'pico_mb': round(pico, 1),
+            'incremento_mb': round(max(0.0, pico - antes), 1), **extra}
+
+
+def medir_en_proceso_nuevo(directorio, ruta, etapa):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_medir_etapa, str(directorio), str(ruta), etapa).result()
+
+
+def _commit():
+    try:
+        salida = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return salida.stdout.strip()
+
+
+def ejecutar(tamanos, etapas, directorio=DIRECTORIO_TRABAJO, repeticiones=1, semilla=0):
+    """Informe (dict) con la mejor de ``repeticiones`` medidas de cada etapa y tamaño."""
+    directorio.mkdir(parents=True, exist_ok=True)
+    plantilla = None
+    resultados = []
+    for filas in tamanos:
+        ruta = directorio / f"sintetico-{filas}-s{semilla}.csv"
+        if not ruta.exists():
+            plantilla = plantilla or leer_plantilla()
+            inicio = time.perf_counter()
+            generar_csv(ruta, filas, plantilla, semilla)
+            print(f"Generado {ruta.name} en {time.perf_counter() - inicio:.1f} s")
+        for etapa in etapas:
+            medida = min((medir_en_proceso_nuevo(directorio, ruta, etapa) for _ in range(repeticiones)),
+                         key=lambda m: m['segundos'])
+            resultados.append({'filas': filas, 'etapa': etapa, 'bytes_csv': ruta.stat().st_size, **medida})
+            print(f"  {filas:>11,d} {etapa:15s} {medida['segundos']:9.2f} s {medida['pico_mb']:9.0f} MB pico "
+                  f"{medida['incremento_mb']:9.0f} MB etapa")
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'entorno': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                    'sistema': platform.platform(), 'cpus': os.cpu_count()},
+        'filas_por_bloque': FILAS_POR_BLOQUE,
+        'semilla': semilla,
+        'resultados': resultados,
+    }
+
+
+def comparar(informe, anterior, tolerancia=TOLERANCIA):
+    """Etapas cuyo tiempo o pico de memoria superan ``tolerancia`` veces los de ``anterior``."""
+    previas = {(r['filas'], r['etapa']): r for r in anterior['resultados']}
+    regresiones = []
+    print(f"Comparación con {anterior.get('commit')} ({anterior.get('fecha')}):")
+    for r in informe['resultados']:
+        previa = previas.get((r['filas'], r['etapa']))
+        if previa is None:
+            continue
+        ratio_tiempo = r['segundos'] / max(previa['segundos'], 1e-3)
+        ratio_memoria = r['pico_mb'] / max(previa['pico_mb'], 1.0)
+        mas_lenta = ratio_tiempo > tolerancia and r['segundos'] - previa['segundos'] > MARGEN_SEGUNDOS
+        marca = "  <-- regresión" if mas_lenta or ratio_memoria > tolerancia else ""
+        print(f"  {r['filas']:>11,d} {r['etapa']:15s} tiempo x{ratio_tiempo:5.2f}  memoria x{ratio_memoria:5.2f}{marca}")
+        if marca:
+            regresiones.append((r['filas'], r['etapa']))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de pruebas de rendimiento con datos sintéticos")
+    parser.add_argument("--filas", type=filas_de, nargs="+", default=[filas_de(t) for t in TAMANOS_POR_DEFECTO],
+                        help="tamaños a medir (admite 500k, 20M...)")
+    parser.add_argument("--etapas", nargs="+", choices=list(ETAPAS), default=list(ETAPAS))
+    parser.add_argument("--repeticiones", type=int, default=1, help="se guarda la medida más rápida")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--directorio", type=Path, default=DIRECTORIO_TRABAJO,
+                        help="dónde van los CSV sintéticos y sus cachés (se reutilizan entre ejecuciones)")
+    parser.add_argument("--salida", type=Path, help="JSON del informe (por defecto en data/cache/rendimiento)")
+    parser.add_argument("--comparar", type=Path, help="informe anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    args = parser.parse_args()
+
+    informe = ejecutar(args.filas, args.etapas, args.directorio, args.repeticiones, args.semilla)
+    salida = args.salida or DIRECTORIO_RENDIMIENTO / f"{informe['fecha'].replace(':', '')}-{informe['commit']}.json"
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Informe: {salida}")
+
+    if args.comparar:
+        anterior = json.loads(args.comparar.read_text(encoding="utf-8"))
+        if comparar(informe, anterior, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Generador de incidencias sintéticas con el formato de total-castellano.csv.
+
+Uso (desde la raíz del repositorio):
+
+    python app/sintetico.py 5M /tmp/incidencias-5M.csv [--semilla 0] [--plantilla data/total-castellano.csv]
+
+Las frecuencias salen del CSV real (la plantilla): cada fila sintética toma un
+par distrito/barrio con su grafía original (con las variantes sucias que la
+normalización tiene que resolver) y un tema según lo que se observa en cada
+barrio, y un mes según el perfil mensual de ese tema. También se reproducen la
+columna ``tipo``, los solicitantes y la proporción de fechas no válidas. El
+fichero se escribe por bloques, así que cabe cualquier número de filas.
+"""
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from datos import FILAS_POR_BLOQUE, RUTA_INCIDENCIAS
+
+COLUMNAS = ['distrito_solicitante', 'barrio_solicitante', 'tema', 'tipo', 'distrito_localizacion',
+            'barrio_localizacion', 'fecha_entrada_ayuntamiento']
+COLUMNAS_CELDA = ['distrito_localizacion', 'barrio_localizacion', 'tema']
+COLUMNAS_INDEPENDIENTES = ['distrito_solicitante', 'barrio_solicitante', 'tipo']
+FECHA = 'fecha_entrada_ayuntamiento'
+
+# Bloques que se generan y escriben de una vez
+FILAS_POR_BLOQUE_SINTETICO = 10 * FILAS_POR_BLOQUE
+
+
+def filas_de(texto):
+    """Número de filas a partir de ``'200000'``, ``'500k'`` o ``'20M'``."""
+    multiplicador = {'k': 1_000, 'm': 1_000_000}.get(texto[-1].lower(), 1)
+    return int(float(texto[:-1] if multiplicador > 1 else texto) * multiplicador)
+
+
+# ----------------------------
+# Plantilla: frecuencias del CSV real
+# ----------------------------
+@dataclass
+class Plantilla:
+    celdas: pd.Series          # (distrito, barrio, tema) tal como vienen escritos -> incidencias
+    meses_por_tema: dict       # tema -> Series mes (Period) -> incidencias
+    independientes: dict       # columna -> Series valor -> incidencias
+    fechas_invalidas: pd.Series
+    filas: int
+
+
+def _sumar(partes):
+    partes = [p for p in partes if len(p)]
+    if not partes:
+        return pd.Series(dtype=np.int64)
+    return pd.concat(partes).groupby(level=list(range(partes[0].index.nlevels))).sum()
+
+
+def leer_plantilla(ruta=RUTA_INCIDENCIAS):
+    """Frecuencias observadas en el CSV ``ruta``, leído por bloques."""
+    celdas, meses, invalidas, filas = [], [], [], 0
+    independientes = {col: [] for col in COLUMNAS_INDEPENDIENTES}
+    for bloque in pd.read_csv(ruta, sep=';', dtype=str, keep_default_na=False, chunksize=FILAS_POR_BLOQUE):
+        filas += len(bloque)
+        fechas = pd.to_datetime(bloque[FECHA], errors='coerce')
+        validas = fechas.notna()
+        celdas.append(bloque.groupby(COLUMNAS_CELDA).size())
+        meses.append(pd.DataFrame({'tema': bloque['tema'][validas],
+                                   'mes': fechas[validas].dt.to_period('M')}).value_counts())
+        invalidas.append(bloque.loc[~validas, FECHA].value_counts())
+        for col in COLUMNAS_INDEPENDIENTES:
+            independientes[col].append(bloque[col].value_counts())
+
+    meses = _sumar(meses)
+    return Plantilla(
+        celdas=_sumar(celdas),
+        meses_por_tema={tema: serie.droplevel('tema') for tema, serie in meses.groupby(level='tema')},
+        independientes={col: _sumar(partes) for col, partes in independientes.items()},
+        fechas_invalidas=_sumar(invalidas),
+        filas=filas,
+    )
+
+
+# ----------------------------
+# Generación
+# ----------------------------
+def _muestrear(rng, frecuencias, n):
+    """Posiciones de ``n`` valores de ``frecuencias`` elegidos en proporción a su frecuencia."""
+    return rng.choice(len(frecuencias), n, p=frecuencias.to_numpy() / frecuencias.sum())
+
+
+def _fechas(rng, meses, n):
+    """``n`` días 'AAAA-MM-DD' con los meses según ``meses`` y el día uniforme dentro del mes."""
+    inicio = meses.index.to_timestamp().to_numpy('datetime64[D]')[_muestrear(rng, meses, n)]
+    dias = (inicio.astype('datetime64[M]') + 1).astype('datetime64[D]') - inicio
+    return inicio + (rng.random(n) * dias.astype(np.int64)).astype(np.int64)
+
+
+def generar_bloque(plantilla, n, rng):
+    """DataFrame de ``n`` incidencias sintéticas con las columnas del CSV original."""
+    celdas = plantilla.celdas.index.to_frame(index=False).iloc[_muestrear(rng, plantilla.celdas, n)]
+    df = pd.DataFrame({col: pd.Categorical(celdas[col].to_numpy()) for col in COLUMNAS_CELDA})
+    for col, frecuencias in plantilla.independientes.items():
+        df[col] = pd.Categorical.from_codes(_muestrear(rng, frecuencias, n), frecuencias.index)
+
+    # El mes depende del tema: los temas tienen tendencias y estacionalidades distintas
+    todos = sum(plantilla.meses_por_tema.values())
+    fechas = np.empty(n, dtype='datetime64[D]')
+    for tema in df['tema'].cat.categories:
+        filas = np.flatnonzero(df['tema'].to_numpy() == tema)
+        fechas[filas] = _fechas(rng, plantilla.meses_por_tema.get(tema, todos), len(filas))
+    texto = fechas.astype(str).astype(object)
+    if len(plantilla.fechas_invalidas):
+        invalidas = np.flatnonzero(rng.random(n) < plantilla.fechas_invalidas.sum() / plantilla.filas)
+        texto[invalidas] = plantilla.fechas_invalidas.index.to_numpy()[
+            _muestrear(rng, plantilla.fechas_invalidas, len(invalidas))]
+    df[FECHA] = texto
+    return df[COLUMNAS]
+
+
+def generar_csv(destino, filas, plantilla=None, semilla=0):
+    """Escribe en ``destino`` un CSV de ``filas`` incidencias sintéticas, bloque a bloque."""
+    plantilla = plantilla or leer_plantilla()
+    rng = np.random.default_rng(semilla)
+    with open(destino, "w", encoding="utf-8", newline="") as f:
+        for inicio in range(0, filas, FILAS_POR_BLOQUE_SINTETICO):
+            bloque = generar_bloque(plantilla, min(FILAS_POR_BLOQUE_SINTETICO, filas - inicio), rng)
+            bloque.to_csv(f, sep=';', index=False, header=inicio == 0, lineterminator='\n')
+    return destino
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de incidencias sintéticas")
+    parser.add_argument("filas", type=filas_de, help="número de filas (admite 500k, 20M...)")
+    parser.add_argument("destino", help="CSV a escribir")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--plantilla", default=str(RUTA_INCIDENCIAS), help="CSV real del que salen las frecuencias")
+    args = parser.parse_args()
+
+    generar_csv(args.destino, args.filas, leer_plantilla(args.plantilla), args.semilla)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+import streamlit as st
+
+from cache_memoria import obtener_cache
+from procesos import PoolProcesos
+
+# ----------------------------
+# Trabajos largos en segundo plano
+# ----------------------------
+# Los ajustes caros (Prophet, Random Forest) se mandan a un pool de procesos
+# compartido por todas las sesiones del servidor, y la página sigue
+# dibujándose con lo que ya tiene. Un trabajo se identifica por su clave: si
+# otra sesión pide lo mismo mientras está en marcha, se une a ese trabajo en
+# lugar de lanzar otro. Al recoger un resultado, pasa a la caché de resultados
+# con la misma clave y el gestor lo suelta. Los terminados que nadie recoge (la
+# sesión se cerró) se conservan hasta MAX_TRABAJOS_TERMINADOS.
+PROCESOS_TRABAJOS = max(1, (os.cpu_count() or 1) - 1)
+MAX_TRABAJOS_TERMINADOS = 64
+SEGUNDOS_SONDEO = 1
+
+# Duraciones recientes de cada tipo de trabajo, para estimar el progreso
+DURACIONES_RECORDADAS = 20
+
+
+@dataclass
+class Trabajo:
+    """Trabajo enviado al pool: su futuro, una descripción y el instante de envío."""
+    futuro: object
+    descripcion: str
+    enviado: float = field(default_factory=time.monotonic)
+
+
+class GestorTrabajos:
+    """Pool de procesos con los trabajos indexados por clave (en curso y terminados)."""
+
+    def __init__(self, procesos=PROCESOS_TRABAJOS):
+        self._procesos = procesos
+        self._pool = None
+        # Reentrante: si el futuro ya ha terminado al añadirle el callback,
+        # _registrar_duracion se ejecuta dentro de enviar, con el bloqueo tomado
+        self._bloqueo = threading.RLock()
+        self._trabajos = OrderedDict()
+        self._duraciones = {}
+
+    def _enviar_al_pool(self, funcion, args):
+        if self._pool is None:
+            self._pool = PoolProcesos(max_workers=self._procesos)
+        try:
+            return self._pool.submit(funcion, *args)
+        except BrokenProcessPool:
+            # Un proceso murió (p. ej. por memoria): el pool no se recupera y se crea otro
+            self._pool = PoolProcesos(max_workers=self._procesos)
+            return self._pool.submit(funcion, *args)
+
+    def enviar(self, clave, funcion, *args, descripcion=''):
+        """Trabajo de ``clave``: el que ya existe (en curso o terminado) o uno nuevo con ``funcion(*args)``."""
+        with self._bloqueo:
+            trabajo = self._trabajos.get(clave)
+            if trabajo is None:
+                trabajo = Trabajo(self._enviar_al_pool(funcion, args), descripcion)
+                trabajo.futuro.add_done_callback(lambda futuro: self._registrar_duracion(clave[0], trabajo))
+                self._trabajos[clave] = trabajo
+                self._podar()
+            self._trabajos.move_to_end(clave)
+            return trabajo
+
+    def descartar(self, clave):
+        with self._bloqueo:
+            self._trabajos.pop(clave, None)
+
+    def _podar(self):
+        terminados = [clave for clave, trabajo in self._trabajos.items() if trabajo.futuro.done()]
+        for clave in terminados[:max(0, len(terminados) - MAX_TRABAJOS_TERMINADOS)]:
+            del self._trabajos[clave]
+
+    def _registrar_duracion(self, tipo, trabajo):
+        if trabajo.futuro.cancelled() or trabajo.futuro.exception() is not None:
+            return
+        # El callback corre en un hilo del pool mientras progreso() lee las duraciones
+        with self._bloqueo:
+            duraciones = self._duraciones.setdefault(tipo, deque(maxlen=DURACIONES_RECORDADAS))
+            duraciones.append(time.monotonic() - trabajo.enviado)
+
+    def progreso(self, clave):
+        """``(fracción estimada o None, texto)`` de un trabajo en curso."""
+        with self._bloqueo:
+            trabajo = self._trabajos.get(clave)
+            if trabajo is None:
+                return None, ""
+            delante = sum(1 for otro in self._trabajos.values()
+                          if otro.enviado < trabajo.enviado and not otro.futuro.done())
+            duraciones = list(self._duraciones.get(clave[0], ()))
+        transcurrido = time.monotonic() - trabajo.enviado
+        texto = f"{trabajo.descripcion}: {transcurrido:.0f} s"
+        if delante:
+            texto += f" ({delante} trabajos por delante)"
+        if not duraciones:
+            return None, texto
+        estimado = sum(duraciones) / len(duraciones) * (1 + delante // self._procesos)
+        return min(0.95, transcurrido / estimado), texto
+
+    def en_curso(self, clave):
+        trabajo = self._trabajos.get(clave)
+        return trabajo is not None and not trabajo.futuro.done()
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_gestor():
+    """Gestor de trabajos del servidor, compartido entre sesiones."""
+    return GestorTrabajos()
+
+
+# ------------ Uso desde las páginas ------------
+@st.experimental_fragment(run_every=SEGUNDOS_SONDEO)
+def _seguir_progreso(clave):
+    gestor = obtener_gestor()
+    if not gestor.en_curso(clave):
+        # Terminado: se vuelve a ejecutar la página entera para mostrar el resultado
+        st.rerun()
+    fraccion, texto = gestor.progreso(clave)
+    if fraccion is None:
+        st.caption(f"⏳ {texto}")
+    else:
+        st.progress(fraccion, text=f"⏳ {texto}")
+
+
+def resultado_en_segundo_plano(clave, funcion, *args, descripcion=''):
+    """Resultado de ``funcion(*args)`` si el trabajo ``clave`` ya ha terminado; si no, ``None``.
+
+    La primera petición lanza el trabajo y las siguientes (de cualquier sesión)
+    se unen a él. Mientras está en marcha se muestra su progreso y, al terminar,
+    la página se vuelve a ejecutar sola. Si falla, se muestra el error y se
+    descarta para que la siguiente petición lo reintente.
+    """
+    cache = obtener_cache()
+    encontrado, resultado = cache.obtener(clave)
+    if encontrado:
+        return resultado
+    gestor = obtener_gestor()
+    trabajo = gestor.enviar(clave, funcion, *args, descripcion=descripcion)
+    if not trabajo.futuro.done():
+        _seguir_progreso(clave)
+        return None
+    error = trabajo.futuro.exception()
+    if error is not None:
+        gestor.descartar(clave)
+        st.error(f"❌ {descripcion}: {error}")
+        return None
+    resultado = trabajo.futuro.result()
+    if cache.guardar(clave, resultado):
+        gestor.descartar(clave)
+    return resultado